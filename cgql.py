@@ -10,11 +10,21 @@ import json
 import sys
 import os
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, List, Optional
 
 # 本地会话文件路径
 SESSION_FILE = Path.home() / ".cgql_session.json"
 
+# 以 NDJSON 流式返回结果的命令 (命令, 子命令)
+STREAM_COMMANDS = {
+    ("query", "cycles-batch"),
+    ("query", "cb"),
+    ("q", "cycles-batch"),
+    ("q", "cb"),
+    ("scan", "cycles"),
+    ("scan", "c"),
+}
+
 
 class Session:
     """会话管理器 - 管理本地 token 和服务器地址。"""
@@ -53,6 +63,15 @@ class Session:
                 pass
 
 
+def _request_timeout(command: list) -> float:
+    """请求的超时时间(秒): 默认 30 秒,命令带 --timeout-ms 时再加上搜索预算。"""
+    try:
+        timeout_ms = int(command[command.index("--timeout-ms") + 1])
+    except (ValueError, IndexError):
+        return 30
+    return 30 + timeout_ms / 1000
+
+
 def send_request(session: Session, command: list) -> Dict[str, Any]:
     """发送请求到服务器。
 
@@ -70,9 +89,13 @@ def send_request(session: Session, command: list) -> Dict[str, Any]:
         cookies = {"token": session.token} if session.token else {}
         payload = {"command": command}
 
-        # 发送请求
+        # 发送请求(指定 --timeout-ms 时等待时间不少于搜索预算)
         response = requests.post(
-            url, json=payload, headers=headers, cookies=cookies, timeout=30
+            url,
+            json=payload,
+            headers=headers,
+            cookies=cookies,
+            timeout=_request_timeout(command),
         )
 
         # 处理响应
@@ -113,6 +136,90 @@ def send_request(session: Session, command: list) -> Dict[str, Any]:
         return {"status": "error", "message": f"Request failed: {str(e)}"}
 
 
+def is_stream_command(command: list) -> bool:
+    """判断命令是否以流式返回结果。"""
+    return tuple(command[:2]) in STREAM_COMMANDS
+
+
+def expand_start_file(command: list) -> list:
+    """把 --start-file 读取为 --starts 参数。
+
+    起点文件位于客户端本地,服务器无法读取,因此在发送前展开。
+    """
+    for i, token in enumerate(command):
+        if token == "--start-file" and i + 1 < len(command):
+            path, rest = command[i + 1], command[:i] + command[i + 2 :]
+            break
+        if token.startswith("--start-file="):
+            path, rest = token[len("--start-file="):], command[:i] + command[i + 1 :]
+            break
+    else:
+        return command
+    with open(path, "r") as f:
+        start_vids: List[str] = f.read().replace(",", " ").split()
+    return rest + ["--starts"] + start_vids
+
+
+def extract_output_option(command: list) -> tuple:
+    """取出 --output/-o 参数,返回 (剩余命令, 输出文件路径)。
+
+    输出文件写在客户端本地,不发送给服务器。
+    """
+    for i, token in enumerate(command):
+        if token in ("--output", "-o"):
+            if i + 1 < len(command):
+                return command[:i] + command[i + 2 :], command[i + 1]
+        elif token.startswith("--output="):
+            return command[:i] + command[i + 1 :], token[len("--output="):]
+        elif token.startswith("-o") and not token.startswith("--"):
+            return command[:i] + command[i + 1 :], token[2:]
+    return command, None
+
+
+def send_stream_request(session: Session, command: list) -> Iterator[Dict[str, Any]]:
+    """发送请求到服务器的流式接口,逐行产出结果。
+
+    Args:
+        session: 会话对象
+        command: 命令参数列表
+    """
+    try:
+        url = f"{session.host}/execute/stream"
+        cookies = {"token": session.token} if session.token else {}
+
+        # 批量任务耗时较长,只限制连接超时,不限制读取超时
+        with requests.post(
+            url,
+            json={"command": command},
+            cookies=cookies,
+            stream=True,
+            timeout=(30, None),
+        ) as response:
+            if response.status_code != 200:
+                try:
+                    yield response.json()
+                except Exception:
+                    yield {
+                        "status": "error",
+                        "message": f"HTTP {response.status_code}: {response.text}",
+                    }
+                return
+
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+
+    except requests.exceptions.ConnectionError:
+        yield {
+            "status": "error",
+            "message": f"Connection failed: Unable to reach server at {session.host}",
+        }
+    except requests.exceptions.Timeout:
+        yield {"status": "error", "message": "Request timeout"}
+    except Exception as e:
+        yield {"status": "error", "message": f"Request failed: {str(e)}"}
+
+
 def handle_special_commands(
     session: Session, command: list
 ) -> Optional[Dict[str, Any]]:
@@ -177,6 +284,32 @@ def main():
 
     command = sys.argv[1:]
 
+    # 流式命令: 每收到一个结果输出一行 JSON
+    if is_stream_command(command):
+        try:
+            command = expand_start_file(command)
+        except OSError as e:
+            print(json.dumps({"status": "error", "message": f"Failed to read start file: {e}"}))
+            sys.exit(1)
+
+        # 指定 --output 时结果行写入本地文件,终端只显示进度和汇总
+        command, output_path = extract_output_option(command)
+        output = open(output_path, "w") if output_path else None
+
+        failed = False
+        try:
+            for result in send_stream_request(session, command):
+                line = json.dumps(result, ensure_ascii=False)
+                if output is not None:
+                    output.write(line + "\n")
+                if output is None or result.get("type") != "cycle":
+                    print(line, flush=True)
+                failed = failed or result.get("status") == "error"
+        finally:
+            if output is not None:
+                output.close()
+        sys.exit(1 if failed else 0)
+
     # 处理特殊命令
     result = handle_special_commands(session, command)
 
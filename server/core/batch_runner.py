@@ -0,0 +1,347 @@
+"""批量起点搜索的工作池。
+
+数据库引擎(run_batch / iter_batch)共用一个进程级线程池,首次使用时创建,之后
+一直保留。数据库引擎的搜索主要等待 I/O,线程足以并发。
+
+内存引擎和全图扫描是纯 Python 计算,受 GIL 限制,线程池没有加速效果,改在工作
+进程中执行(run_batch_processes / iter_batch_processes): 调用方固定的图先导出为
+临时快照文件(snapshot.export_graph),每个工作进程用 read_snapshot 加载后放入
+自己的 graph_cache,再调用工厂函数构建搜索函数。工作进程用 forkserver 启动
+(不支持时用 spawn),不复制父进程的线程和锁: HTTP 服务本身是多线程的,直接 fork
+可能让子进程卡在其它线程持有的锁上(日志、连接池、graph_cache 的锁)。
+每个工作进程持有一份完整的图,不计入 graph_cache 的内存预算;启动进程和加载图有
+固定开销,默认按起点数决定进程数,起点较少时在当前线程中顺序执行。
+
+每个批次同时在途的起点不超过 workers 个,结果按完成顺序逐个产出,调用方可以
+边算边返回。一个起点可以产出多项结果(iter_batch): 工作线程(进程)逐项放入有界
+队列,调用方读取慢时随之等待,不需要先把一个起点的全部结果保存在内存中。
+调用方停止读取后不再提交新的起点,工作线程(进程)在放入下一项时退出。
+"""
+
+import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from server.core import graph_cache, snapshot
+from server.core.mem_graph import MemGraph
+
+
+Search = Callable[[int], Dict[str, Any]]
+
+# 在工作进程中调用,返回单个起点的搜索函数
+Factory = Callable[..., Callable[[int], Any]]
+
+# 进程级线程池的线程数,也是单个批次并发数的上限
+POOL_THREADS = 32
+
+# 每个并发的起点在队列中最多缓冲的结果项数
+ITEM_BUFFER = 256
+
+# 默认进程数按每个工作进程至少分到多少个起点计算
+PROCESS_MIN_STARTS = 64
+
+# 工作进程的启动方式
+START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# 调用方停止读取后等待工作进程退出的时间(秒),超时后强制结束
+STOP_TIMEOUT = 5
+
+# iter_batch 产出的起点完成标记
+FINISHED = object()
+
+# 工作进程发回的消息类型: (start_vid, 类型, 内容)
+_ITEM, _FINISHED, _FAILED = range(3)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _reset_after_fork() -> None:
+    """子进程不继承父进程的线程池。"""
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def default_processes(n_starts: int) -> int:
+    """内存引擎的默认进程数: 每个进程至少 PROCESS_MIN_STARTS 个起点,不超过 CPU 核数。"""
+    return max(1, min(default_workers(), n_starts // PROCESS_MIN_STARTS))
+
+
+def run_batch(
+    search: Search,
+    start_vids: List[int],
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """对每个起点执行 search,按完成顺序产出 (start_vid, 结果)。
+
+    Args:
+        search: 单个起点的搜索函数
+        start_vids: 起点列表
+        workers: 并发数,默认为 CPU 核数(不超过 POOL_THREADS); 1 表示在当前线程中顺序执行
+    """
+    for start_vid, result in iter_batch(lambda vid: (search(vid),), start_vids, workers):
+        if result is not FINISHED:
+            yield start_vid, result
+
+
+def iter_batch(
+    search: Callable[[int], Iterable[Any]],
+    start_vids: List[int],
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, Any]]:
+    """对每个起点执行产出多项结果的 search,逐项产出 (start_vid, 项)。
+
+    同一起点的项按 search 产出的顺序排列,全部产出后再产出 (start_vid, FINISHED)。
+    search 抛出的异常在调用方重新抛出。参数同 run_batch。
+    """
+    workers = min(workers or default_workers(), len(start_vids), POOL_THREADS)
+
+    if workers <= 1:
+        for start_vid in start_vids:
+            for item in search(start_vid):
+                yield start_vid, item
+            yield start_vid, FINISHED
+        return
+
+    results: "queue.Queue[Tuple[int, Any]]" = queue.Queue(maxsize=workers * ITEM_BUFFER)
+    stop = threading.Event()
+
+    def put(start_vid: int, item: Any) -> bool:
+        """放入一项,调用方已停止读取时返回 False。"""
+        while not stop.is_set():
+            try:
+                results.put((start_vid, item), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(start_vid: int) -> None:
+        if stop.is_set():
+            return
+        try:
+            for item in search(start_vid):
+                if not put(start_vid, item):
+                    return
+        except BaseException as e:
+            put(start_vid, _Failed(e))
+            return
+        put(start_vid, FINISHED)
+
+    executor = _get_executor()
+    pending = iter(start_vids)
+    running = 0
+    try:
+        for start_vid in islice(pending, workers):
+            executor.submit(run, start_vid)
+            running += 1
+        while running:
+            start_vid, item = results.get()
+            if isinstance(item, _Failed):
+                raise item.error
+            if item is FINISHED:
+                running -= 1
+                for next_vid in islice(pending, 1):
+                    executor.submit(run, next_vid)
+                    running += 1
+            yield start_vid, item
+    finally:
+        stop.set()
+
+
+def run_batch_processes(
+    graph: MemGraph,
+    factory: Factory,
+    args: Tuple[Any, ...],
+    start_vids: List[int],
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """在工作进程中对每个起点执行 factory(*args) 返回的搜索函数,按完成顺序产出 (start_vid, 结果)。
+
+    参数同 iter_batch_processes。
+    """
+    for start_vid, result in iter_batch_processes(
+        graph, _one_result, (factory, *args), start_vids, workers
+    ):
+        if result is not FINISHED:
+            yield start_vid, result
+
+
+def iter_batch_processes(
+    graph: MemGraph,
+    factory: Factory,
+    args: Tuple[Any, ...],
+    start_vids: List[int],
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[int, Any]]:
+    """在工作进程中对每个起点执行产出多项结果的搜索函数,逐项产出 (start_vid, 项)。
+
+    每个工作进程加载 graph 的副本并固定在自己的 graph_cache 中,然后调用
+    factory(*args) 构建搜索函数,factory 应通过 graph_cache.get_graph 取图。
+    factory、args 以及产出的项都要能 pickle(factory 必须是模块级函数)。
+    产出顺序和异常处理同 iter_batch。
+
+    Args:
+        graph: 调用方固定的内存图
+        factory: 构建单个起点搜索函数的工厂函数
+        args: factory 的参数
+        start_vids: 起点列表
+        workers: 进程数,默认按起点数计算(default_processes);不超过 1 时不启动进程,
+            在当前线程中调用 factory 顺序执行
+    """
+    if workers is None:
+        workers = default_processes(len(start_vids))
+    workers = min(workers, len(start_vids), POOL_THREADS)
+
+    if workers <= 1:
+        yield from iter_batch(factory(*args), start_vids, 1)
+        return
+
+    context = multiprocessing.get_context(START_METHOD)
+    tasks = context.Queue()
+    results = context.Queue(maxsize=workers * ITEM_BUFFER)
+    stop = context.Event()
+    processes = []
+    fd, path = tempfile.mkstemp(prefix="cgql-batch-", suffix=".snap")
+    os.close(fd)
+    try:
+        snapshot.export_graph(graph, path)
+        for _ in range(workers):
+            process = context.Process(
+                target=_process_worker,
+                args=(path, graph.username, factory, args, tasks, results, stop),
+                daemon=True,
+            )
+            process.start()
+            processes.append(process)
+
+        pending = iter(start_vids)
+        running = 0
+        for start_vid in islice(pending, workers):
+            tasks.put(start_vid)
+            running += 1
+        while running:
+            try:
+                start_vid, kind, item = results.get(timeout=1)
+            except queue.Empty:
+                # 工作进程只在收到结束标记后正常退出,此前退出说明进程异常终止
+                for process in processes:
+                    if process.exitcode is not None:
+                        raise RuntimeError(
+                            f"Search worker exited unexpectedly (exit code {process.exitcode})"
+                        )
+                continue
+            if kind == _FAILED:
+                raise item
+            if kind == _FINISHED:
+                running -= 1
+                for next_vid in islice(pending, 1):
+                    tasks.put(next_vid)
+                    running += 1
+                item = FINISHED
+            yield start_vid, item
+    finally:
+        stop.set()
+        for _ in processes:
+            tasks.put(None)
+        for process in processes:
+            process.join(STOP_TIMEOUT)
+            if process.exitcode is None:
+                process.terminate()
+                process.join()
+        tasks.close()
+        results.close()
+        os.remove(path)
+
+
+def _one_result(factory: Factory, *args: Any) -> Callable[[int], Tuple[Dict[str, Any]]]:
+    """把返回单个结果的搜索函数包装成产出一项的搜索函数(在工作进程中调用)。"""
+    search = factory(*args)
+    return lambda start_vid: (search(start_vid),)
+
+
+def _process_worker(
+    path: str,
+    username: str,
+    factory: Factory,
+    args: Tuple[Any, ...],
+    tasks: Any,
+    results: Any,
+    stop: Any,
+) -> None:
+    """工作进程: 加载导出的图,逐个领取起点执行搜索,收到 None 时退出。"""
+
+    def put(message: Tuple[Any, int, Any]) -> bool:
+        """放入一条消息,调用方已停止读取时返回 False。"""
+        while not stop.is_set():
+            try:
+                results.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        graph, _ = snapshot.read_snapshot(path)
+        graph_cache.put_graph(username, graph)
+        with graph_cache.pinned_graph(username):
+            search = factory(*args)
+            for start_vid in iter(tasks.get, None):
+                try:
+                    for item in search(start_vid):
+                        if not put((start_vid, _ITEM, item)):
+                            return
+                except Exception as e:
+                    put((start_vid, _FAILED, _picklable(e)))
+                    return
+                if not put((start_vid, _FINISHED, None)):
+                    return
+    except Exception as e:
+        put((None, _FAILED, _picklable(e)))
+    finally:
+        if stop.is_set():
+            # 调用方不再读取,退出时不等待队列中未发出的消息
+            results.cancel_join_thread()
+
+
+def _picklable(error: Exception) -> Exception:
+    """不能 pickle 的异常转换为 RuntimeError,保留类型名和信息。"""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+class _Failed:
+    """工作线程中 search 抛出的异常。"""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=POOL_THREADS, thread_name_prefix="cycle-batch"
+            )
+        return _executor
@@ -1,20 +1,56 @@
 """环路查找服务 - 基于双向BFS的高效环检测算法。
 
-使用OpenGauss的UNLOGGED临时表进行边扩展,支持时序过滤和各种约束条件。
+使用OpenGauss的UNLOGGED工作表进行边扩展,支持时序过滤和各种约束条件。
+
+工作表从 scratch_pool 租用,预先创建、反复使用,不再为每次搜索建表删表。
+整个搜索固定使用一个连接、在一个事务内执行(pinned_connection),结束时回滚事务,
+写入的数据随之丢弃。开始时用 DELETE 清空租到的工作表(回滚后表中只有死元组,
+通常没有可删的行),不使用 TRUNCATE: TRUNCATE 为每张表和索引分配新文件并更新
+pg_class,回滚后这些系统表的行版本成为死元组。各侧的当前深度由 FrontierSchedule
+在 Python 中记录,不需要向数据库查询。
+
+每一侧的每一层单独一张工作表(租约中的 fwd_<depth>/bwd_<depth>),扩展只读取上一层
+的表,不随已搜索的层数变大。预计较大的层(上一层的扩展代价即新层行数的上界,达到
+ANALYZE_MIN_ROWS)写入后立即 ANALYZE,优化器据此为下一层的扩展和碰撞检测选择连接
+方式(层很大时改用哈希连接);较小的层不做 ANALYZE(ANALYZE 写入 pg_statistic 和
+pg_class,回滚后留下死元组),由优化器按当前的实际页数估算行数。回滚在工作表中
+留下的死元组(被中止的事务插入的行)由 autovacuum 像普通表一样回收。语句按往返合并:
+- 准备阶段(清空工作表、反向距离表、初始化两侧起点、初始代价)一次往返;
+- 每扩展一层(写入新层 + 按需 ANALYZE + 新层大小与扩展代价 + 与另一侧各层的碰撞)
+  一次往返。
+
+查询语句都是参数化的模板(fetch_prepared): 过滤值、深度、起点和 limit 都作为参数
+传入,语句文本只随"哪些过滤条件存在"和层表名变化,在每个连接上 PREPARE 一次后
+反复 EXECUTE,省去每次的解析和改写;每个连接最多保留 MAX_PREPARED 条,租约的层表
+删除后引用它们的语句会被 DEALLOCATE。搜索事务内设置 plan_cache_mode 为
+force_custom_plan: 工作表的大小每次搜索、每一层都不同,扩展和碰撞语句每次执行都
+按当前的统计信息和页数重新规划,不使用按空表规划的通用计划。点和边明细语句只按
+主键查找,计划与参数无关,执行时设置 force_generic_plan,每个连接只规划一次。
+
+指定 timeout_ms 时每次往返的 statement_timeout 设为距期限的剩余时间,
+超时的语句由数据库取消,搜索返回已找到的环并标记 meta.truncated。
 """
 
 import time
-import uuid
 from typing import List, Dict, Any, Optional, Set, Tuple
 from server.opengauss.graph_dao import (
-    execute_ddl,
-    execute_dml,
-    fetch_all,
-    fetch_one,
+    fetch_prepared,
+    pinned_connection,
+    statement_deadline,
     Vertex,
     Edge,
     get_user_table_name,
 )
+from server.core import scratch_pool
+from server.core.deadline import Deadline
+from server.core.frontier_schedule import BACKWARD, FORWARD, FrontierSchedule
+
+
+# 扩展代价(新层行数的上界)达到该值时,写入新层后 ANALYZE 该层的工作表
+ANALYZE_MIN_ROWS = 20000
+
+# 只按主键查找的明细语句: 使用通用计划,每个连接只规划一次
+_GENERIC_PLAN = ("SET LOCAL plan_cache_mode = force_generic_plan", None)
 
 
 def query_cycles(
@@ -30,6 +66,7 @@ def query_cycles(
     limit: int = 10,
     allow_duplicate_vertices: bool = False,
     allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
     **db_kwargs: Any,
 ) -> Dict[str, Any]:
     """查询环路 - 使用双向BFS算法。
@@ -47,13 +84,14 @@ def query_cycles(
         limit: 最多返回的环数量
         allow_duplicate_vertices: 是否允许环中出现重复点(除起点外)
         allow_duplicate_edges: 是否允许环中出现重复边
+        timeout_ms: 搜索时间预算(毫秒),到期后返回已找到的环并标记 meta.truncated
         **db_kwargs: 数据库连接参数
 
     Returns:
         Dict: 包含status, found, data(环列表), meta等信息
     """
     start_time = time.time()
-    session_id = str(uuid.uuid4())
+    deadline = Deadline(timeout_ms)
 
     try:
         # 1. 验证起始点存在
@@ -71,35 +109,37 @@ def query_cycles(
                 "message": "Start vertex does not match filters",
             }
 
-        # 3. 执行双向BFS搜索
-        cycles = _bidirectional_bfs(
-            start_vid=start_vid,
-            max_depth=max_depth,
-            username=username,
-            direction=direction,
-            vertex_filter_v_types=vertex_filter_v_types,
-            vertex_filter_min_balance=vertex_filter_min_balance,
-            edge_filter_e_types=edge_filter_e_types,
-            edge_filter_min_amount=edge_filter_min_amount,
-            edge_filter_max_amount=edge_filter_max_amount,
-            limit=limit,
-            allow_duplicate_vertices=allow_duplicate_vertices,
-            allow_duplicate_edges=allow_duplicate_edges,
-            session_id=session_id,
-            **db_kwargs,
-        )
+        # 3. 执行双向BFS搜索: 租用工作表(每侧深度 0..max_depth),
+        #    固定一个连接和事务,期间的 SQL 受期限约束
+        with scratch_pool.lease(max_depth + 1, **db_kwargs) as scratch, pinned_connection(
+            **db_kwargs
+        ), statement_deadline(deadline.expires_at):
+            cycles, schedule = _bidirectional_bfs(
+                scratch=scratch,
+                start_vid=start_vid,
+                max_depth=max_depth,
+                username=username,
+                direction=direction,
+                vertex_filter_v_types=vertex_filter_v_types,
+                vertex_filter_min_balance=vertex_filter_min_balance,
+                edge_filter_e_types=edge_filter_e_types,
+                edge_filter_min_amount=edge_filter_min_amount,
+                edge_filter_max_amount=edge_filter_max_amount,
+                limit=limit,
+                allow_duplicate_vertices=allow_duplicate_vertices,
+                allow_duplicate_edges=allow_duplicate_edges,
+                deadline=deadline,
+                **db_kwargs,
+            )
 
         # 4. 构造返回结果
         execution_time = int((time.time() - start_time) * 1000)
+        meta = {"execution_time_ms": execution_time, **schedule.meta()}
 
         if not cycles:
-            return {
-                "status": "success",
-                "found": False,
-                "meta": {"execution_time_ms": execution_time},
-            }
+            return {"status": "success", "found": False, "meta": meta}
 
-        # 5. 获取环的详细信息
+        # 5. 获取环的详细信息(搜索事务可能已因超时中止,这里重新检出连接)
         cycle_data = []
         for cycle_path in cycles:
             vertices_data, edges_data = _get_cycle_details(cycle_path, username, **db_kwargs)
@@ -110,17 +150,15 @@ def query_cycles(
             "found": True,
             "count": len(cycle_data),
             "data": cycle_data,
-            "meta": {"execution_time_ms": execution_time},
+            "meta": meta,
         }
 
     except Exception as e:
         return {"status": "error", "message": f"Cycle query failed: {e}"}
-    finally:
-        # 清理临时表
-        _cleanup_temp_tables(session_id, **db_kwargs)
 
 
 def _bidirectional_bfs(
+    scratch: scratch_pool.Lease,
     start_vid: int,
     max_depth: int,
     username: str,
@@ -133,128 +171,292 @@ def _bidirectional_bfs(
     limit: int,
     allow_duplicate_vertices: bool,
     allow_duplicate_edges: bool,
-    session_id: str,
+    deadline: Optional[Deadline] = None,
     **db_kwargs: Any,
-) -> List[List[Tuple[int, int, int]]]:
+) -> Tuple[List[List[Tuple[int, int, int]]], FrontierSchedule]:
     """双向BFS核心算法。
 
+    每一步扩展当前层度数之和较小的一侧,两侧深度之和不超过 max_depth。
+    搜索前先反向BFS计算每个点回到起点的最少边数,正向扩展时丢弃剩余深度
+    不足以回到起点的点;时序搜索时还丢弃到达后无法再按时序离开或回到起点的点。
+
+    deadline 到期(语句被数据库取消,或两步之间发现已到期)时停止搜索,
+    返回已找到的环,schedule.truncated 为 True。
+
     Returns:
-        List[List[Tuple]]: 环路列表,每个环路是(src_vid, dst_vid, eid)的列表
+        Tuple: (环路列表, 扩展调度记录),每个环路是(src_vid, dst_vid, eid)的列表
     """
-    # 创建正向和反向工作表
-    fwd_table = f"fwd_{session_id.replace('-', '_')}"
-    bwd_table = f"bwd_{session_id.replace('-', '_')}"
+    schedule = FrontierSchedule(max_depth)
+    cycles = []
+    seen_cycles = set()  # 用于环去重
 
-    _create_temp_table(fwd_table, **db_kwargs)
-    _create_temp_table(bwd_table, **db_kwargs)
+    try:
+        # 准备阶段一次往返: 清空工作表、反向距离表、初始化两侧起点,
+        # 并取起点最晚的入边时间和两侧第一层的扩展代价
+        fwd_start = scratch.layer_table(FORWARD, 0)
+        bwd_start = scratch.layer_table(BACKWARD, 0)
+        setup = [
+            # 只在本次搜索的事务内生效,回滚后恢复
+            ("SET LOCAL plan_cache_mode = force_custom_plan", None),
+            *[(f"DELETE FROM {table}", None) for table in scratch.tables()],
+            *_build_distance_table_sql(
+                scratch.dist_table,
+                start_vid,
+                max_depth,
+                username,
+                edge_filter_e_types,
+                edge_filter_min_amount,
+                edge_filter_max_amount,
+                vertex_filter_v_types,
+                vertex_filter_min_balance,
+            ),
+            # 初始化起点(occur_time设为0表示起点)
+            _init_search_sql(fwd_start, start_vid),
+            _init_search_sql(bwd_start, start_vid),
+            _setup_result_sql(fwd_start, bwd_start, start_vid, username),
+        ]
+        latest_in, fwd_cost, bwd_cost = fetch_prepared(setup, **db_kwargs)[0]
+
+        # 时序环的最后一条边必须晚于之前所有边: 起点最晚的入边时间是所有边的上界
+        latest_return = None
+        if direction == "forward":
+            latest_return = latest_in
+            if latest_return is None:
+                return [], schedule
+
+        while len(cycles) < limit:
+            side = schedule.next_side(fwd_cost, bwd_cost)
+            if side is None:
+                break
+            if deadline is not None and deadline.expired():
+                schedule.truncate()
+                break
+
+            depth = schedule.depth[side]
+            layer_table = scratch.layer_table(side, depth + 1)
+            if side == FORWARD:
+                # 正向扩展
+                expand = _expand_forward_sql(
+                    scratch.layer_table(FORWARD, depth),
+                    layer_table,
+                    depth,
+                    username,
+                    direction,
+                    edge_filter_e_types,
+                    edge_filter_min_amount,
+                    edge_filter_max_amount,
+                    vertex_filter_v_types,
+                    vertex_filter_min_balance,
+                    scratch.dist_table,
+                    max_depth,
+                    latest_return,
+                )
+            else:
+                # 反向扩展
+                expand = _expand_backward_sql(
+                    scratch.layer_table(BACKWARD, depth),
+                    layer_table,
+                    username,
+                    direction,
+                    edge_filter_e_types,
+                    edge_filter_min_amount,
+                    edge_filter_max_amount,
+                    vertex_filter_v_types,
+                    vertex_filter_min_balance,
+                )
+
+            # 一次往返: 扩展新层(预计较大时随即 ANALYZE),
+            # 取新层大小、新层的扩展代价和与另一侧各层的碰撞
+            other = BACKWARD if side == FORWARD else FORWARD
+            statements = [expand]
+            if (fwd_cost if side == FORWARD else bwd_cost) >= ANALYZE_MIN_ROWS:
+                statements.append((f"ANALYZE {layer_table}", None))
+            statements.append(
+                _layer_result_sql(
+                    layer_table,
+                    [scratch.layer_table(other, d) for d in range(schedule.depth[other] + 1)],
+                    side,
+                    start_vid,
+                    username,
+                    limit - len(cycles),
+                )
+            )
+            rows = fetch_prepared(statements, **db_kwargs)
+            count, cost = rows[0][0], rows[0][1]
+
+            if count == 0:
+                schedule.exhaust(side)
+                continue
+            schedule.advance(side)
+
+            # 检查碰撞: 只用新扩展出的一层与另一方向的表做连接
+            new_cycles = _detect_cycles(
+                [row[2:] for row in rows if row[2] is not None],
+                start_vid,
+                allow_duplicate_vertices,
+                allow_duplicate_edges,
+                limit - len(cycles),
+                seen_cycles,
+            )
+            cycles.extend(new_cycles)
+
+            if side == FORWARD:
+                fwd_cost = cost
+            else:
+                bwd_cost = cost
+    except Exception:
+        # 语句因期限到期被数据库取消: 丢弃正在执行的一步,返回已找到的环
+        if deadline is None or not deadline.expired():
+            raise
+        schedule.truncate()
+
+    return cycles, schedule
+
+
+class _Params:
+    """按出现顺序收集预备语句的参数,调用时返回对应的 $n 占位符。"""
+
+    def __init__(self) -> None:
+        self.values: List[Any] = []
+
+    def __call__(self, value: Any, cast: str = "") -> str:
+        self.values.append(value)
+        return f"${len(self.values)}{cast}"
+
+
+Statement = Tuple[str, Optional[Tuple]]
+
+
+def _filter_conditions(
+    params: _Params,
+    username: str,
+    vertex_col: str,
+    edge_filter_e_types: Optional[List[str]],
+    edge_filter_min_amount: Optional[int],
+    edge_filter_max_amount: Optional[int],
+    vertex_filter_v_types: Optional[List[str]],
+    vertex_filter_min_balance: Optional[int],
+) -> Tuple[str, List[str]]:
+    """边 e 和点(e 的 vertex_col 端)的过滤条件,返回 (点表连接子句, 条件列表)。
 
-    # 初始化起点(occur_time设为0表示起点)
-    _init_search(fwd_table, start_vid, **db_kwargs)
-    _init_search(bwd_table, start_vid, **db_kwargs)
+    条件只包含占位符,只有"哪些过滤条件存在"会改变语句文本。
+    """
+    vertex_table_name, _ = get_user_table_name(username)
+    conditions = []
 
-    cycles = []
-    seen_cycles = set()  # 用于环去重
-    current_depth = 1
-
-    while current_depth <= max_depth // 2 and len(cycles) < limit:
-        # 正向扩展
-        fwd_count = _expand_forward(
-            fwd_table,
-            username,
-            direction,
-            edge_filter_e_types,
-            edge_filter_min_amount,
-            edge_filter_max_amount,
-            vertex_filter_v_types,
-            vertex_filter_min_balance,
-            **db_kwargs,
-        )
+    # 边过滤条件
+    if edge_filter_e_types:
+        conditions.append(f"e.e_type = ANY({params(list(edge_filter_e_types), '::TEXT[]')})")
 
-        if fwd_count == 0:
-            break
-
-        # 检查碰撞
-        new_cycles = _detect_cycles(
-            fwd_table,
-            bwd_table,
-            start_vid,
-            username,
-            allow_duplicate_vertices,
-            allow_duplicate_edges,
-            limit - len(cycles),
-            seen_cycles,
-            **db_kwargs,
-        )
-        cycles.extend(new_cycles)
-
-        if len(cycles) >= limit:
-            break
-
-        # 反向扩展
-        bwd_count = _expand_backward(
-            bwd_table,
-            username,
-            direction,
-            edge_filter_e_types,
-            edge_filter_min_amount,
-            edge_filter_max_amount,
-            vertex_filter_v_types,
-            vertex_filter_min_balance,
-            **db_kwargs,
-        )
+    if edge_filter_min_amount is not None:
+        conditions.append(f"e.amount >= {params(edge_filter_min_amount)}")
 
-        if bwd_count == 0:
-            break
-
-        # 再次检查碰撞
-        new_cycles = _detect_cycles(
-            fwd_table,
-            bwd_table,
-            start_vid,
-            username,
-            allow_duplicate_vertices,
-            allow_duplicate_edges,
-            limit - len(cycles),
-            seen_cycles,
-            **db_kwargs,
-        )
-        cycles.extend(new_cycles)
+    if edge_filter_max_amount is not None:
+        conditions.append(f"e.amount <= {params(edge_filter_max_amount)}")
 
-        current_depth += 1
+    # 点过滤条件
+    vertex_join = ""
+    if vertex_filter_v_types or vertex_filter_min_balance is not None:
+        vertex_join = f"JOIN {vertex_table_name} v ON v.vid = e.{vertex_col}"
+        if vertex_filter_v_types:
+            conditions.append(
+                f"v.v_type = ANY({params(list(vertex_filter_v_types), '::TEXT[]')})"
+            )
+        if vertex_filter_min_balance is not None:
+            conditions.append(f"v.balance >= {params(vertex_filter_min_balance)}")
+
+    return vertex_join, conditions
 
-    return cycles
 
+def _frontier_cost_sql(table_name: str, username: str, outgoing: bool) -> str:
+    """估计扩展一层的代价的 SQL: 该层所有点的出度(或入度)之和。"""
+    _, edge_table_name = get_user_table_name(username)
+    join_col = "src_vid" if outgoing else "dst_vid"
+    return f"""
+        SELECT COUNT(*) FROM {table_name} t
+        JOIN {edge_table_name} e ON e.{join_col} = t.vid
+        """
 
-def _create_temp_table(table_name: str, **db_kwargs: Any) -> None:
-    """创建UNLOGGED临时表用于BFS扩展。"""
+
+def _setup_result_sql(
+    fwd_table: str, bwd_table: str, start_vid: int, username: str
+) -> Statement:
+    """准备阶段的结果: 起点最晚的入边时间(没有入边时为 NULL)和两侧第一层的扩展代价。"""
+    _, edge_table_name = get_user_table_name(username)
     sql = f"""
-    CREATE UNLOGGED TABLE {table_name} (
-        vid BIGINT NOT NULL,
-        parent_vid BIGINT,
-        occur_time BIGINT NOT NULL,
-        eid BIGINT,
-        depth INT NOT NULL,
-        path_vids BIGINT[],
-        path_eids BIGINT[]
-    ) WITH (ORIENTATION = ROW);
+    SELECT (SELECT MAX(occur_time) FROM {edge_table_name} WHERE dst_vid = $1),
+           ({_frontier_cost_sql(fwd_table, username, True)}),
+           ({_frontier_cost_sql(bwd_table, username, False)})
     """
-    execute_ddl(sql, **db_kwargs)
+    return sql, (start_vid,)
 
-    # 创建索引加速JOIN
-    execute_ddl(f"CREATE INDEX idx_{table_name}_vid ON {table_name}(vid);", **db_kwargs)
 
+def _build_distance_table_sql(
+    table_name: str,
+    start_vid: int,
+    max_depth: int,
+    username: str,
+    edge_filter_e_types: Optional[List[str]],
+    edge_filter_min_amount: Optional[int],
+    edge_filter_max_amount: Optional[int],
+    vertex_filter_v_types: Optional[List[str]],
+    vertex_filter_min_balance: Optional[int],
+) -> List[Statement]:
+    """从起点沿入边反向BFS,记录每个点回到起点的最少边数(不超过 max_depth)的语句。
 
-def _init_search(table_name: str, start_vid: int, **db_kwargs: Any) -> None:
-    """初始化搜索表,插入起点。"""
+    只经过满足过滤条件的边和点,不考虑时序,因此是回到起点所需边数的下界。
+    每一层一条 INSERT(同一模板),随准备阶段一次发出;某层为空后后续各层也不会
+    插入任何行。
+    """
+    _, edge_table_name = get_user_table_name(username)
+
+    statements: List[Statement] = [
+        (f"INSERT INTO {table_name} (vid, dist) VALUES ($1, 0)", (start_vid,)),
+    ]
+
+    params = _Params()
+    dist = params(0, "::INT")
+    vertex_join, conditions = _filter_conditions(
+        params,
+        username,
+        "src_vid",
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+    )
+    where_clause = " AND ".join(conditions) if conditions else "1=1"
     sql = f"""
-    INSERT INTO {table_name} (vid, parent_vid, occur_time, eid, depth, path_vids, path_eids)
-    VALUES (%s, NULL, 0, NULL, 0, ARRAY[%s]::BIGINT[], ARRAY[]::BIGINT[]);
+        INSERT INTO {table_name} (vid, dist)
+        SELECT DISTINCT e.src_vid, {dist} + 1
+        FROM {table_name} r
+        JOIN {edge_table_name} e ON e.dst_vid = r.vid
+        {vertex_join}
+        WHERE r.dist = {dist}
+          AND {where_clause}
+          AND NOT EXISTS (SELECT 1 FROM {table_name} x WHERE x.vid = e.src_vid)
+        """
+
+    # 起点自身距离为 0,最后一层的点距离为 max_depth - 1 即可覆盖所有可用的点
+    for level in range(max_depth - 1):
+        statements.append((sql, (level, *params.values[1:])))
+    return statements
+
+
+def _init_search_sql(table_name: str, start_vid: int) -> Statement:
+    """初始化搜索表、插入起点的语句。"""
+    sql = f"""
+    INSERT INTO {table_name} (vid, parent_vid, occur_time, eid, path_vids, path_eids)
+    VALUES ($1, NULL, 0, NULL, ARRAY[$1]::BIGINT[], ARRAY[]::BIGINT[])
     """
-    execute_dml(sql, (start_vid, start_vid), **db_kwargs)
+    return sql, (start_vid,)
 
 
-def _expand_forward(
+def _expand_forward_sql(
+    prev_table: str,
     table_name: str,
+    depth: int,
     username: str,
     direction: str,
     edge_filter_e_types: Optional[List[str]],
@@ -262,66 +464,64 @@ def _expand_forward(
     edge_filter_max_amount: Optional[int],
     vertex_filter_v_types: Optional[List[str]],
     vertex_filter_min_balance: Optional[int],
-    **db_kwargs: Any,
-) -> int:
-    """正向扩展一层。"""
-    vertex_table_name, edge_table_name = get_user_table_name(username)
-    conditions = []
+    dist_table: str,
+    max_depth: int,
+    latest_return: Optional[int],
+) -> Statement:
+    """正向扩展一层的语句: 从深度为 depth 的层 prev_table 出发,写入新层 table_name。
+
+    只保留在 dist_table 中、且剩余深度足以回到起点的点。时序搜索时,
+    边的时间必须早于 latest_return(起点最晚的入边时间),且目标点必须还有
+    更晚的出边(按 (src_vid, occur_time) 索引做 EXISTS 探测)。
+    """
+    _, edge_table_name = get_user_table_name(username)
+    params = _Params()
+    conditions = [f"r.dist <= {params(max_depth - depth - 1)}"]
 
     # 时序条件
     if direction == "forward":
         conditions.append("e.occur_time > t.occur_time")
+        if latest_return is not None:
+            conditions.append(f"e.occur_time < {params(latest_return)}")
+        conditions.append(
+            f"EXISTS (SELECT 1 FROM {edge_table_name} n "
+            f"WHERE n.src_vid = e.dst_vid AND n.occur_time > e.occur_time)"
+        )
 
-    # 边过滤条件
-    if edge_filter_e_types:
-        e_types_str = "'" + "','".join(edge_filter_e_types) + "'"
-        conditions.append(f"e.e_type IN ({e_types_str})")
-
-    if edge_filter_min_amount is not None:
-        conditions.append(f"e.amount >= {edge_filter_min_amount}")
-
-    if edge_filter_max_amount is not None:
-        conditions.append(f"e.amount <= {edge_filter_max_amount}")
-
-    # 点过滤条件
-    vertex_join = ""
-    if vertex_filter_v_types or vertex_filter_min_balance is not None:
-        vertex_join = f"JOIN {vertex_table_name} v ON v.vid = e.dst_vid"
-        if vertex_filter_v_types:
-            v_types_str = "'" + "','".join(vertex_filter_v_types) + "'"
-            conditions.append(f"v.v_type IN ({v_types_str})")
-        if vertex_filter_min_balance is not None:
-            conditions.append(f"v.balance >= {vertex_filter_min_balance}")
-
-    where_clause = " AND ".join(conditions) if conditions else "1=1"
-
-    # 获取当前最大深度
-    max_depth_result = fetch_one(f"SELECT MAX(depth) FROM {table_name}", **db_kwargs)
-    assert max_depth_result is not None
-    current_max_depth = max_depth_result[0] if max_depth_result[0] is not None else 0
+    vertex_join, filters = _filter_conditions(
+        params,
+        username,
+        "dst_vid",
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+    )
+    where_clause = " AND ".join(conditions + filters)
 
     sql = f"""
-    INSERT INTO {table_name} (vid, parent_vid, occur_time, eid, depth, path_vids, path_eids)
+    INSERT INTO {table_name} (vid, parent_vid, occur_time, eid, path_vids, path_eids)
     SELECT 
         e.dst_vid,
         t.vid,
         e.occur_time,
         e.eid,
-        t.depth + 1,
         t.path_vids || e.dst_vid,
         t.path_eids || e.eid
-    FROM {table_name} t
+    FROM {prev_table} t
     JOIN {edge_table_name} e ON e.src_vid = t.vid
+    JOIN {dist_table} r ON r.vid = e.dst_vid
     {vertex_join}
-    WHERE t.depth = {current_max_depth}
-      AND {where_clause}
-      AND NOT (e.dst_vid = ANY(t.path_vids));
+    WHERE {where_clause}
+      AND NOT (e.dst_vid = ANY(t.path_vids))
     """
 
-    return execute_dml(sql, **db_kwargs)
+    return sql, tuple(params.values)
 
 
-def _expand_backward(
+def _expand_backward_sql(
+    prev_table: str,
     table_name: str,
     username: str,
     direction: str,
@@ -330,93 +530,119 @@ def _expand_backward(
     edge_filter_max_amount: Optional[int],
     vertex_filter_v_types: Optional[List[str]],
     vertex_filter_min_balance: Optional[int],
-    **db_kwargs: Any,
-) -> int:
-    """反向扩展一层。"""
-    vertex_table_name, edge_table_name = get_user_table_name(username)
+) -> Statement:
+    """反向扩展一层的语句: 从上一层 prev_table 出发,写入新层 table_name。"""
+    _, edge_table_name = get_user_table_name(username)
+    params = _Params()
     conditions = []
 
     # 时序条件(反向搜索时间更早)
     if direction == "forward":
-        conditions.append("e.occur_time < t.occur_time OR t.occur_time = 0")
-
-    # 边过滤条件
-    if edge_filter_e_types:
-        e_types_str = "'" + "','".join(edge_filter_e_types) + "'"
-        conditions.append(f"e.e_type IN ({e_types_str})")
-
-    if edge_filter_min_amount is not None:
-        conditions.append(f"e.amount >= {edge_filter_min_amount}")
-
-    if edge_filter_max_amount is not None:
-        conditions.append(f"e.amount <= {edge_filter_max_amount}")
-
-    # 点过滤条件
-    vertex_join = ""
-    if vertex_filter_v_types or vertex_filter_min_balance is not None:
-        vertex_join = f"JOIN {vertex_table_name} v ON v.vid = e.src_vid"
-        if vertex_filter_v_types:
-            v_types_str = "'" + "','".join(vertex_filter_v_types) + "'"
-            conditions.append(f"v.v_type IN ({v_types_str})")
-        if vertex_filter_min_balance is not None:
-            conditions.append(f"v.balance >= {vertex_filter_min_balance}")
-
+        conditions.append("(e.occur_time < t.occur_time OR t.occur_time = 0)")
+
+    vertex_join, filters = _filter_conditions(
+        params,
+        username,
+        "src_vid",
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+    )
+    conditions += filters
     where_clause = " AND ".join(conditions) if conditions else "1=1"
 
-    # 获取当前最大深度
-    max_depth_result = fetch_one(f"SELECT MAX(depth) FROM {table_name}", **db_kwargs)
-    assert max_depth_result is not None
-    current_max_depth = max_depth_result[0] if max_depth_result[0] is not None else 0
-
     sql = f"""
-    INSERT INTO {table_name} (vid, parent_vid, occur_time, eid, depth, path_vids, path_eids)
+    INSERT INTO {table_name} (vid, parent_vid, occur_time, eid, path_vids, path_eids)
     SELECT 
         e.src_vid,
         t.vid,
         e.occur_time,
         e.eid,
-        t.depth + 1,
         t.path_vids || e.src_vid,
         t.path_eids || e.eid
-    FROM {table_name} t
+    FROM {prev_table} t
     JOIN {edge_table_name} e ON e.dst_vid = t.vid
     {vertex_join}
-    WHERE t.depth = {current_max_depth}
-      AND {where_clause}
-      AND NOT (e.src_vid = ANY(t.path_vids));
+    WHERE {where_clause}
+      AND NOT (e.src_vid = ANY(t.path_vids))
     """
 
-    return execute_dml(sql, **db_kwargs)
+    return sql, tuple(params.values)
 
 
-def _detect_cycles(
-    fwd_table: str,
-    bwd_table: str,
+def _layer_result_sql(
+    layer_table: str,
+    other_tables: List[str],
+    expanded_side: str,
     start_vid: int,
     username: str,
+    remaining_limit: int,
+) -> Statement:
+    """刚扩展出的一层的结果语句,紧跟在写入该层的语句之后执行。
+
+    每行依次为: 新层的行数、新层的扩展代价(见 _frontier_cost_sql),以及一个碰撞
+    (meet_vid, fwd_vids, fwd_eids, bwd_vids, bwd_eids);没有碰撞时只有一行,
+    碰撞各列为 NULL。
+
+    Args:
+        layer_table: 刚扩展出的层,只有该层参与连接,
+                     更早的层之间的碰撞在它们扩展时已经检测过
+        other_tables: 另一方向已扩展的各层
+        expanded_side: 刚扩展的方向, "fwd" 或 "bwd"
+    """
+    other = " UNION ALL ".join(
+        f"SELECT vid, path_vids, path_eids FROM {table}" for table in other_tables
+    )
+    if expanded_side == FORWARD:
+        f_source, b_source = layer_table, f"({other})"
+    else:
+        f_source, b_source = f"({other})", layer_table
+
+    sql = f"""
+    SELECT
+        s.layer_size,
+        s.cost,
+        c.meet_vid,
+        c.fwd_vids,
+        c.fwd_eids,
+        c.bwd_vids,
+        c.bwd_eids
+    FROM (
+        SELECT
+            (SELECT COUNT(*) FROM {layer_table}) AS layer_size,
+            ({_frontier_cost_sql(layer_table, username, expanded_side == FORWARD)}) AS cost
+    ) s
+    LEFT JOIN (
+        SELECT
+            f.vid as meet_vid,
+            f.path_vids as fwd_vids,
+            f.path_eids as fwd_eids,
+            b.path_vids as bwd_vids,
+            b.path_eids as bwd_eids
+        FROM {f_source} f
+        JOIN {b_source} b ON f.vid = b.vid
+        WHERE f.vid != $1
+        LIMIT $2
+    ) c ON TRUE
+    """
+    return sql, (start_vid, remaining_limit * 5)
+
+
+def _detect_cycles(
+    collisions: List[Tuple],
+    start_vid: int,
     allow_duplicate_vertices: bool,
     allow_duplicate_edges: bool,
     remaining_limit: int,
     seen_cycles: Set[Tuple[int, ...]],
-    **db_kwargs: Any,
 ) -> List[List[Tuple[int, int, int]]]:
-    """检测两个方向的碰撞,找出环路。"""
-    # 找到碰撞点
-    sql = f"""
-    SELECT 
-        f.vid as meet_vid,
-        f.path_vids as fwd_vids,
-        f.path_eids as fwd_eids,
-        b.path_vids as bwd_vids,
-        b.path_eids as bwd_eids
-    FROM {fwd_table} f
-    JOIN {bwd_table} b ON f.vid = b.vid
-    WHERE f.vid != {start_vid}
-    LIMIT {remaining_limit * 5};
-    """
-
-    collisions = fetch_all(sql, **db_kwargs)
+    """由新扩展的一层与另一方向的碰撞构造环路。
 
+    Args:
+        collisions: 碰撞列表,每项为 (meet_vid, fwd_vids, fwd_eids, bwd_vids, bwd_eids)
+    """
     cycles = []
     for collision in collisions:
         meet_vid, fwd_vids, fwd_eids, bwd_vids, bwd_eids = collision
@@ -507,16 +733,13 @@ def _get_cycle_details(
         eids.append(eid)
 
     # 查询点信息
-    vids_list = list(vids)
-    vids_str = ",".join(map(str, vids_list))
-    vertices_sql = f"SELECT vid, v_type, create_time, balance FROM {vertex_table_name} WHERE vid IN ({vids_str})"
-    vertices_data = fetch_all(vertices_sql, **db_kwargs)
+    vertices_sql = f"SELECT vid, v_type, create_time, balance FROM {vertex_table_name} WHERE vid = ANY($1::BIGINT[])"
+    vertices_data = fetch_prepared([_GENERIC_PLAN, (vertices_sql, (list(vids),))], **db_kwargs)
     vertices = [Vertex.from_tuple(v).to_dict() for v in vertices_data]
 
     # 查询边信息
-    eids_str = ",".join(map(str, eids))
-    edges_sql = f"SELECT eid, src_vid, dst_vid, amount, occur_time, e_type FROM {edge_table_name} WHERE eid IN ({eids_str})"
-    edges_data = fetch_all(edges_sql, **db_kwargs)
+    edges_sql = f"SELECT eid, src_vid, dst_vid, amount, occur_time, e_type FROM {edge_table_name} WHERE eid = ANY($1::BIGINT[])"
+    edges_data = fetch_prepared([_GENERIC_PLAN, (edges_sql, (eids,))], **db_kwargs)
     edges = [Edge.from_tuple(e).to_dict() for e in edges_data]
 
     return vertices, edges
@@ -525,12 +748,9 @@ def _get_cycle_details(
 def _get_vertex(vid: int, username: str, **db_kwargs: Any) -> Optional[Vertex]:
     """获取点信息。"""
     vertex_table_name, _ = get_user_table_name(username)
-    result = fetch_one(
-        f"SELECT vid, v_type, create_time, balance FROM {vertex_table_name} WHERE vid = %s",
-        (vid,),
-        **db_kwargs,
-    )
-    return Vertex.from_tuple(result) if result else None
+    sql = f"SELECT vid, v_type, create_time, balance FROM {vertex_table_name} WHERE vid = $1"
+    rows = fetch_prepared([_GENERIC_PLAN, (sql, (vid,))], **db_kwargs)
+    return Vertex.from_tuple(rows[0]) if rows else None
 
 
 def _vertex_matches_filter(
@@ -544,18 +764,6 @@ def _vertex_matches_filter(
     return True
 
 
-def _cleanup_temp_tables(session_id: str, **db_kwargs: Any) -> None:
-    """清理临时表。"""
-    safe_session = session_id.replace("-", "_")
-    tables = [f"fwd_{safe_session}", f"bwd_{safe_session}"]
-
-    for table in tables:
-        try:
-            execute_ddl(f"DROP TABLE IF EXISTS {table};", **db_kwargs)
-        except Exception:
-            pass  # 忽略清理错误
-
-
 def _get_cycle_signature(cycle: List[Tuple[int, int, int]]) -> Tuple[int, ...]:
     """生成环路的唯一签名，用于去重。
     
@@ -6,7 +6,7 @@
 import argparse
 import json
 import sys
-from typing import List, Dict, Any, Callable, Optional
+from typing import List, Dict, Any, Callable, Iterator, Optional
 from dataclasses import dataclass, field
 
 from server.core.auth_service import register_user, login_user
@@ -16,11 +16,19 @@ from server.core.graph_service import (
     insert_vertex,
     insert_edge,
     query_cycles,
+    query_cycles_batch,
+    iter_cycles_batch,
+    scan_cycles,
+    query_scc,
     delete_vertex,
     delete_edge,
     update_vertex,
     update_edge,
+    CYCLE_ENGINES,
 )
+from server.core.cycle_planner import AUTO
+from server.core.cycle_topk import ORDER_BY
+from server.core.snapshot import build_snapshot
 
 
 # ==================== 命令配置数据结构 ====================
@@ -50,6 +58,7 @@ class Command:
     help: str = ""  # 帮助信息
     arguments: List[Argument] = field(default_factory=list)  # 参数列表
     handler: Optional[Callable] = None  # 处理函数
+    stream_handler: Optional[Callable] = None  # 流式处理函数,逐个产出结果
     subcommands: List["Command"] = field(default_factory=list)  # 子命令
 
 
@@ -126,15 +135,9 @@ def handle_query_edge(args) -> Dict[str, Any]:
     )
 
 
-def handle_query_cycle(args) -> Dict[str, Any]:
-    """处理查询环路命令"""
-    username = getattr(args, 'username_context', None)
-    if not username:
-        return {"status": "error", "message": "User not authenticated"}
-    
+def _cycle_search_kwargs(args) -> Dict[str, Any]:
+    """从参数中提取环路搜索的公共参数"""
     kwargs = {
-        "username": username,
-        "start_vid": args.start_vid,
         "max_depth": args.max_depth,
         "direction": args.direction,
         "limit": args.limit,
@@ -149,13 +152,129 @@ def handle_query_cycle(args) -> Dict[str, Any]:
         ("edge_filter_e_type", "edge_filter_e_type"),
         ("edge_filter_min_amount", "edge_filter_min_amount"),
         ("edge_filter_max_amount", "edge_filter_max_amount"),
+        ("timeout_ms", "timeout_ms"),
+        ("engine", "engine"),
+        ("order_by", "order_by"),
     ]
 
     for arg_name, param_name in optional_params:
         if hasattr(args, arg_name) and getattr(args, arg_name) is not None:
             kwargs[param_name] = getattr(args, arg_name)
 
-    return query_cycles(**kwargs)
+    return kwargs
+
+
+def handle_query_cycle(args) -> Dict[str, Any]:
+    """处理查询环路命令"""
+    username = getattr(args, 'username_context', None)
+    if not username:
+        return {"status": "error", "message": "User not authenticated"}
+
+    return query_cycles(
+        username=username, start_vid=args.start_vid, **_cycle_search_kwargs(args)
+    )
+
+
+def handle_query_scc(args) -> Dict[str, Any]:
+    """处理查询强连通分量命令"""
+    username = getattr(args, 'username_context', None)
+    if not username:
+        return {"status": "error", "message": "User not authenticated"}
+
+    return query_scc(username=username, vid=args.vid, limit=args.limit)
+
+
+def _batch_start_vids(args) -> List[int]:
+    """合并 --starts 与 --start-file 给出的起点。
+
+    --start-file 只在本地 CLI 中读取,HTTP 请求中的 --start-file 由 local_only_error 拒绝。
+    """
+    start_vids = list(args.start_vids or [])
+    if args.start_file:
+        with open(args.start_file, "r") as f:
+            start_vids.extend(int(tok) for tok in f.read().replace(",", " ").split())
+    return start_vids
+
+
+def handle_query_cycles_batch(args) -> Dict[str, Any]:
+    """处理批量查询环路命令,收集全部结果后返回"""
+    username = getattr(args, 'username_context', None)
+    if not username:
+        return {"status": "error", "message": "User not authenticated"}
+
+    return query_cycles_batch(
+        username,
+        _batch_start_vids(args),
+        workers=args.workers,
+        **_cycle_search_kwargs(args),
+    )
+
+
+def stream_query_cycles_batch(args) -> Iterator[Dict[str, Any]]:
+    """处理批量查询环路命令,每完成一个起点产出一个结果"""
+    username = getattr(args, 'username_context', None)
+    if not username:
+        yield {"status": "error", "message": "User not authenticated"}
+        return
+
+    yield from iter_cycles_batch(
+        username,
+        _batch_start_vids(args),
+        workers=args.workers,
+        **_cycle_search_kwargs(args),
+    )
+
+
+def _scan_cycles(args, username: str) -> Iterator[Dict[str, Any]]:
+    kwargs = _cycle_search_kwargs(args)
+    kwargs.pop("limit")
+    return scan_cycles(
+        username,
+        limit=args.limit,
+        workers=args.workers,
+        progress_every=args.progress_every,
+        **kwargs,
+    )
+
+
+def handle_scan_cycles(args) -> Dict[str, Any]:
+    """处理全图环路扫描命令。
+
+    指定 --output 时把所有结果行写入 NDJSON 文件,只返回汇总;
+    否则收集全部环路后一并返回。
+    """
+    username = getattr(args, 'username_context', None)
+    if not username:
+        return {"status": "error", "message": "User not authenticated"}
+
+    cycles = []
+    summary: Dict[str, Any] = {"status": "error", "message": "Scan produced no summary"}
+    output = open(args.output, "w") if args.output else None
+    try:
+        for item in _scan_cycles(args, username):
+            if output is not None:
+                output.write(json.dumps(item, ensure_ascii=False) + "\n")
+            elif item["type"] == "cycle":
+                cycles.append(item)
+            if item["type"] == "summary":
+                summary = {k: v for k, v in item.items() if k != "type"}
+    finally:
+        if output is not None:
+            output.close()
+
+    if output is None and summary["status"] == "success":
+        summary["data"] = cycles
+    return summary
+
+
+def stream_scan_cycles(args) -> Iterator[Dict[str, Any]]:
+    """处理全图环路扫描命令,逐个产出进度、环路和汇总"""
+    username = getattr(args, 'username_context', None)
+    if not username:
+        yield {"status": "error", "message": "User not authenticated"}
+        return
+
+    yield from _scan_cycles(args, username)
 
 
 def handle_insert_vertex(args) -> Dict[str, Any]:
@@ -241,6 +360,11 @@ def handle_update_edge(args) -> Dict[str, Any]:
 # ==================== 命令定义 ====================
 
 
+def handle_snapshot_build(args) -> Dict[str, Any]:
+    """处理生成内存图快照命令(仅本地 CLI,按 --username 指定用户)"""
+    return build_snapshot(args.username)
+
+
 def get_command_tree() -> List[Command]:
     """获取命令树配置"""
 
@@ -302,6 +426,99 @@ def get_command_tree() -> List[Command]:
         flags=["--max-time"], help="最大发生时间", type=int, dest="max_occur_time"
     )
 
+    cycle_limit_arg = Argument(
+        flags=["--limit"],
+        help="最多返回的环路数量",
+        type=int,
+        default=10,
+    )
+    cycle_timeout_arg = Argument(
+        flags=["--timeout-ms"],
+        help="搜索时间预算(毫秒),到期后返回已找到的环路",
+        type=int,
+        dest="timeout_ms",
+    )
+    cycle_engine_arg = Argument(
+        flags=["--engine"],
+        help="搜索引擎 (默认 auto: 按图规模、起点度数、过滤选择率和内存预算自动选择)",
+        type=str,
+        default=AUTO,
+        choices=[AUTO, *CYCLE_ENGINES],
+    )
+    cycle_order_arg = Argument(
+        flags=["--order-by"],
+        help="按得分返回最优的 --limit 个环: total_amount/min_amount 从大到小, duration 从短到长",
+        type=str,
+        choices=list(ORDER_BY),
+        dest="order_by",
+    )
+
+    # 环路搜索参数(单起点查询、批量查询与全图扫描共用)
+    cycle_search_args = [
+        Argument(
+            flags=["--depth", "--max-depth"],
+            help="最大深度",
+            required=True,
+            type=int,
+            dest="max_depth",
+        ),
+        Argument(
+            flags=["--dir", "--direction"],
+            help="方向 (forward/any)",
+            type=str,
+            default="forward",
+            choices=["forward", "any"],
+            dest="direction",
+        ),
+        # 点过滤
+        Argument(
+            flags=["--vt", "--v-type"],
+            help="点类型过滤",
+            type=str,
+            nargs="+",
+            dest="vertex_filter_v_type",
+        ),
+        Argument(
+            flags=["--min-bal", "--min-balance"],
+            help="点最小余额过滤",
+            type=int,
+            dest="vertex_filter_min_balance",
+        ),
+        # 边过滤
+        Argument(
+            flags=["--et", "--e-type"],
+            help="边类型过滤",
+            type=str,
+            nargs="+",
+            dest="edge_filter_e_type",
+        ),
+        Argument(
+            flags=["--min-amt", "--min-amount"],
+            help="边最小金额过滤",
+            type=int,
+            dest="edge_filter_min_amount",
+        ),
+        Argument(
+            flags=["--max-amt", "--max-amount"],
+            help="边最大金额过滤",
+            type=int,
+            dest="edge_filter_max_amount",
+        ),
+        # 结果控制
+        Argument(
+            flags=["--allow-dup-v", "--allow-duplicate-vertices"],
+            help="允许环路中重复访问同一个点",
+            action="store_true",
+            dest="allow_duplicate_vertices",
+        ),
+        Argument(
+            flags=["--allow-dup-e", "--allow-duplicate-edges"],
+            help="允许环路中重复使用同一条边",
+            action="store_true",
+            dest="allow_duplicate_edges",
+        ),
+    ]
+
     return [
         # ==================== 认证命令 ====================
         Command(
@@ -379,76 +596,96 @@ def get_command_tree() -> List[Command]:
                             type=int,
                             dest="start_vid",
                         ),
+                        *cycle_search_args,
+                        cycle_limit_arg,
+                        cycle_timeout_arg,
+                        cycle_engine_arg,
+                        cycle_order_arg,
+                    ],
+                    handler=handle_query_cycle,
+                ),
+                Command(
+                    name="cycles-batch",
+                    aliases=["cb"],
+                    help="批量查询多个起点的环路",
+                    arguments=[
                         Argument(
-                            flags=["--depth", "--max-depth"],
-                            help="最大深度",
-                            required=True,
+                            flags=["--starts", "--start-vids"],
+                            help="起始点 ID 列表",
                             type=int,
-                            dest="max_depth",
-                        ),
-                        Argument(
-                            flags=["--dir", "--direction"],
-                            help="方向 (forward/any)",
-                            type=str,
-                            default="forward",
-                            choices=["forward", "any"],
-                            dest="direction",
+                            nargs="+",
+                            dest="start_vids",
                         ),
-                        # 点过滤
                         Argument(
-                            flags=["--vt", "--v-type"],
-                            help="点类型过滤",
+                            flags=["--start-file"],
+                            help="起始点 ID 文件(以空白或逗号分隔)",
                             type=str,
-                            nargs="+",
-                            dest="vertex_filter_v_type",
                         ),
                         Argument(
-                            flags=["--min-bal", "--min-balance"],
-                            help="点最小余额过滤",
+                            flags=["--workers"],
+                            help="并发数(内存引擎为工作进程数,默认按起点数计算;数据库引擎为线程数,默认为 CPU 核数)",
                             type=int,
-                            dest="vertex_filter_min_balance",
-                        ),
-                        # 边过滤
-                        Argument(
-                            flags=["--et", "--e-type"],
-                            help="边类型过滤",
-                            type=str,
-                            nargs="+",
-                            dest="edge_filter_e_type",
                         ),
+                        *cycle_search_args,
+                        cycle_limit_arg,
+                        cycle_timeout_arg,
+                        cycle_engine_arg,
+                        cycle_order_arg,
+                    ],
+                    handler=handle_query_cycles_batch,
+                    stream_handler=stream_query_cycles_batch,
+                ),
+                Command(
+                    name="scc",
+                    help="查询强连通分量(指定 --vid 时返回该点所在分量,否则返回全图统计)",
+                    arguments=[
+                        vid_arg,
                         Argument(
-                            flags=["--min-amt", "--min-amount"],
-                            help="边最小金额过滤",
+                            flags=["--limit"],
+                            help="最多返回的分量成员数量",
                             type=int,
-                            dest="edge_filter_min_amount",
+                            default=100,
                         ),
+                    ],
+                    handler=handle_query_scc,
+                ),
+            ],
+        ),
+        # ==================== 扫描命令 ====================
+        Command(
+            name="scan",
+            help="全图扫描",
+            subcommands=[
+                Command(
+                    name="cycles",
+                    aliases=["c"],
+                    help="扫描全图中所有长度不超过 --depth 的环路",
+                    arguments=[
+                        *cycle_search_args,
                         Argument(
-                            flags=["--max-amt", "--max-amount"],
-                            help="边最大金额过滤",
+                            flags=["--limit"],
+                            help="最多输出的环路数量(默认不限)",
                             type=int,
-                            dest="edge_filter_max_amount",
                         ),
-                        # 结果控制
                         Argument(
-                            flags=["--limit"],
-                            help="最多返回的环路数量",
+                            flags=["--workers"],
+                            help="工作进程数(默认按候选起点数计算,不超过 CPU 核数)",
                             type=int,
-                            default=10,
                         ),
                         Argument(
-                            flags=["--allow-dup-v", "--allow-duplicate-vertices"],
-                            help="允许环路中重复访问同一个点",
-                            action="store_true",
-                            dest="allow_duplicate_vertices",
+                            flags=["--progress-every"],
+                            help="每完成多少个起点报告一次进度",
+                            type=int,
+                            default=1000,
                         ),
                         Argument(
-                            flags=["--allow-dup-e", "--allow-duplicate-edges"],
-                            help="允许环路中重复使用同一条边",
-                            action="store_true",
-                            dest="allow_duplicate_edges",
+                            flags=["--output", "-o"],
+                            help="把结果以 NDJSON 写入文件,只返回汇总",
+                            type=str,
                         ),
                     ],
-                    handler=handle_query_cycle,
+                    handler=handle_scan_cycles,
+                    stream_handler=stream_scan_cycles,
                 ),
             ],
         ),
@@ -646,6 +883,19 @@ def get_command_tree() -> List[Command]:
                 ),
             ],
         ),
+        # ==================== 快照命令(仅本地 CLI) ====================
+        Command(
+            name="snapshot",
+            help="管理内存图快照",
+            subcommands=[
+                Command(
+                    name="build",
+                    help="从数据库加载用户的图并写入快照文件",
+                    arguments=[username_arg],
+                    handler=handle_snapshot_build,
+                ),
+            ],
+        ),
     ]
 
 
@@ -658,6 +908,7 @@ def build_parser() -> argparse.ArgumentParser:
         prog="cgql",
         description="CycleGraph Query Language - 图数据库命令行工具",
         formatter_class=argparse.RawDescriptionHelpFormatter,
+        allow_abbrev=False,
     )
 
     subparsers = parser.add_subparsers(dest="command", help="可用命令")
@@ -674,8 +925,9 @@ def _add_commands_to_parser(
     """递归添加命令到解析器"""
     for cmd in commands:
         # 创建子命令解析器
+        # 不接受参数缩写: 参数检查(如 local_only_error)按完整的参数名进行
         cmd_parser = subparsers.add_parser(
-            cmd.name, aliases=cmd.aliases, help=cmd.help
+            cmd.name, aliases=cmd.aliases, help=cmd.help, allow_abbrev=False
         )
 
         # 添加参数
@@ -708,6 +960,8 @@ def _add_commands_to_parser(
         # 设置处理器
         if cmd.handler:
             cmd_parser.set_defaults(handler=cmd.handler)
+        if cmd.stream_handler:
+            cmd_parser.set_defaults(stream_handler=cmd.stream_handler)
 
 
 # ==================== 命令执行 ====================
@@ -715,6 +969,34 @@ def _add_commands_to_parser(
 
 _PARSER = build_parser()
 
+# 只允许在本地 CLI 中使用的命令(会写服务器上的文件)
+LOCAL_ONLY_COMMANDS = {"snapshot"}
+
+# 只允许在本地 CLI 中使用的参数(读写服务器上的文件): 参数名(dest) -> 命令行写法。
+# cgql 客户端在发送前把 --start-file 展开为 --starts,把 --output 留在本地写入
+LOCAL_ONLY_OPTIONS = {"output": "--output", "start_file": "--start-file"}
+
+
+def local_only_error(args_list: List[str]) -> Optional[str]:
+    """检查命令是否使用了只允许在本地 CLI 中使用的命令或参数。
+
+    按解析后的结果检查,--output=x、-ox 等写法都会被识别。
+
+    Returns:
+        Optional[str]: 错误信息;命令可以远程执行(或无法解析)时为 None
+    """
+    try:
+        args = _PARSER.parse_args(args_list)
+    except SystemExit:
+        return None  # 由 execute_command 报告参数错误
+
+    if args.command in LOCAL_ONLY_COMMANDS:
+        return f"Command {args.command} is only available in the local CLI"
+    for dest, flag in LOCAL_ONLY_OPTIONS.items():
+        if getattr(args, dest, None) is not None:
+            return f"Option {flag} is only available in the local CLI"
+    return None
+
 
 def execute_command(args_list: List[str], username: Optional[str] = None) -> Dict[str, Any]:
     """执行 CLI 命令并返回结果字典。
@@ -743,6 +1025,39 @@ def execute_command(args_list: List[str], username: Optional[str] = None) -> Dic
         return {"status": "error", "message": f"Command execution failed: {str(e)}"}
 
 
+def execute_command_stream(
+    args_list: List[str], username: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
+    """执行 CLI 命令并逐个产出结果字典。
+
+    支持流式输出的命令(如 query cycles-batch)每得到一个结果就产出一次,
+    其它命令只产出一个结果,与 execute_command 相同。
+
+    Args:
+        args_list: 命令参数列表
+        username: 当前登录的用户名(从token验证获得),用于多用户表隔离
+    """
+    try:
+        args = _PARSER.parse_args(args_list)
+    except SystemExit:
+        yield {"status": "error", "message": "Invalid command or arguments"}
+        return
+
+    if not hasattr(args, "handler"):
+        yield {"status": "error", "message": "Unknown command"}
+        return
+
+    try:
+        args.username_context = username
+        stream_handler = getattr(args, "stream_handler", None)
+        if stream_handler is None:
+            yield args.handler(args)
+        else:
+            yield from stream_handler(args)
+    except Exception as e:
+        yield {"status": "error", "message": f"Command execution failed: {str(e)}"}
+
+
 def execute_command_from_string(command_str: str) -> str:
     """从命令字符串执行并返回 JSON 字符串。
 
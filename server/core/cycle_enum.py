@@ -0,0 +1,320 @@
+"""环路查找服务 - 有界长度时序环的完整枚举。
+
+双向BFS对每个点每层只保留一条路径,在稠密图上会漏掉大量环。本模块在内存图
+上从起点做深度优先搜索,返回经过起点、长度不超过 max_depth 的全部简单环,
+搜索前先做两项预处理用于剪枝(思路来自 Johnson / 2SCENT 一类算法):
+
+1. 反向可达距离: 从起点沿入边做反向BFS,得到每个点回到起点至少需要的边数。
+   当前深度加上该距离超过 max_depth 的分支直接剪掉。
+2. 最晚出发时间(仅 direction="forward"): 每个点沿时间递增路径回到起点时,
+   第一条边最晚可以在什么时刻发生。到达某点的时间不早于该值时,不可能再
+   按时序回到起点,分支直接剪掉。
+
+DFS 只保存当前一条路径,不存储所有部分路径,环路逐个产出;达到 limit 或
+搜索期限(timeout_ms)到期后立即停止,期限到期时 meta.truncated 为 True。
+"""
+
+import time
+from itertools import groupby, islice
+from typing import Callable, Iterator, List, Dict, Any, Optional, Tuple
+from server.core import graph_cache, scc
+from server.core.deadline import Deadline, SearchTimeout
+from server.core.mem_graph import MemGraph
+from server.core.membibfs import (
+    _edge_filter,
+    distance_to_start,
+    _get_cycle_details_from_memory,
+    _vertex_matches_filter,
+)
+
+
+def query_cycles(
+    start_vid: int,
+    max_depth: int,
+    username: str,
+    direction: str = "forward",
+    vertex_filter_v_types: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_types: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    limit: int = 10,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
+    **db_kwargs: Any,
+) -> Dict[str, Any]:
+    """查询环路 - 完整枚举经过起点的有界长度环。
+
+    Args:
+        start_vid: 起始点ID
+        max_depth: 最大搜索深度(环路长度)
+        username: 用户名，用于确定查询哪个用户的表
+        direction: 时序方向, "forward"(时间递增) 或 "any"(无时序要求)
+        vertex_filter_v_types: 点类型过滤列表
+        vertex_filter_min_balance: 点最小余额过滤
+        edge_filter_e_types: 边类型过滤列表
+        edge_filter_min_amount: 边最小金额过滤
+        edge_filter_max_amount: 边最大金额过滤
+        limit: 最多返回的环数量
+        allow_duplicate_vertices: 是否允许环中出现重复点(除起点外)
+        allow_duplicate_edges: 是否允许环中出现重复边
+        timeout_ms: 搜索时间预算(毫秒),到期后返回已找到的环
+        **db_kwargs: 数据库连接参数
+
+    Returns:
+        Dict: 包含status, found, data(环列表), meta等信息。
+              meta.complete 为 True 表示已枚举出全部满足条件的环,
+              meta.truncated 为 True 表示搜索期限已到。
+    """
+    try:
+        # 搜索期间固定内存图,并发的写操作修补副本,不影响本次搜索
+        with graph_cache.pinned_graph(username, **db_kwargs):
+            search = make_searcher(
+                max_depth,
+                username,
+                direction,
+                vertex_filter_v_types,
+                vertex_filter_min_balance,
+                edge_filter_e_types,
+                edge_filter_min_amount,
+                edge_filter_max_amount,
+                limit,
+                allow_duplicate_vertices,
+                allow_duplicate_edges,
+                timeout_ms,
+                **db_kwargs,
+            )
+            return search(start_vid)
+    except Exception as e:
+        return {"status": "error", "message": f"Cycle query failed: {e}"}
+
+
+def make_searcher(
+    max_depth: int,
+    username: str,
+    direction: str = "forward",
+    vertex_filter_v_types: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_types: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    limit: int = 10,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
+    **db_kwargs: Any,
+) -> Callable[[int], Dict[str, Any]]:
+    """获取内存图并构建过滤条件,返回对单个起点执行枚举的函数。
+
+    参数含义同 query_cycles,timeout_ms 对每个起点单独计时。
+    返回的函数一直使用此时取得的图,调用方应在 graph_cache.pinned_graph 内使用它。
+    """
+    graph = graph_cache.get_graph(username, **db_kwargs)
+    edge_ok = _edge_filter(
+        graph,
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+    )
+    scc_index = scc.get_index(graph)
+
+    def search(start_vid: int) -> Dict[str, Any]:
+        start_time = time.time()
+        deadline = Deadline(timeout_ms)
+        try:
+            # 1. 验证起始点存在
+            start_vertex = graph.get_vertex(start_vid)
+            if not start_vertex:
+                return {"status": "error", "message": f"Start vertex {start_vid} not found"}
+
+            # 2. 检查起始点是否满足过滤条件
+            if not _vertex_matches_filter(
+                start_vertex, vertex_filter_v_types, vertex_filter_min_balance
+            ):
+                return {
+                    "status": "success",
+                    "found": False,
+                    "message": "Start vertex does not match filters",
+                }
+
+            # 3. 起点不在任何环上时直接返回,否则只在起点所在的强连通分量内搜索
+            start = graph.vertex_index(start_vid)
+            if not scc_index.on_cycle(start):
+                return {
+                    "status": "success",
+                    "found": False,
+                    "message": "Start vertex is not on any cycle",
+                }
+            component_ok = scc.component_edge_filter(graph, scc_index, start, edge_ok)
+
+            # 4. 枚举环路
+            cycles, complete, truncated = _enumerate_cycles(
+                graph,
+                start,
+                max_depth,
+                direction,
+                component_ok,
+                limit,
+                allow_duplicate_vertices,
+                allow_duplicate_edges,
+                deadline,
+            )
+
+            # 5. 构造返回结果
+            execution_time = int((time.time() - start_time) * 1000)
+            meta = {
+                "execution_time_ms": execution_time,
+                "complete": complete,
+                "truncated": truncated,
+            }
+
+            if not cycles:
+                return {"status": "success", "found": False, "meta": meta}
+
+            cycle_data = []
+            for cycle_path in cycles:
+                vertices_data, edges_data = _get_cycle_details_from_memory(
+                    cycle_path, graph
+                )
+                cycle_data.append({"vertices": vertices_data, "edges": edges_data})
+
+            return {
+                "status": "success",
+                "found": True,
+                "count": len(cycle_data),
+                "data": cycle_data,
+                "meta": meta,
+            }
+
+        except Exception as e:
+            return {"status": "error", "message": f"Cycle query failed: {e}"}
+
+    return search
+
+
+def _enumerate_cycles(
+    graph: MemGraph,
+    start: int,
+    max_depth: int,
+    direction: str,
+    edge_ok: Optional[Callable[[int], bool]],
+    limit: int,
+    allow_duplicate_vertices: bool,
+    allow_duplicate_edges: bool,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[List[List[Tuple[int, int, int, int]]], bool, bool]:
+    """从起点 DFS 枚举环路,最多 limit 个。
+
+    Returns:
+        Tuple: (环路列表, 是否枚举完整, 是否因期限到期而停止)。
+               环路格式为 [(src_vid, dst_vid, eid, edge_idx), ...]
+    """
+    vids, eids = graph.vids, graph.eids
+    src_col, dst_col = graph.src, graph.dst
+    cycles: List[List[Tuple[int, int, int, int]]] = []
+    try:
+        paths = iter_cycles(
+            graph,
+            start,
+            max_depth,
+            direction,
+            edge_ok,
+            allow_duplicate_vertices,
+            allow_duplicate_edges,
+            deadline,
+        )
+        for path in islice(paths, limit):
+            cycles.append(
+                [(vids[src_col[ei]], vids[dst_col[ei]], eids[ei], ei) for ei in path]
+            )
+    except SearchTimeout:
+        return cycles, False, True
+    return cycles, len(cycles) < limit, False
+
+
+def iter_cycles(
+    graph: MemGraph,
+    start: int,
+    max_depth: int,
+    direction: str,
+    edge_ok: Optional[Callable[[int], bool]],
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    deadline: Optional[Deadline] = None,
+) -> Iterator[List[int]]:
+    """从起点(点下标) DFS 逐个产出环路,每个环路是从起点出发的边下标列表。
+
+    每进入一个点检查一次 deadline,到期时抛出 SearchTimeout。
+    """
+    temporal = direction == "forward"
+    dist, ball_edges = distance_to_start(graph, start, max_depth, edge_ok, deadline)
+    latest = _latest_departure(graph, start, ball_edges) if temporal else None
+
+    dst_col, time_col = graph.dst, graph.occur_time
+    path: List[int] = []  # 当前路径上的边下标
+    on_path = {start}
+    used_edges = set()
+
+    def dfs(vi: int, arrival: int, depth: int) -> Iterator[List[int]]:
+        if deadline is not None:
+            deadline.check()
+        for ei in graph.out_edge_indices(vi, after=arrival if temporal else None):
+            if edge_ok is not None and not edge_ok(ei):
+                continue
+            if not allow_duplicate_edges and ei in used_edges:
+                continue
+
+            nxt = dst_col[ei]
+            if nxt == start:
+                yield path + [ei]
+                continue
+
+            # 剪枝: 剩余深度不足以回到起点
+            remaining = dist.get(nxt)
+            if remaining is None or depth + 1 + remaining > max_depth:
+                continue
+            # 剪枝: 到达时间太晚,无法按时序回到起点
+            t = time_col[ei]
+            if temporal and t >= latest.get(nxt, t):
+                continue
+            if not allow_duplicate_vertices and nxt in on_path:
+                continue
+
+            path.append(ei)
+            used_edges.add(ei)
+            first_visit = nxt not in on_path
+            on_path.add(nxt)
+            yield from dfs(nxt, t, depth + 1)
+            if first_visit:
+                on_path.discard(nxt)
+            used_edges.discard(ei)
+            path.pop()
+
+    return dfs(start, 0, 0)
+
+
+def _latest_departure(graph: MemGraph, start: int, edges: List[int]) -> Dict[int, int]:
+    """计算每个点沿时间严格递增的路径回到起点时,第一条边最晚的发生时间。
+
+    按时间从晚到早扫描边: 处理边 (u -> v, t) 时,所有晚于 t 的边都已处理,
+    因此 latest[v] 已包含从 v 出发、第一条边晚于 t 的所有路径。同一时刻的边
+    作为一组,先全部基于组前的结果判断再统一更新,保证时间严格递增。
+    """
+    src_col, dst_col, time_col = graph.src, graph.dst, graph.occur_time
+    latest: Dict[int, int] = {}
+    ordered = sorted(edges, key=time_col.__getitem__, reverse=True)
+
+    for t, group in groupby(ordered, key=time_col.__getitem__):
+        reachable = [
+            src_col[ei]
+            for ei in group
+            if dst_col[ei] == start or latest.get(dst_col[ei], t) > t
+        ]
+        for u in reachable:
+            if u not in latest:
+                latest[u] = t
+
+    return latest
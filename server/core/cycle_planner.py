@@ -0,0 +1,287 @@
+"""环路查询计划 - 按估算的访问量和内存占用为查询选择搜索引擎。
+
+engine 为 "auto" 时,根据以下估算选择引擎:
+- 图规模: 内存图已缓存时取精确值,否则取 pg_class.reltuples(统计信息缺失时
+  退化为 COUNT(*)),并在进程内缓存 STATS_TTL 秒;
+- 起点的出/入度: 内存图或边表索引;
+- 过滤条件的选择率: 由数据库对过滤条件的行数估计(EXPLAIN)除以表的行数。
+
+由此估算双向搜索需要读取的边数 reach_edges:每一侧搜索约 max_depth/2 层,
+每层的分支数为过滤后的平均度数。选择规则:
+1. 内存图已缓存: membibfs;
+2. reach_edges 只占过滤后边数的一小部分(LAZY_FRACTION): lazybfs,只取起点附近的邻接;
+3. 全图的内存估算不超过内存预算: membibfs(加载全图并缓存);
+4. 按需加载的内存估算不超过预算: lazybfs;
+5. 否则: bibfs,搜索状态全部放在数据库临时表中。
+
+指定 order_by 时固定使用 topk。显式指定 membibfs/enum/topk 而全图超出内存预算时
+拒绝查询(抛出 PlanRejected)。
+内存预算即 graph_cache 的进程级预算。选择结果和估算值写入 meta.plan。
+"""
+
+import math
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from server.opengauss.graph_dao import fetch_all, fetch_one, get_user_table_name
+from server.core import graph_cache
+
+
+AUTO = "auto"
+# 指定 order_by 时使用的排序 top-k 搜索(cycle_topk),只能在内存图上执行
+TOPK = "topk"
+
+# 需要加载用户全图的引擎
+MEMORY_ENGINES = ("membibfs", "enum", TOPK)
+
+# 内存图每个点、每条边的估算字节数(与 MemGraph.estimated_bytes 口径一致):
+# 点: vids/create_time/balance/四个时间包络(8 字节) + v_type(4) + 存活标记(1)
+#     + 两个 CSR 偏移(16) + vid 字典项(约 100)
+# 边: eid/amount/occur_time(8 字节) + src/dst/e_type(4) + 存活标记(1) + 两个 CSR 边下标(8)
+VERTEX_BYTES = 8 * 7 + 4 + 1 + 16 + 100
+EDGE_BYTES = 8 * 3 + 4 * 3 + 1 + 8
+# 按需加载时每条取回的边的估算字节数(列数组、eid 字典项、邻接表槽位)
+LAZY_EDGE_BYTES = 150
+
+# 估算读取的边数不超过过滤后边数的该比例时使用 lazybfs
+LAZY_FRACTION = 0.05
+
+# 图规模统计的进程内缓存时间(秒)
+STATS_TTL = 60
+
+_stats_cache: Dict[str, Tuple[float, int, int, str]] = {}
+_stats_lock = threading.Lock()
+
+_ROWS_PATTERN = re.compile(r"rows=(\d+)")
+
+
+class PlanRejected(Exception):
+    """查询的估算内存超出预算,拒绝执行。plan 为拒绝时的计划信息。"""
+
+    def __init__(self, message: str, plan: Dict[str, Any]):
+        super().__init__(message)
+        self.plan = plan
+
+
+def plan_cycle_query(
+    username: str,
+    engine: str,
+    start_vid: Optional[int],
+    max_depth: int,
+    direction: str,
+    vertex_filter_v_type: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_type: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    order_by: Optional[str] = None,
+) -> Dict[str, Any]:
+    """为环路查询选择引擎,返回写入 meta.plan 的计划。
+
+    Args:
+        username: 用户名
+        engine: "auto" 或 graph_service.CYCLE_ENGINES 中的引擎名
+        start_vid: 起点ID;批量查询时为 None,按平均度数估算
+        max_depth, direction 及过滤条件: 同 graph_service.query_cycles
+        order_by: 排序依据,指定时使用 topk 引擎
+
+    Returns:
+        Dict: engine(选定的引擎), requested(请求的引擎), reason(选择理由),
+              estimates(估算值)
+
+    Raises:
+        PlanRejected: 需要加载全图的引擎超出内存预算,或 order_by 与数据库引擎同时指定
+    """
+    budget = graph_cache.memory_budget()
+    cached = graph_cache.peek_graph(username) is not None
+    plan: Dict[str, Any] = {"engine": engine, "requested": engine, "reason": "requested"}
+
+    if order_by is not None:
+        if engine not in (AUTO, *MEMORY_ENGINES):
+            raise PlanRejected(
+                f"Order by is only supported on the in-memory graph, not engine {engine}",
+                plan,
+            )
+        engine = TOPK
+        _choose(plan, TOPK, f"ordered by {order_by}, best-first search on the in-memory graph")
+
+    if engine != AUTO and (engine not in MEMORY_ENGINES or cached):
+        # 显式指定且不需要加载全图,不必估算
+        return plan
+
+    vertices, edges, source = _graph_stats(username)
+    graph_bytes = vertices * VERTEX_BYTES + edges * EDGE_BYTES
+    estimates: Dict[str, Any] = {
+        "stats_source": source,
+        "vertices": vertices,
+        "edges": edges,
+        "graph_bytes": graph_bytes,
+        "memory_budget": budget,
+    }
+    plan["estimates"] = estimates
+
+    if engine != AUTO:
+        if graph_bytes > budget:
+            raise PlanRejected(
+                f"Estimated graph size {graph_bytes} bytes exceeds memory budget "
+                f"{budget} bytes, use engine auto, lazybfs or bibfs",
+                plan,
+            )
+        return plan
+
+    if cached:
+        return _choose(plan, "membibfs", "graph already cached in memory")
+
+    table_vertex, table_edge = get_user_table_name(username)
+    vertex_sel = _selectivity(
+        table_vertex,
+        vertices,
+        _vertex_conditions(vertex_filter_v_type, vertex_filter_min_balance),
+    )
+    edge_sel = _selectivity(
+        table_edge,
+        edges,
+        _edge_conditions(edge_filter_e_type, edge_filter_min_amount, edge_filter_max_amount),
+    )
+    filtered_edges = edges * edge_sel * vertex_sel
+
+    # 每一侧的分支数: 过滤后的平均出度(direction="any" 时出入边都可走)
+    sides = 2 if direction == "any" else 1
+    branching = sides * filtered_edges / vertices if vertices else 0.0
+    if start_vid is not None:
+        start_degree = _start_degree(username, table_edge, start_vid)
+        estimates["start_degree"] = start_degree
+        first_layer = sides * start_degree * edge_sel * vertex_sel
+    else:
+        first_layer = 2 * branching
+
+    # 两侧第一层合计 first_layer 条边,之后每侧约 ceil(max_depth/2) - 1 层
+    side_depth = math.ceil(max_depth / 2)
+    reach = first_layer * sum(branching**i for i in range(side_depth))
+    reach_edges = int(min(reach, filtered_edges))
+    lazy_bytes = reach_edges * LAZY_EDGE_BYTES
+
+    estimates.update(
+        {
+            "vertex_selectivity": round(vertex_sel, 6),
+            "edge_selectivity": round(edge_sel, 6),
+            "branching": round(branching, 3),
+            "reach_edges": reach_edges,
+            "lazy_bytes": lazy_bytes,
+        }
+    )
+
+    if reach_edges <= LAZY_FRACTION * filtered_edges:
+        return _choose(plan, "lazybfs", "search reaches a small part of the graph")
+    if graph_bytes <= budget:
+        return _choose(plan, "membibfs", "graph fits in memory budget")
+    if lazy_bytes <= budget:
+        return _choose(plan, "lazybfs", "graph exceeds memory budget, fetch adjacency on demand")
+    return _choose(plan, "bibfs", "search state exceeds memory budget, keep it in the database")
+
+
+def _choose(plan: Dict[str, Any], engine: str, reason: str) -> Dict[str, Any]:
+    plan["engine"] = engine
+    plan["reason"] = reason
+    return plan
+
+
+def _graph_stats(username: str) -> Tuple[int, int, str]:
+    """返回 (点数, 边数, 来源)。"""
+    with graph_cache.pinned_graph(username, load=False) as graph:
+        if graph is not None:
+            return graph.vertex_count, graph.edge_count, "cache"
+
+    now = time.monotonic()
+    with _stats_lock:
+        entry = _stats_cache.get(username)
+        if entry is not None and now - entry[0] < STATS_TTL:
+            return entry[1], entry[2], entry[3]
+
+    table_vertex, table_edge = get_user_table_name(username)
+    vertices = _reltuples(table_vertex)
+    edges = _reltuples(table_edge)
+    source = "pg_class"
+    if vertices is None or edges is None:
+        # 表尚未收集过统计信息
+        vertices = fetch_one(f"SELECT COUNT(*) FROM {table_vertex}")[0]
+        edges = fetch_one(f"SELECT COUNT(*) FROM {table_edge}")[0]
+        source = "count"
+
+    with _stats_lock:
+        _stats_cache[username] = (now, vertices, edges, source)
+    return vertices, edges, source
+
+
+def _reltuples(table_name: str) -> Optional[int]:
+    """表的估计行数,尚未收集统计信息时返回 None。"""
+    result = fetch_one(
+        "SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (table_name,)
+    )
+    if result is None or result[0] is None or result[0] <= 0:
+        return None
+    return int(result[0])
+
+
+def _selectivity(
+    table_name: str, total: int, conditions: Tuple[List[str], List[Any]]
+) -> float:
+    """过滤条件的选择率(数据库估计的满足条件行数 / 总行数)。"""
+    clauses, params = conditions
+    if not clauses or total <= 0:
+        return 1.0
+    rows = fetch_all(
+        f"EXPLAIN SELECT 1 FROM {table_name} WHERE {' AND '.join(clauses)}",
+        tuple(params),
+    )
+    match = _ROWS_PATTERN.search(rows[0][0]) if rows else None
+    if match is None:
+        return 1.0
+    return min(1.0, int(match.group(1)) / total)
+
+
+def _vertex_conditions(
+    v_types: Optional[List[str]], min_balance: Optional[int]
+) -> Tuple[List[str], List[Any]]:
+    clauses: List[str] = []
+    params: List[Any] = []
+    if v_types:
+        clauses.append(f"v_type IN ({','.join(['%s'] * len(v_types))})")
+        params.extend(v_types)
+    if min_balance is not None:
+        clauses.append("balance >= %s")
+        params.append(min_balance)
+    return clauses, params
+
+
+def _edge_conditions(
+    e_types: Optional[List[str]], min_amount: Optional[int], max_amount: Optional[int]
+) -> Tuple[List[str], List[Any]]:
+    clauses: List[str] = []
+    params: List[Any] = []
+    if e_types:
+        clauses.append(f"e_type IN ({','.join(['%s'] * len(e_types))})")
+        params.extend(e_types)
+    if min_amount is not None:
+        clauses.append("amount >= %s")
+        params.append(min_amount)
+    if max_amount is not None:
+        clauses.append("amount <= %s")
+        params.append(max_amount)
+    return clauses, params
+
+
+def _start_degree(username: str, table_edge: str, start_vid: int) -> int:
+    """起点的出度与入度之和(正向搜索时即两侧第一层的边数)。"""
+    with graph_cache.pinned_graph(username, load=False) as graph:
+        if graph is not None:
+            vi = graph.vertex_index(start_vid)
+            return 0 if vi is None else graph.out_degree(vi) + graph.in_degree(vi)
+
+    result = fetch_one(
+        f"SELECT (SELECT COUNT(*) FROM {table_edge} WHERE src_vid = %s), "
+        f"(SELECT COUNT(*) FROM {table_edge} WHERE dst_vid = %s)",
+        (start_vid, start_vid),
+    )
+    return result[0] + result[1]
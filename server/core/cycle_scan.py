@@ -0,0 +1,212 @@
+"""全图环路扫描 - 找出用户图中所有长度不超过 max_depth 的环。
+
+1. 先按过滤条件计算强连通分量,只有非平凡分量(或带自环)中的点才可能
+   位于环上,其余点不作为起点。
+2. 每个候选起点用 cycle_enum 的 DFS 枚举,并限制只走同一分量内的边。
+3. 每个环只报告一次:
+   - direction="forward" 时,时间严格递增的环只有一种旋转方式合法
+     (从最早的边出发),因此天然只会从唯一的起点被找到;
+   - direction="any" 时,规定环从其中 vid 最小的点出发,搜索时只经过
+     vid 大于起点的点。
+4. 起点分发到 batch_runner 的工作进程并行枚举(纯 Python 的 DFS 在线程中受 GIL
+   限制): 每个工作进程加载固定图的副本,连同分量编号构建自己的搜索函数。
+   每找到一个环就产出,不等起点枚举完;工作进程与调用方之间的缓冲有上限,
+   期间定期报告进度。
+
+产出的每一项是一个字典(通常逐行写成 NDJSON):
+    {"type": "progress", "done": ..., "total": ..., "cycles": ...}
+    {"type": "cycle", "start_vid": ..., "length": ..., "edges": [...]}
+    {"type": "summary", "status": "success", ...}
+"""
+
+import time
+from array import array
+from contextlib import ExitStack
+from itertools import islice
+from typing import Callable, Dict, Any, Iterator, List, Optional
+from server.core import batch_runner, graph_cache
+from server.core.cycle_enum import iter_cycles
+from server.core.mem_graph import MemGraph
+from server.core.membibfs import _edge_filter
+from server.core.scc import cyclic_vertices, strongly_connected_components
+
+
+PROGRESS_INTERVAL = 1000  # 每完成多少个起点报告一次进度
+
+
+def scan_cycles(
+    username: str,
+    max_depth: int,
+    direction: str = "forward",
+    vertex_filter_v_types: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_types: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    limit: Optional[int] = None,
+    workers: Optional[int] = None,
+    progress_every: int = PROGRESS_INTERVAL,
+    **db_kwargs: Any,
+) -> Iterator[Dict[str, Any]]:
+    """扫描全图,逐个产出进度、环路和最终汇总。
+
+    Args:
+        username: 用户名，用于确定查询哪个用户的表
+        max_depth: 环路最大长度
+        direction: 时序方向, "forward"(时间递增) 或 "any"(无时序要求)
+        limit: 最多产出的环路数量, None 表示不限
+        workers: 进程数,默认按候选起点数计算(batch_runner.default_processes)
+        progress_every: 每完成多少个起点产出一条进度
+        其余过滤参数含义同 query_cycles
+    """
+    start_time = time.time()
+
+    # 扫描期间固定内存图,并发的写操作修补副本,不影响本次扫描
+    with ExitStack() as stack:
+        try:
+            graph = stack.enter_context(graph_cache.pinned_graph(username, **db_kwargs))
+            edge_ok = _edge_filter(
+                graph,
+                vertex_filter_v_types,
+                vertex_filter_min_balance,
+                edge_filter_e_types,
+                edge_filter_min_amount,
+                edge_filter_max_amount,
+            )
+
+            # 1. 只有非平凡强连通分量中的点才可能位于环上
+            comp, n_comp = strongly_connected_components(graph, edge_ok)
+            candidates = cyclic_vertices(graph, comp, n_comp, edge_ok)
+            start_vids = sorted(graph.vids[vi] for vi in candidates)
+        except Exception as e:
+            yield {"type": "summary", "status": "error", "message": f"Cycle scan failed: {e}"}
+            return
+
+        total = len(start_vids)
+        yield {"type": "progress", "done": 0, "total": total, "cycles": 0}
+
+        done = 0
+        found = 0
+        truncated = False
+        try:
+            args = (
+                username,
+                comp,
+                max_depth,
+                direction,
+                vertex_filter_v_types,
+                vertex_filter_min_balance,
+                edge_filter_e_types,
+                edge_filter_min_amount,
+                edge_filter_max_amount,
+                allow_duplicate_vertices,
+                allow_duplicate_edges,
+                limit,
+            )
+            for start_vid, edges in batch_runner.iter_batch_processes(
+                graph, make_scan_searcher, args, start_vids, workers
+            ):
+                if edges is batch_runner.FINISHED:
+                    done += 1
+                    if done % progress_every == 0 and done < total:
+                        yield {"type": "progress", "done": done, "total": total, "cycles": found}
+                    continue
+                yield {
+                    "type": "cycle",
+                    "start_vid": start_vid,
+                    "length": len(edges),
+                    "edges": edges,
+                }
+                found += 1
+                if limit is not None and found >= limit:
+                    truncated = True
+                    break
+        except Exception as e:
+            yield {"type": "summary", "status": "error", "message": f"Cycle scan failed: {e}"}
+            return
+
+        yield {
+            "type": "summary",
+            "status": "success",
+            "starts": total,
+            "done": done,
+            "components": n_comp,
+            "cycles": found,
+            "truncated": truncated,
+            "execution_time_ms": int((time.time() - start_time) * 1000),
+        }
+
+
+def make_scan_searcher(
+    username: str,
+    comp: array,
+    max_depth: int,
+    direction: str,
+    vertex_filter_v_types: Optional[List[str]],
+    vertex_filter_min_balance: Optional[int],
+    edge_filter_e_types: Optional[List[str]],
+    edge_filter_min_amount: Optional[int],
+    edge_filter_max_amount: Optional[int],
+    allow_duplicate_vertices: bool,
+    allow_duplicate_edges: bool,
+    limit: Optional[int],
+) -> Callable[[int], Iterator[List[Dict[str, Any]]]]:
+    """构建扫描单个起点的函数,逐个产出起点的环(边字典列表)。
+
+    在 batch_runner 的工作进程中调用,图从 graph_cache 中取得(工作进程固定的
+    副本与调用方的图点下标相同,comp 可以直接使用)。
+    """
+    graph = graph_cache.get_graph(username)
+    edge_ok = _edge_filter(
+        graph,
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+    )
+
+    def search(start_vid: int) -> Iterator[List[Dict[str, Any]]]:
+        start = graph.vertex_index(start_vid)
+        scan_ok = _scan_edge_filter(graph, comp, start, direction, edge_ok)
+        paths = iter_cycles(
+            graph,
+            start,
+            max_depth,
+            direction,
+            scan_ok,
+            allow_duplicate_vertices,
+            allow_duplicate_edges,
+        )
+        if limit is not None:
+            paths = islice(paths, limit)
+        for path in paths:
+            yield [graph.edge(ei).to_dict() for ei in path]
+
+    return search
+
+
+def _scan_edge_filter(
+    graph: MemGraph,
+    comp: array,
+    start: int,
+    direction: str,
+    edge_ok: Optional[Callable[[int], bool]],
+) -> Callable[[int], bool]:
+    """扫描时的边过滤: 只走起点所在分量内的边;无时序要求时只经过 vid 大于起点的点。"""
+    src_col, dst_col, vids = graph.src, graph.dst, graph.vids
+    component = comp[start]
+    start_vid = vids[start]
+    canonical = direction != "forward"
+
+    def scan_ok(ei: int) -> bool:
+        dst = dst_col[ei]
+        if comp[dst] != component or comp[src_col[ei]] != component:
+            return False
+        if canonical and dst != start and vids[dst] < start_vid:
+            return False
+        return edge_ok is None or edge_ok(ei)
+
+    return scan_ok
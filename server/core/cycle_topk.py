@@ -0,0 +1,379 @@
+"""环路查找服务 - 按环的金额或时长排序的 top-k 最优优先搜索。
+
+limit 只截取搜索顺序中最先找到的 N 个环;需要"金额最大的 N 个环"时,本模块在
+内存图上做最优优先的分支定界搜索,按得分从优到劣逐个产出环:
+
+- total_amount: 环上边金额之和,越大越优;
+- min_amount:   环上边金额的最小值(瓶颈金额),越大越优;
+- duration:     环上边发生时间的跨度(最晚 - 最早),越短越优。
+
+每个部分路径的上界 = 已走过部分的得分与"剩余步数内从当前点回到起点"的最优得分
+的组合。后者在搜索前由反向可达范围内的边做 max_depth 轮松弛得到(忽略简单路径
+和时序约束,因此不会低估)。搜索用堆按上界取出部分路径扩展,完整的环以精确得分
+放入同一个堆:取出完整的环时,剩余所有分支的上界都不超过它,可以直接产出。
+上界不超过第 k 个环得分的分支因此不会被展开。
+
+剪枝条件与 cycle_enum 相同(反向可达距离、最晚出发时间),期限到期时 meta.truncated 为 True。
+"""
+
+import heapq
+import time
+from itertools import count
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
+from server.core import graph_cache, scc
+from server.core.cycle_enum import _latest_departure
+from server.core.deadline import Deadline, SearchTimeout
+from server.core.mem_graph import MemGraph
+from server.core.membibfs import (
+    _edge_filter,
+    distance_to_start,
+    _get_cycle_details_from_memory,
+    _vertex_matches_filter,
+)
+
+
+ORDER_BY = ("total_amount", "min_amount", "duration")
+
+_INF = float("inf")
+
+
+def query_cycles(
+    start_vid: int,
+    max_depth: int,
+    username: str,
+    direction: str = "forward",
+    vertex_filter_v_types: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_types: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    limit: int = 10,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
+    order_by: str = "total_amount",
+    **db_kwargs: Any,
+) -> Dict[str, Any]:
+    """查询得分最优的 limit 个环路。
+
+    Args:
+        start_vid ~ timeout_ms: 同 cycle_enum.query_cycles
+        order_by: 排序依据, "total_amount" / "min_amount"(从大到小) 或
+                  "duration"(从短到长)
+        **db_kwargs: 数据库连接参数
+
+    Returns:
+        Dict: 包含status, found, data(按得分排序的环列表,每个环带 score), meta等信息。
+              meta.complete 为 True 表示满足条件的环不足 limit 个且已全部返回。
+    """
+    try:
+        # 搜索期间固定内存图,并发的写操作修补副本,不影响本次搜索
+        with graph_cache.pinned_graph(username, **db_kwargs):
+            search = make_searcher(
+                max_depth,
+                username,
+                direction,
+                vertex_filter_v_types,
+                vertex_filter_min_balance,
+                edge_filter_e_types,
+                edge_filter_min_amount,
+                edge_filter_max_amount,
+                limit,
+                allow_duplicate_vertices,
+                allow_duplicate_edges,
+                timeout_ms,
+                order_by,
+                **db_kwargs,
+            )
+            return search(start_vid)
+    except Exception as e:
+        return {"status": "error", "message": f"Cycle query failed: {e}"}
+
+
+def make_searcher(
+    max_depth: int,
+    username: str,
+    direction: str = "forward",
+    vertex_filter_v_types: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_types: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    limit: int = 10,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
+    order_by: str = "total_amount",
+    **db_kwargs: Any,
+) -> Callable[[int], Dict[str, Any]]:
+    """获取内存图并构建过滤条件,返回对单个起点执行 top-k 搜索的函数。
+
+    参数含义同 query_cycles,timeout_ms 对每个起点单独计时。
+    返回的函数一直使用此时取得的图,调用方应在 graph_cache.pinned_graph 内使用它。
+    """
+    if order_by not in ORDER_BY:
+        raise ValueError(f"Order by must be one of: {', '.join(ORDER_BY)}")
+
+    graph = graph_cache.get_graph(username, **db_kwargs)
+    edge_ok = _edge_filter(
+        graph,
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+    )
+    scc_index = scc.get_index(graph)
+
+    def search(start_vid: int) -> Dict[str, Any]:
+        start_time = time.time()
+        deadline = Deadline(timeout_ms)
+        try:
+            # 1. 验证起始点存在
+            start_vertex = graph.get_vertex(start_vid)
+            if not start_vertex:
+                return {"status": "error", "message": f"Start vertex {start_vid} not found"}
+
+            # 2. 检查起始点是否满足过滤条件
+            if not _vertex_matches_filter(
+                start_vertex, vertex_filter_v_types, vertex_filter_min_balance
+            ):
+                return {
+                    "status": "success",
+                    "found": False,
+                    "message": "Start vertex does not match filters",
+                }
+
+            # 3. 起点不在任何环上时直接返回,否则只在起点所在的强连通分量内搜索
+            start = graph.vertex_index(start_vid)
+            if not scc_index.on_cycle(start):
+                return {
+                    "status": "success",
+                    "found": False,
+                    "message": "Start vertex is not on any cycle",
+                }
+            component_ok = scc.component_edge_filter(graph, scc_index, start, edge_ok)
+
+            # 4. 最优优先搜索
+            stats = {"expanded": 0}
+            cycles: List[Tuple[float, List[int]]] = []
+            truncated = False
+            try:
+                best_first = iter_best_cycles(
+                    graph,
+                    start,
+                    max_depth,
+                    direction,
+                    component_ok,
+                    order_by,
+                    allow_duplicate_vertices,
+                    allow_duplicate_edges,
+                    deadline,
+                    stats,
+                )
+                for score, path in best_first:
+                    cycles.append((score, path))
+                    if len(cycles) >= limit:
+                        break
+            except SearchTimeout:
+                truncated = True
+
+            # 5. 构造返回结果
+            execution_time = int((time.time() - start_time) * 1000)
+            meta = {
+                "execution_time_ms": execution_time,
+                "order_by": order_by,
+                "expanded": stats["expanded"],
+                "complete": not truncated and len(cycles) < limit,
+                "truncated": truncated,
+            }
+
+            if not cycles:
+                return {"status": "success", "found": False, "meta": meta}
+
+            vids, eids = graph.vids, graph.eids
+            src_col, dst_col = graph.src, graph.dst
+            cycle_data = []
+            for score, path in cycles:
+                cycle_path = [
+                    (vids[src_col[ei]], vids[dst_col[ei]], eids[ei], ei) for ei in path
+                ]
+                vertices_data, edges_data = _get_cycle_details_from_memory(
+                    cycle_path, graph
+                )
+                cycle_data.append(
+                    {"vertices": vertices_data, "edges": edges_data, "score": score}
+                )
+
+            return {
+                "status": "success",
+                "found": True,
+                "count": len(cycle_data),
+                "data": cycle_data,
+                "meta": meta,
+            }
+
+        except Exception as e:
+            return {"status": "error", "message": f"Cycle query failed: {e}"}
+
+    return search
+
+
+def iter_best_cycles(
+    graph: MemGraph,
+    start: int,
+    max_depth: int,
+    direction: str,
+    edge_ok: Optional[Callable[[int], bool]],
+    order_by: str,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    deadline: Optional[Deadline] = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Tuple[float, List[int]]]:
+    """从起点(点下标)按得分从优到劣逐个产出 (得分, 边下标列表)。
+
+    每取出一个部分路径检查一次 deadline,到期时抛出 SearchTimeout。
+    """
+    temporal = direction == "forward"
+    dist, ball_edges = distance_to_start(graph, start, max_depth, edge_ok, deadline)
+    latest = _latest_departure(graph, start, ball_edges) if temporal else None
+
+    amount_col, dst_col, time_col = graph.amount, graph.dst, graph.occur_time
+    if order_by == "duration":
+        # 累计值为 (最早时间, 最晚时间),跨度只增不减,当前跨度即下界
+        start_acc = None
+
+        def extend(acc, ei):
+            t = time_col[ei]
+            return (t, t) if acc is None else (min(acc[0], t), max(acc[1], t))
+
+        def key(acc):
+            return 0 if acc is None else -(acc[1] - acc[0])
+
+        def bound(acc, vi, remaining):
+            return key(acc) if dist.get(vi, _INF) <= remaining else None
+
+        def score(acc):
+            return acc[1] - acc[0]
+
+    else:
+        if order_by == "total_amount":
+            start_acc, step = 0, lambda a, b: a + b
+        else:
+            start_acc, step = _INF, min
+        best = _bound_table(graph, start, ball_edges, max_depth, start_acc, step)
+
+        def extend(acc, ei):
+            return step(acc, amount_col[ei])
+
+        def key(acc):
+            return acc
+
+        def bound(acc, vi, remaining):
+            rest = best[remaining].get(vi)
+            return None if rest is None else step(acc, rest)
+
+        score = key
+
+    start_bound = bound(start_acc, start, max_depth)
+    if start_bound is None:
+        return
+
+    # 堆元素: (-上界, 是否未完成, 序号, 点下标, 深度, 累计得分, 到达时间, 路径链表)
+    # 路径链表为 (边下标, 上一节点) 的嵌套元组;同上界时完整的环先出堆
+    tiebreak = count()
+    heap = [(-start_bound, 1, next(tiebreak), start, 0, start_acc, 0, None)]
+    while heap:
+        neg, partial, _, vi, depth, acc, arrival, node = heapq.heappop(heap)
+        if not partial:
+            yield score(acc), _path_edges(node)
+            continue
+
+        if deadline is not None:
+            deadline.check()
+        if stats is not None:
+            stats["expanded"] += 1
+
+        on_path, used = _path_sets(node, dst_col)
+        for ei in graph.out_edge_indices(vi, after=arrival if temporal else None):
+            if edge_ok is not None and not edge_ok(ei):
+                continue
+            if not allow_duplicate_edges and ei in used:
+                continue
+
+            nxt = dst_col[ei]
+            new_acc = extend(acc, ei)
+            if nxt == start:
+                heapq.heappush(
+                    heap, (-key(new_acc), 0, next(tiebreak), nxt, depth + 1, new_acc, 0, (ei, node))
+                )
+                continue
+
+            remaining = max_depth - depth - 1
+            t = time_col[ei]
+            if temporal and t >= latest.get(nxt, t):
+                continue
+            if not allow_duplicate_vertices and nxt in on_path:
+                continue
+            ub = bound(new_acc, nxt, remaining)
+            if ub is None:
+                continue
+            heapq.heappush(
+                heap, (-ub, 1, next(tiebreak), nxt, depth + 1, new_acc, t, (ei, node))
+            )
+
+
+def _bound_table(
+    graph: MemGraph,
+    start: int,
+    ball_edges: List[int],
+    max_depth: int,
+    identity: float,
+    step: Callable[[float, float], float],
+) -> List[Dict[int, float]]:
+    """计算每个点在 k 步内回到起点的最优得分上界,返回 tables[k][点下标]。
+
+    tables[0] 只包含起点(得分为 identity);第 k 轮用所有边 u -> w 松弛
+    tables[k][u] = max(tables[k-1][u], step(amount, tables[k-1][w]))。
+    不在 tables[k] 中的点无法在 k 步内回到起点。
+    """
+    amount_col, src_col, dst_col = graph.amount, graph.src, graph.dst
+    tables: List[Dict[int, float]] = [{start: identity}]
+    for _ in range(max_depth):
+        prev = tables[-1]
+        cur = dict(prev)
+        for ei in ball_edges:
+            rest = prev.get(dst_col[ei])
+            if rest is None:
+                continue
+            value = step(amount_col[ei], rest)
+            u = src_col[ei]
+            old = cur.get(u)
+            if old is None or value > old:
+                cur[u] = value
+        if cur == prev:
+            # 已收敛,之后各轮相同
+            tables.extend([prev] * (max_depth + 1 - len(tables)))
+            break
+        tables.append(cur)
+    return tables
+
+
+def _path_edges(node: Optional[Tuple[int, Any]]) -> List[int]:
+    edges: List[int] = []
+    while node is not None:
+        ei, node = node
+        edges.append(ei)
+    edges.reverse()
+    return edges
+
+
+def _path_sets(node: Optional[Tuple[int, Any]], dst_col) -> Tuple[set, set]:
+    """路径上经过的点(不含起点)和边。"""
+    on_path, used = set(), set()
+    while node is not None:
+        ei, node = node
+        used.add(ei)
+        on_path.add(dst_col[ei])
+    return on_path, used
@@ -0,0 +1,34 @@
+"""搜索期限 - 环路查询的时间预算。
+
+查询指定 timeout_ms 后,搜索在两次扩展之间(以及扩展内部逐个状态)检查期限,
+到期后停止搜索并返回已找到的环,meta.truncated 为 True。数据库引擎另外通过
+graph_dao.statement_deadline 把剩余时间设为语句的 statement_timeout,
+由数据库取消超时的语句。
+"""
+
+import time
+from typing import Optional
+
+
+class SearchTimeout(Exception):
+    """搜索期限已到。"""
+
+
+class Deadline:
+    """从创建时开始计时的期限,timeout_ms 为 None 时永不到期。"""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, timeout_ms: Optional[int] = None):
+        self.expires_at = (
+            None if timeout_ms is None else time.monotonic() + timeout_ms / 1000
+        )
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self) -> None:
+        """期限已到时抛出 SearchTimeout,用于中断一层扩展。"""
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise SearchTimeout()
+
@@ -0,0 +1,213 @@
+"""过滤视图 - 以位图的形式把过滤条件作用在缓存的基础图上。
+
+同一用户的所有环路查询共用 graph_cache 中不带过滤条件的基础图。过滤条件
+预先计算成点位图和边位图(bytearray,1 表示满足条件),查询时只需选择视图,
+按下标查表即可判断点和边是否满足条件,过滤条件变化不会重新加载图。
+
+视图按规范化的过滤条件缓存在图对象上(MemGraph.filter_views),超过 MAX_VIEWS
+个时按 LRU 淘汰。视图只对计算它的图对象的某个版本有效。写操作修补图时
+(MemGraph 的 insert/update/delete)同步修补缓存的视图(FilterView.refresh):
+新增的点和边补齐到位图末尾,余额或类型变化的点重新计算,结果变化时连同它的
+邻接边一起重新计算,不需要重新扫描全图。graph_cache 修补副本时副本带着视图的
+拷贝。只有压缩重新编号边下标时视图全部作废,下次使用时重新计算。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple
+from server.core.mem_graph import MemGraph
+
+
+MAX_VIEWS = 16  # 每个图最多缓存的视图数
+
+FilterKey = Tuple[
+    Optional[Tuple[str, ...]], Optional[int], Optional[Tuple[str, ...]], Optional[int], Optional[int]
+]
+
+_lock = threading.Lock()
+
+
+class FilterView:
+    """一组过滤条件在某个版本的图上对应的点位图和边位图。
+
+    边需要自身满足边过滤条件,且源点和目标点都满足点过滤条件。
+    位图计算之后新增(且没有经 refresh 补齐)的点和边视为不满足条件。
+    """
+
+    __slots__ = ("version", "key", "vertex_mask", "edge_mask")
+
+    def __init__(
+        self, version: int, key: FilterKey, vertex_mask: bytearray, edge_mask: bytearray
+    ):
+        self.version = version
+        self.key = key
+        self.vertex_mask = vertex_mask
+        self.edge_mask = edge_mask
+
+    def copy(self) -> "FilterView":
+        return FilterView(self.version, self.key, self.vertex_mask[:], self.edge_mask[:])
+
+    def refresh(self, graph: MemGraph, vertices: Iterable[int], edges: Iterable[int]) -> None:
+        """图修补之后修补位图,使视图对应图的当前版本。
+
+        新增的点和边补齐到位图末尾;vertices 中的点(余额或类型可能变化)重新计算,
+        结果变化时它的邻接边一起重新计算;edges 中的边(金额或类型可能变化)重新计算。
+        已删除的边不会再被访问,它们的位不再修补。
+        """
+        vertex_ok, edge_ok = _predicates(graph, self.key, self.vertex_mask)
+        vertex_mask, edge_mask = self.vertex_mask, self.edge_mask
+        vertex_mask.extend(vertex_ok(vi) for vi in range(len(vertex_mask), len(graph.vids)))
+
+        changed = set(edges)
+        for vi in vertices:
+            bit = vertex_ok(vi)
+            if bit != vertex_mask[vi]:
+                vertex_mask[vi] = bit
+                changed.update(graph.out_edge_indices(vi))
+                changed.update(graph.in_edge_indices(vi))
+
+        size = len(edge_mask)
+        for ei in changed:
+            if ei < size:
+                edge_mask[ei] = edge_ok(ei)
+        edge_mask.extend(edge_ok(ei) for ei in range(size, len(graph.eids)))
+        self.version = graph.version
+
+    def vertex_ok(self, vi: int) -> bool:
+        return vi < len(self.vertex_mask) and bool(self.vertex_mask[vi])
+
+    @property
+    def edge_ok(self) -> Callable[[int], bool]:
+        mask, size = self.edge_mask, len(self.edge_mask)
+
+        def edge_ok(ei: int) -> bool:
+            return ei < size and bool(mask[ei])
+
+        return edge_ok
+
+
+def filter_key(
+    vertex_filter_v_types: Optional[List[str]],
+    vertex_filter_min_balance: Optional[int],
+    edge_filter_e_types: Optional[List[str]],
+    edge_filter_min_amount: Optional[int],
+    edge_filter_max_amount: Optional[int],
+) -> Optional[FilterKey]:
+    """规范化过滤条件(类型列表去重排序),没有任何过滤条件时返回 None。"""
+    key = (
+        tuple(sorted(set(vertex_filter_v_types))) if vertex_filter_v_types else None,
+        vertex_filter_min_balance,
+        tuple(sorted(set(edge_filter_e_types))) if edge_filter_e_types else None,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+    )
+    return None if key == (None, None, None, None, None) else key
+
+
+def get_view(
+    graph: MemGraph,
+    vertex_filter_v_types: Optional[List[str]],
+    vertex_filter_min_balance: Optional[int],
+    edge_filter_e_types: Optional[List[str]],
+    edge_filter_min_amount: Optional[int],
+    edge_filter_max_amount: Optional[int],
+) -> Optional[FilterView]:
+    """获取过滤条件对应的视图,没有任何过滤条件时返回 None。"""
+    key = filter_key(
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+    )
+    if key is None:
+        return None
+
+    with _lock:
+        views = graph.filter_views
+        view = views.get(key)
+        if view is not None and view.version == graph.version:
+            views.move_to_end(key)
+            return view
+
+    view = _build_view(graph, key)
+
+    with _lock:
+        views = graph.filter_views
+        # 图已修补过,旧版本的视图全部作废
+        for stale in [k for k, v in views.items() if v.version != graph.version]:
+            del views[stale]
+        if view.version == graph.version:
+            views[key] = view
+            views.move_to_end(key)
+            while len(views) > MAX_VIEWS:
+                views.popitem(last=False)
+    return view
+
+
+def _type_codes(graph: MemGraph, key: FilterKey) -> Tuple[Optional[set], Optional[set]]:
+    """类型过滤转换为字典编码集合,图中(尚)不存在的类型直接忽略。"""
+    v_type_names, _, e_type_names, _, _ = key
+    v_types = (
+        {graph.v_type_code(t) for t in v_type_names} - {None} if v_type_names else None
+    )
+    e_types = (
+        {graph.e_type_code(t) for t in e_type_names} - {None} if e_type_names else None
+    )
+    return v_types, e_types
+
+
+def _predicates(
+    graph: MemGraph, key: FilterKey, vertex_mask: bytearray
+) -> Tuple[Callable[[int], int], Callable[[int], int]]:
+    """逐个判断点和边的函数(返回 0/1),与 _build_view 的批量计算一致。
+
+    边的判断读取 vertex_mask 中源点和目标点的结果。
+    """
+    _, min_balance, _, min_amount, max_amount = key
+    v_types, e_types = _type_codes(graph, key)
+    v_type, balance = graph.v_type, graph.balance
+    src, dst, e_type, amount = graph.src, graph.dst, graph.e_type, graph.amount
+
+    def vertex_ok(vi: int) -> int:
+        return int(
+            (v_types is None or v_type[vi] in v_types)
+            and (min_balance is None or balance[vi] >= min_balance)
+        )
+
+    def edge_ok(ei: int) -> int:
+        return int(
+            vertex_mask[src[ei]]
+            and vertex_mask[dst[ei]]
+            and (e_types is None or e_type[ei] in e_types)
+            and (min_amount is None or amount[ei] >= min_amount)
+            and (max_amount is None or amount[ei] <= max_amount)
+        )
+
+    return vertex_ok, edge_ok
+
+
+def _build_view(graph: MemGraph, key: FilterKey) -> FilterView:
+    """按过滤条件扫描点列和边列,计算位图。"""
+    _, min_balance, _, min_amount, max_amount = key
+    version = graph.version
+    v_types, e_types = _type_codes(graph, key)
+
+    if v_types is None and min_balance is None:
+        vertex_mask = bytearray(b"\x01" * len(graph.vids))
+    else:
+        vertex_mask = bytearray(
+            (v_types is None or v_type in v_types)
+            and (min_balance is None or balance >= min_balance)
+            for v_type, balance in zip(graph.v_type, graph.balance)
+        )
+
+    edge_mask = bytearray(
+        vertex_mask[src]
+        and vertex_mask[dst]
+        and (e_types is None or e_type in e_types)
+        and (min_amount is None or amount >= min_amount)
+        and (max_amount is None or amount <= max_amount)
+        for src, dst, e_type, amount in zip(graph.src, graph.dst, graph.e_type, graph.amount)
+    )
+    return FilterView(version, key, vertex_mask, edge_mask)
@@ -0,0 +1,255 @@
+"""向量化前沿扩展 - 用 NumPy 批量完成内存双向BFS的一层扩展(可选依赖)。
+
+纯 Python 的扩展循环每访问一条边约 1µs,图缓存后这部分占了大部分 CPU。
+前沿较大时改用本模块:
+1. 按 CSR 偏移一次取出前沿所有点的邻接边,增量邻接表中的边逐点补充;
+2. 存活、时序、过滤视图的边位图、分量限制、剩余深度、时间包络等条件
+   都转为布尔掩码批量计算;
+3. 用路径签名位图批量排除肯定不在路径上的点,只有签名冲突的候选才沿
+   父指针逐个确认;
+4. 按目标点分组(np.unique),每个点只保留到第一个确定不在路径上的候选为止,
+   剩下的少量候选再按顺序追加为新状态。
+
+扩展结果(新状态及其顺序)与纯 Python 版本完全一致。未安装 NumPy 时
+available() 返回 False,调用方继续使用纯 Python 版本。
+
+MemGraph 和 PathArena 的列都是 array.array,NumPy 视图存在期间不能扩容
+(append 抛出 BufferError)。PathArena 只属于本次搜索,视图只在计算候选时临时
+创建,追加新状态前全部释放。MemGraph 由其它线程的写操作修补,因此扩展器只能
+用在 graph_cache.pinned_graph 固定的图上: 被固定的图不会被原地修补,写操作
+修补的是副本,视图存在期间图的列不会扩容。
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from server.core.mem_graph import MemGraph
+from server.core.path_arena import SIGNATURE_BITS, PathArena
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 NumPy 时只使用纯 Python 扩展
+    np = None
+
+
+# 前沿的邻接边数(按度数估计)不少于该值时才使用向量化扩展
+VECTOR_MIN_EDGES = 1024
+
+
+def available() -> bool:
+    return np is not None
+
+
+class FrontierKernel:
+    """单次搜索共用的向量化扩展器,保存过滤位图和剪枝数据。"""
+
+    def __init__(
+        self,
+        graph: MemGraph,
+        edge_mask: Optional[bytearray] = None,
+        comp: Optional[Any] = None,
+        component: Optional[int] = None,
+    ):
+        """
+        Args:
+            graph: 内存图,必须在搜索期间保持固定(graph_cache.pinned_graph)
+            edge_mask: 过滤视图的边位图(FilterView.edge_mask), None 表示不过滤
+            comp: 点下标 -> 分量编号(SccIndex.comp),与 component 一起限制只走分量内的边
+        """
+        self.graph = graph
+        self.edge_mask = edge_mask
+        self.comp = comp
+        self.component = component
+        self.dist_keys = self.dist_values = None
+
+    def use_distances(self, dist_to_start: Dict[int, int]) -> None:
+        """设置每个点回到起点的最少边数,正向扩展时用于剪枝。
+
+        按点下标排序后二分查找,内存只与可达点数量成正比。
+        """
+        keys = sorted(dist_to_start)
+        self.dist_keys = np.array(keys, dtype=np.int64)
+        self.dist_values = np.array([dist_to_start[k] for k in keys], dtype=np.int64)
+
+    def expand_forward(
+        self,
+        frontier: List[int],
+        arena: PathArena,
+        state: Dict[int, int],
+        target_depth: int,
+        temporal: bool,
+        max_depth: int,
+    ) -> List[int]:
+        """正向扩展一层,语义同 membibfs._expand_forward_memory。"""
+        return self._expand(frontier, arena, state, target_depth, temporal, True, max_depth)
+
+    def expand_backward(
+        self,
+        frontier: List[int],
+        arena: PathArena,
+        state: Dict[int, int],
+        target_depth: int,
+        temporal: bool,
+    ) -> List[int]:
+        """反向扩展一层,语义同 membibfs._expand_backward_memory。"""
+        return self._expand(frontier, arena, state, target_depth, temporal, False, 0)
+
+    # ==================== 内部实现 ====================
+
+    def _expand(
+        self,
+        frontier: List[int],
+        arena: PathArena,
+        state: Dict[int, int],
+        target_depth: int,
+        temporal: bool,
+        outgoing: bool,
+        max_depth: int,
+    ) -> List[int]:
+        if not frontier:
+            return []
+
+        parents, ends, eis, times = self._candidates(
+            frontier, arena, temporal, outgoing, max_depth - target_depth
+        )
+
+        # 按顺序采用每个目标点第一个不在路径上的候选(签名不冲突时 on_path 立即返回)
+        new_frontier: List[int] = []
+        claimed = set()
+        for parent, end, ei, t in zip(parents, ends, eis, times):
+            if end in claimed or arena.on_path(parent, end):
+                continue
+            claimed.add(end)
+            new_sid = arena.add(parent, end, ei, t)
+            state[end] = new_sid
+            new_frontier.append(new_sid)
+        return new_frontier
+
+    def _candidates(
+        self,
+        frontier: List[int],
+        arena: PathArena,
+        temporal: bool,
+        outgoing: bool,
+        remaining: int,
+    ) -> Tuple[List[int], List[int], List[int], List[int]]:
+        """批量计算候选 (父状态, 目标点, 边, 时间),按纯 Python 版本的访问顺序排列。
+
+        每个目标点只保留到第一个签名不冲突的候选为止,签名冲突的候选由调用方确认。
+        """
+        graph = self.graph
+        sids = np.array(frontier, dtype=np.int64)
+        vis = np.frombuffer(arena.vi, dtype=np.int32)[sids].astype(np.int64)
+        arrival = np.frombuffer(arena.time, dtype=np.int64)[sids]
+        sigs = np.frombuffer(arena.sig, dtype=np.uint64)[sids]
+
+        # 1. 取出前沿所有点的邻接边: CSR 部分按偏移展开,增量部分逐点补充
+        if outgoing:
+            offsets, targets, extra = graph.out_offsets, graph.out_edges, graph._extra_out
+            ends_col = graph.dst
+        else:
+            offsets, targets, extra = graph.in_offsets, graph.in_edges, graph._extra_in
+            ends_col = graph.src
+        owner, eis = _gather_csr(vis, offsets, targets, graph.base_vertices)
+        if extra:
+            more = [
+                (k, ei)
+                for k, vi in enumerate(vis.tolist())
+                for ei in extra.get(vi, ())
+            ]
+            if more:
+                extra_owner, extra_eis = zip(*more)
+                owner = np.concatenate([owner, np.array(extra_owner, dtype=np.int64)])
+                eis = np.concatenate([eis, np.array(extra_eis, dtype=np.int64)])
+                # 稳定排序: 同一前沿状态内 CSR 部分在前,增量部分在后
+                order = np.argsort(owner, kind="stable")
+                owner, eis = owner[order], eis[order]
+
+        # 2. 条件掩码
+        time_col = np.frombuffer(graph.occur_time, dtype=np.int64)
+        ends = np.frombuffer(ends_col, dtype=np.int32)[eis].astype(np.int64)
+        etime = time_col[eis]
+        keep = np.frombuffer(graph.e_alive, dtype=np.uint8)[eis] != 0
+        if temporal:
+            if outgoing:
+                keep &= etime > arrival[owner]
+            else:
+                # 反向搜索时间更早,起点(时间为 0)不限制
+                before = arrival[owner]
+                keep &= (etime < before) | (before == 0)
+        keep &= self._filter_mask(eis)
+
+        if outgoing:
+            # 剩余深度不足以回到起点
+            if self.dist_keys is not None:
+                keep &= self._dist_ok(ends, remaining)
+            # 时间包络: 到达后无法再按时序离开该点或回到起点
+            if temporal:
+                latest_return = graph.in_time_max[arena.vi[0]]  # 状态 0 是起点
+                out_time_max = np.frombuffer(graph.out_time_max, dtype=np.int64)
+                keep &= (etime < out_time_max[ends]) & (etime < latest_return)
+
+        owner, ends, eis, etime = owner[keep], ends[keep], eis[keep], etime[keep]
+
+        # 3. 路径签名: 对应位为 0 的点肯定不在路径上。每个目标点第一个签名
+        #    不冲突的候选一定会被采用(除非已被更早的候选占用),之后的候选都可以丢弃
+        bits = (sigs[owner] >> (ends % SIGNATURE_BITS).astype(np.uint64)) & np.uint64(1)
+        n = len(ends)
+        positions = np.arange(n, dtype=np.int64)
+        uniq, inverse = np.unique(ends, return_inverse=True)
+        first_clear = np.full(len(uniq), n, dtype=np.int64)
+        clear = bits == 0
+        np.minimum.at(first_clear, inverse[clear], positions[clear])
+        idx = np.flatnonzero(positions <= first_clear[inverse])
+
+        return (
+            sids[owner[idx]].tolist(),
+            ends[idx].tolist(),
+            eis[idx].tolist(),
+            etime[idx].tolist(),
+        )
+
+    def _filter_mask(self, eis: "np.ndarray") -> "np.ndarray":
+        """过滤视图的边位图和分量限制。位图计算之后新增的边视为不满足条件。"""
+        keep = np.ones(len(eis), dtype=bool)
+
+        if self.edge_mask is not None:
+            mask = np.frombuffer(self.edge_mask, dtype=np.uint8)
+            inside = eis < len(mask)
+            keep &= inside
+            keep[inside] &= mask[eis[inside]] != 0
+
+        if self.comp is not None:
+            graph = self.graph
+            comp = np.frombuffer(self.comp, dtype=np.int32)
+            src = np.frombuffer(graph.src, dtype=np.int32)[eis]
+            dst = np.frombuffer(graph.dst, dtype=np.int32)[eis]
+            keep &= (comp[src] == self.component) & (comp[dst] == self.component)
+        return keep
+
+    def _dist_ok(self, ends: "np.ndarray", remaining: int) -> "np.ndarray":
+        """目标点在距离表中,且回到起点所需边数不超过剩余深度。"""
+        keys = self.dist_keys
+        pos = np.searchsorted(keys, ends)
+        pos_clipped = np.minimum(pos, len(keys) - 1)
+        found = (pos < len(keys)) & (keys[pos_clipped] == ends)
+        return found & (self.dist_values[pos_clipped] <= remaining)
+
+
+def _gather_csr(
+    vis: "np.ndarray", offsets: Any, targets: Any, base_vertices: int
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """展开前沿各点在 CSR 中的邻接区间,返回 (所属前沿位置, 边下标),按前沿顺序排列。"""
+    offsets = np.frombuffer(offsets, dtype=np.int64)
+    targets = np.frombuffer(targets, dtype=np.int32)
+    in_base = vis < base_vertices
+    lo = np.zeros(len(vis), dtype=np.int64)
+    hi = np.zeros(len(vis), dtype=np.int64)
+    lo[in_base] = offsets[vis[in_base]]
+    hi[in_base] = offsets[vis[in_base] + 1]
+    counts = hi - lo
+
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(vis), dtype=np.int64), counts)
+    # 每条边在 targets 中的位置: 区间起点 + 区间内的偏移
+    starts = np.cumsum(counts) - counts
+    positions = np.arange(total, dtype=np.int64) - np.repeat(starts - lo, counts)
+    return owner, targets[positions].astype(np.int64)
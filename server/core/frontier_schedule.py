@@ -0,0 +1,67 @@
+"""双向搜索的扩展调度。
+
+双向BFS不再严格交替扩展正向和反向,而是每一步扩展估计代价更低的一侧
+(代价为该侧当前层所有点的度数之和,即扩展时需要扫描的边数)。
+两侧深度之和不超过 max_depth,因此找到的环长度不会超过 max_depth。
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+FORWARD = "fwd"
+BACKWARD = "bwd"
+
+
+class FrontierSchedule:
+    """记录两侧已扩展的深度,并选择下一步扩展哪一侧。"""
+
+    def __init__(self, max_depth: int) -> None:
+        self.max_depth = max_depth
+        self.depth = {FORWARD: 0, BACKWARD: 0}
+        self.steps: List[str] = []
+        self.truncated = False  # 搜索期限已到,提前停止
+        self._exhausted = set()
+
+    def next_side(self, fwd_cost: int, bwd_cost: int) -> Optional[str]:
+        """返回下一步要扩展的一侧,深度预算用完或无法再扩展时返回 None。
+
+        代价相同时优先扩展较浅的一侧,再相同时优先正向。
+        """
+        if self.depth[FORWARD] + self.depth[BACKWARD] >= self.max_depth:
+            return None
+        # 任一侧从起点就无法扩展,不可能存在环
+        if any(self.depth[side] == 0 for side in self._exhausted):
+            return None
+
+        costs = {FORWARD: fwd_cost, BACKWARD: bwd_cost}
+        candidates = [side for side in (FORWARD, BACKWARD) if side not in self._exhausted]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda side: (costs[side], self.depth[side]))
+
+    def advance(self, side: str) -> int:
+        """记录一侧成功扩展一层,返回该侧的新深度。"""
+        self.depth[side] += 1
+        self.steps.append(side)
+        return self.depth[side]
+
+    def exhaust(self, side: str) -> None:
+        """标记一侧已无法继续扩展,之后只扩展另一侧。"""
+        self._exhausted.add(side)
+
+    def truncate(self) -> None:
+        """标记搜索因期限已到而提前停止。"""
+        self.truncated = True
+
+    def meta(self) -> Dict[str, Any]:
+        """返回写入查询结果 meta 的调度信息。
+
+        depth_reached 为两侧已扩展的深度之和,即已搜索过的环长度上限。
+        """
+        return {
+            "schedule": list(self.steps),
+            "forward_depth": self.depth[FORWARD],
+            "backward_depth": self.depth[BACKWARD],
+            "depth_reached": self.depth[FORWARD] + self.depth[BACKWARD],
+            "truncated": self.truncated,
+        }
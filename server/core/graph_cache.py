@@ -0,0 +1,271 @@
+"""图缓存 - 进程级的按用户内存图缓存。
+
+每个用户的全图只在第一次环路查询时加载(优先读取 snapshot 快照并重放变更日志,
+没有可用快照时从数据库全量加载),之后常驻内存;
+graph_service 的写操作通过 `patch` 同步修补缓存中的图,同时累计写操作数,
+定期在后台刷新快照(snapshot.record_write)。服务启动时可以用 `warm_graphs`
+在后台预先加载指定用户的图。多个用户之间按 LRU 淘汰,总的估算内存占用不超过预算。
+
+环路查询在搜索期间用 `pinned_graph` 固定图对象。图被固定时写操作不原地修改它,
+而是复制一份、修补副本后替换缓存中的图(写时复制): 正在进行的搜索继续使用
+原来的图,其中的边下标、过滤位图、分量编号和 NumPy 视图始终对应同一个图;
+没有查询固定时直接原地修补,不产生复制开销。
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from server.core.mem_graph import MemGraph
+from server.core.snapshot import load_graph, record_write
+
+
+# 所有用户内存图的默认总预算(字节)
+DEFAULT_MEMORY_BUDGET = 8 * 1024 * 1024 * 1024
+
+
+class GraphCache:
+    """按用户名缓存 MemGraph,带内存预算和 LRU 淘汰。"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MEMORY_BUDGET):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, MemGraph]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        # 每个用户的写入代数,用于发现加载期间发生的写操作
+        self._generations: Dict[str, int] = {}
+        # 图对象(id) -> 固定次数。被固定的图不会被原地修补
+        self._pins: Dict[int, int] = {}
+
+    def get(
+        self,
+        username: str,
+        loader: Callable[..., MemGraph] = load_graph,
+        **db_kwargs: Any,
+    ) -> MemGraph:
+        """获取用户的内存图,不存在时加载。"""
+        return self._get(username, loader, False, **db_kwargs)
+
+    def acquire(
+        self,
+        username: str,
+        loader: Callable[..., MemGraph] = load_graph,
+        **db_kwargs: Any,
+    ) -> MemGraph:
+        """获取并固定用户的内存图,不存在时加载。用完后必须调用 release。"""
+        return self._get(username, loader, True, **db_kwargs)
+
+    def acquire_cached(self, username: str) -> Optional[MemGraph]:
+        """固定已缓存的图,不触发加载;没有缓存时返回 None。"""
+        with self._lock:
+            graph = self._entries.get(username)
+            if graph is not None:
+                self._pin(graph)
+            return graph
+
+    def release(self, graph: MemGraph) -> None:
+        """解除 acquire/acquire_cached 的固定。"""
+        with self._lock:
+            key = id(graph)
+            if self._pins[key] == 1:
+                del self._pins[key]
+            else:
+                self._pins[key] -= 1
+
+    def _get(
+        self,
+        username: str,
+        loader: Callable[..., MemGraph],
+        pin: bool,
+        **db_kwargs: Any,
+    ) -> MemGraph:
+        with self._lock:
+            graph = self._entries.get(username)
+            if graph is not None:
+                self._entries.move_to_end(username)
+                if pin:
+                    self._pin(graph)
+                return graph
+            load_lock = self._load_locks.setdefault(username, threading.Lock())
+
+        # 同一用户的并发首次查询只加载一次
+        with load_lock:
+            while True:
+                with self._lock:
+                    graph = self._entries.get(username)
+                    if graph is not None:
+                        self._entries.move_to_end(username)
+                        if pin:
+                            self._pin(graph)
+                        return graph
+                    generation = self._generations.get(username, 0)
+
+                graph = loader(username, **db_kwargs)
+
+                with self._lock:
+                    # 加载期间有写操作,读到的数据可能不一致,重新加载
+                    if self._generations.get(username, 0) != generation:
+                        continue
+                    self._entries[username] = graph
+                    self._evict(keep=username)
+                    if pin:
+                        self._pin(graph)
+                    return graph
+
+    def put(self, username: str, graph: MemGraph) -> None:
+        """放入已经加载好的图,替换该用户原有的缓存。"""
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            self._entries[username] = graph
+            self._entries.move_to_end(username)
+            self._evict(keep=username)
+
+    def peek(self, username: str) -> Optional[MemGraph]:
+        """返回已缓存的图,不触发加载。"""
+        with self._lock:
+            return self._entries.get(username)
+
+    def patch(self, username: str, fn: Callable[[MemGraph], None]) -> None:
+        """在写操作成功后修补缓存中的图。
+
+        图被查询固定时修补它的副本并替换缓存中的图,固定它的查询不受影响。
+        修补失败时直接丢弃该用户的缓存,下次查询重新加载。
+        """
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            graph = self._entries.get(username)
+            if graph is None:
+                return
+            try:
+                if id(graph) in self._pins:
+                    graph = graph.copy()
+                fn(graph)
+            except Exception:
+                self._entries.pop(username, None)
+                return
+            self._entries[username] = graph
+            self._evict(keep=username)
+
+    def invalidate(self, username: str) -> None:
+        """丢弃用户的缓存。"""
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            self._entries.pop(username, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            for username in self._entries:
+                self._generations[username] = self._generations.get(username, 0) + 1
+            self._entries.clear()
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(g.estimated_bytes() for g in self._entries.values())
+
+    def _pin(self, graph: MemGraph) -> None:
+        """固定图(调用方持有锁)。"""
+        self._pins[id(graph)] = self._pins.get(id(graph), 0) + 1
+
+    def _evict(self, keep: str) -> None:
+        """按 LRU 淘汰其他用户的图,直到总占用不超过预算(调用方持有锁)。"""
+        total = sum(g.estimated_bytes() for g in self._entries.values())
+        while total > self.max_bytes:
+            victim = next((u for u in self._entries if u != keep), None)
+            if victim is None:
+                break
+            total -= self._entries.pop(victim).estimated_bytes()
+
+
+# 进程级单例
+_cache = GraphCache()
+
+# 当前线程固定的图: 用户名 -> MemGraph
+_local = threading.local()
+
+
+@contextmanager
+def pinned_graph(username: str, load: bool = True, **db_kwargs: Any) -> Iterator[Optional[MemGraph]]:
+    """在当前线程固定用户的内存图,期间本线程的 get_graph 都返回这个图对象。
+
+    load=False 时只固定已缓存的图,没有缓存时产出 None。同一线程内可以嵌套,
+    内层直接使用外层固定的图。
+    """
+    pins: Dict[str, MemGraph] = _local.__dict__.setdefault("pins", {})
+    graph = pins.get(username)
+    if graph is not None:
+        yield graph
+        return
+
+    graph = _cache.acquire(username, **db_kwargs) if load else _cache.acquire_cached(username)
+    if graph is None:
+        yield None
+        return
+    pins[username] = graph
+    try:
+        yield graph
+    finally:
+        # 生成器中的固定可能在其它线程结束,因此直接操作进入时的字典
+        pins.pop(username, None)
+        _cache.release(graph)
+
+
+def get_graph(username: str, **db_kwargs: Any) -> MemGraph:
+    """获取用户的内存图(进程级缓存)。
+
+    当前线程固定了该用户的图时返回固定的图。未固定的图可能被写操作原地修补,
+    搜索应在 pinned_graph 内进行。
+    """
+    pins = getattr(_local, "pins", None)
+    if pins and username in pins:
+        return pins[username]
+    return _cache.get(username, **db_kwargs)
+
+
+def peek_graph(username: str) -> Optional[MemGraph]:
+    return _cache.peek(username)
+
+
+def put_graph(username: str, graph: MemGraph) -> None:
+    """放入已经加载好的图(batch_runner 的工作进程加载父进程导出的图后使用)。"""
+    _cache.put(username, graph)
+
+
+def patch(username: str, fn: Callable[[MemGraph], None], **db_kwargs: Any) -> None:
+    """写操作提交后修补缓存中的图(没有缓存时跳过),并记录一次写操作。"""
+    _cache.patch(username, fn)
+    record_write(username, **db_kwargs)
+
+
+def warm_graphs(usernames: List[str], **db_kwargs: Any) -> threading.Thread:
+    """在后台线程中依次加载用户的图(服务启动时调用),返回该线程。
+
+    加载失败的用户跳过,首次查询时再加载。
+    """
+
+    def run() -> None:
+        for username in usernames:
+            try:
+                _cache.get(username, **db_kwargs)
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=run, name="graph-warm", daemon=True)
+    thread.start()
+    return thread
+
+
+def invalidate(username: str) -> None:
+    _cache.invalidate(username)
+
+
+def memory_budget() -> int:
+    """所有用户内存图的总预算(字节)。"""
+    return _cache.max_bytes
+
+
+def set_memory_budget(max_bytes: int) -> None:
+    """设置所有用户内存图的总预算(字节)。"""
+    with _cache._lock:
+        _cache.max_bytes = max_bytes
+        _cache._evict(keep="")
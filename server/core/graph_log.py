@@ -0,0 +1,131 @@
+"""图变更日志 - 记录用户图的每次写操作,供内存图快照追赶变更。
+
+graph_service 的每个写操作在同一事务中向 graph_log_<user> 追加一行
+(op, payload),payload 是 MemGraph 对应修补方法的参数(JSON)。
+快照记录写入时的日志序号,加载快照后按序号重放之后的日志即可得到最新的图。
+
+seq 由 BIGSERIAL 在 INSERT 时分配,事务的提交顺序却可能不同: 序号较大的写操作
+先提交时,较小的序号还在未提交的事务中,直接读取 MAX(seq) 作为快照序号或重放
+上界会永久跳过它。seq_range 读取前以 SHARE 模式锁定日志表,与 INSERT 持有的
+ROW EXCLUSIVE 锁冲突,等待正在写日志的事务全部结束,因此返回的最大序号之前的
+日志都已提交,之后提交的日志序号都更大。
+
+快照写入后 prune 删除快照已包含的日志,只保留其中序号最大的一行作为下限标记:
+被删除的日志序号都小于剩余的最小序号,序号更早的快照(例如其它服务器上的)
+据此判断无法重放,回退到全量加载。
+"""
+
+import json
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Set, Tuple
+from server.opengauss.graph_dao import (
+    execute_ddl,
+    execute_dml,
+    fetch_iter,
+    fetch_prepared,
+    get_user_log_table_ddl,
+    get_user_log_table_name,
+    Vertex,
+    Edge,
+)
+from server.core.mem_graph import MemGraph
+
+
+# 已确认日志表存在的用户(进程内)
+_ensured: Set[str] = set()
+_ensured_lock = threading.Lock()
+
+
+def ensure_log_table(username: str, **db_kwargs: Any) -> None:
+    """确保用户的日志表存在(兼容日志表加入之前创建的用户),每个进程只检查一次。"""
+    with _ensured_lock:
+        if username in _ensured:
+            return
+    execute_ddl(get_user_log_table_ddl(username), **db_kwargs)
+    with _ensured_lock:
+        _ensured.add(username)
+
+
+def log_statement(
+    username: str, op: str, **payload: Any
+) -> Tuple[str, Tuple[str, str]]:
+    """返回追加一条日志的 (sql, params),由调用方与写操作放在同一事务中执行。"""
+    assert op in _APPLY, op
+    table_name = get_user_log_table_name(username)
+    return (
+        f"INSERT INTO {table_name} (op, payload) VALUES (%s, %s)",
+        (op, json.dumps(payload)),
+    )
+
+
+def seq_range(username: str, **db_kwargs: Any) -> Optional[Tuple[int, int]]:
+    """返回日志的 (最小序号, 最大序号),没有日志时为 (0, 0),日志表不存在时返回 None。
+
+    最大序号之前的日志都已提交(见模块说明),可以作为快照序号和重放上界。
+    """
+    table_name = get_user_log_table_name(username)
+    try:
+        rows = fetch_prepared(
+            [
+                (f"LOCK TABLE {table_name} IN SHARE MODE", None),
+                (f"SELECT COALESCE(MIN(seq), 0), COALESCE(MAX(seq), 0) FROM {table_name}", None),
+            ],
+            **db_kwargs,
+        )
+    except Exception:
+        return None
+    return (rows[0][0], rows[0][1]) if rows else (0, 0)
+
+
+def read_since(
+    username: str, seq: int, until: int, **db_kwargs: Any
+) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+    """按序号顺序产出序号在 (seq, until] 内的日志 (seq, op, payload)。"""
+    table_name = get_user_log_table_name(username)
+    for row_seq, op, payload in fetch_iter(
+        f"SELECT seq, op, payload FROM {table_name} WHERE seq > %s AND seq <= %s ORDER BY seq",
+        (seq, until),
+        **db_kwargs,
+    ):
+        yield row_seq, op, json.loads(payload)
+
+
+def prune(username: str, seq: int, **db_kwargs: Any) -> int:
+    """删除快照(日志序号 seq)已包含的日志,保留其中序号最大的一行作为下限标记。
+
+    Returns:
+        int: 删除的行数
+    """
+    table_name = get_user_log_table_name(username)
+    return execute_dml(
+        f"DELETE FROM {table_name} WHERE seq < "
+        f"(SELECT MAX(seq) FROM {table_name} WHERE seq <= %s)",
+        (seq,),
+        **db_kwargs,
+    )
+
+
+def replayable(snapshot_seq: int, first_seq: int) -> bool:
+    """快照之后的日志是否完整: 被删除的日志序号都小于剩余的最小序号 first_seq。"""
+    return first_seq == 0 or snapshot_seq >= first_seq - 1
+
+
+def apply(graph: MemGraph, op: str, payload: Dict[str, Any]) -> None:
+    """把一条日志重放到内存图上。"""
+    _APPLY[op](graph, payload)
+
+
+_APPLY: Dict[str, Callable[[MemGraph, Dict[str, Any]], None]] = {
+    "insert_vertex": lambda g, p: g.insert_vertex(
+        Vertex(p["vid"], p["v_type"], p["create_time"], p["balance"])
+    ),
+    "update_vertex": lambda g, p: g.update_vertex(p["vid"], p["v_type"], p["balance"]),
+    "delete_vertex": lambda g, p: g.delete_vertex(p["vid"]),
+    "insert_edge": lambda g, p: g.insert_edge(
+        Edge(p["eid"], p["src_vid"], p["dst_vid"], p["amount"], p["occur_time"], p["e_type"])
+    ),
+    "update_edge": lambda g, p: g.update_edge(
+        p["eid"], p["amount"], p["occur_time"], p["e_type"]
+    ),
+    "delete_edge": lambda g, p: g.delete_edge(p["eid"]),
+}
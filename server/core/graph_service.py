@@ -4,11 +4,12 @@
 """
 
 import time
-from typing import List, Dict, Any, Optional
+from contextlib import ExitStack
+from typing import Iterator, List, Dict, Any, Optional, Tuple
 from server.opengauss.graph_dao import (
-    execute_dml,
     execute_multi,
     fetch_all,
+    fetch_iter,
     fetch_one,
     Vertex,
     Edge,
@@ -17,6 +18,11 @@ from server.opengauss.graph_dao import (
 
 import server.core.bibfs as cycle_ag
 import server.core.membibfs as mem_cycle_ag
+import server.core.lazybfs as lazy_cycle_ag
+import server.core.cycle_enum as enum_cycle_ag
+import server.core.procbfs as proc_cycle_ag
+from server.core import cycle_scan, cycle_topk
+from server.core import batch_runner, cycle_planner, graph_cache, graph_log, scc
 
 
 # ==================== Vertex 操作 ====================
@@ -71,8 +77,11 @@ def query_vertices(
         if conditions:
             sql += " WHERE " + " AND ".join(conditions)
 
-        results = fetch_all(sql, tuple(params), **db_kwargs)
-        vertices = [Vertex.from_tuple(row).to_dict() for row in results]
+        # 逐批读取,不在内存中同时保留全部原始行和结果
+        vertices = [
+            Vertex.from_tuple(row).to_dict()
+            for row in fetch_iter(sql, tuple(params), **db_kwargs)
+        ]
 
         return {
             "status": "success",
@@ -135,10 +144,28 @@ def insert_vertex(
         if create_time is None:
             create_time = int(time.time())
 
-        # 插入点
-        execute_dml(
-            f"INSERT INTO {vertex_table_name} (vid, v_type, create_time, balance) VALUES (%s, %s, %s, %s)",
-            (vid, v_type, create_time, balance),
+        # 插入点,并在同一事务中记录变更日志
+        graph_log.ensure_log_table(username, **db_kwargs)
+        execute_multi(
+            [
+                (
+                    f"INSERT INTO {vertex_table_name} (vid, v_type, create_time, balance) VALUES (%s, %s, %s, %s)",
+                    (vid, v_type, create_time, balance),
+                ),
+                graph_log.log_statement(
+                    username,
+                    "insert_vertex",
+                    vid=vid,
+                    v_type=v_type,
+                    create_time=create_time,
+                    balance=balance,
+                ),
+            ],
+            **db_kwargs,
+        )
+        graph_cache.patch(
+            username,
+            lambda g: g.insert_vertex(Vertex(vid, v_type, create_time, balance)),
             **db_kwargs,
         )
 
@@ -223,8 +250,10 @@ def query_edges(
         if conditions:
             sql += " WHERE " + " AND ".join(conditions)
 
-        results = fetch_all(sql, tuple(params), **db_kwargs)
-        edges = [Edge.from_tuple(row).to_dict() for row in results]
+        edges = [
+            Edge.from_tuple(row).to_dict()
+            for row in fetch_iter(sql, tuple(params), **db_kwargs)
+        ]
 
         return {
             "status": "success",
@@ -362,8 +391,21 @@ def insert_edge(
                 f"INSERT INTO {edge_table_name} (eid, src_vid, dst_vid, amount, occur_time, e_type) VALUES (%s, %s, %s, %s, %s, %s)",
                 (eid, src_vid, dst_vid, amount, occur_time, e_type),
             ),
+            graph_log.log_statement(
+                username,
+                "insert_edge",
+                eid=eid,
+                src_vid=src_vid,
+                dst_vid=dst_vid,
+                amount=amount,
+                occur_time=occur_time,
+                e_type=e_type,
+            ),
         ]
+        graph_log.ensure_log_table(username, **db_kwargs)
         execute_multi(sql_list, **db_kwargs)
+        new_edge = Edge(eid, src_vid, dst_vid, amount, occur_time, e_type)
+        graph_cache.patch(username, lambda g: g.insert_edge(new_edge), **db_kwargs)
 
         return {
             "status": "success",
@@ -391,6 +433,18 @@ def insert_edge(
         return {"status": "error", "message": f"Insert edge failed: {e}"}
 
 
+# 环路搜索引擎: 名称 -> 实现模块
+CYCLE_ENGINES = {
+    "membibfs": mem_cycle_ag,
+    "bibfs": cycle_ag,
+    "lazybfs": lazy_cycle_ag,
+    "enum": enum_cycle_ag,
+    "procbfs": proc_cycle_ag,
+}
+
+MAX_BATCH_STARTS = 100000  # 单次批量查询最多的起点数
+
+
 def query_cycles(
     username: str,
     start_vid: int,
@@ -405,14 +459,30 @@ def query_cycles(
     allow_duplicate_vertices: bool = False,
     allow_duplicate_edges: bool = False,
     use_memory: bool = True,
+    engine: Optional[str] = None,
+    timeout_ms: Optional[int] = None,
+    order_by: Optional[str] = None,
 ) -> Dict[str, Any]:
     """查询环路。
 
     Args:
         username: 用户名，用于确定查询哪个用户的表
-        use_memory: 是否使用内存版本(默认True)。内存版本会先加载数据到内存，
-                   适合数据库访问较慢的场景；False则使用数据库临时表版本。
+        use_memory: 为 False 时固定使用数据库临时表版本(engine 未指定时生效)
+        engine: 搜索引擎,默认 "auto":
+                "auto"(按图规模、起点度数、过滤选择率和内存预算自动选择,
+                见 cycle_planner), "membibfs"(内存全图), "bibfs"(数据库临时表),
+                "lazybfs"(按需批量加载邻接,适合大图上的浅层查询),
+                "enum"(内存图上完整枚举全部满足条件的环),
+                "procbfs"(与 bibfs 相同,但整个搜索在数据库函数 cycle_bibfs 内
+                执行,一次往返;需先用 sql/init_schema.py 安装,auto 不会选择)。
+                选择结果和估算值写入 meta.plan
+        timeout_ms: 搜索时间预算(毫秒)。到期后返回已找到的环,
+                    meta.truncated 为 True,meta.depth_reached 为已搜索的深度
+        order_by: 按 "total_amount"/"min_amount"(从大到小) 或 "duration"(从短到长)
+                  返回得分最优的 limit 个环,在内存图上做最优优先搜索(见 cycle_topk)
     """
+    start_time = time.time()
+
     # 验证输入
     if not isinstance(start_vid, int) or start_vid <= 0:
         return {
@@ -420,6 +490,358 @@ def query_cycles(
             "message": "Start vertex ID must be a positive integer",
         }
 
+    error = _validate_cycle_params(
+        max_depth,
+        direction,
+        vertex_filter_min_balance,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        limit,
+        timeout_ms,
+    )
+    if error:
+        return error
+
+    if engine is None:
+        engine = cycle_planner.AUTO if use_memory else "bibfs"
+
+    error = _validate_engine(engine, order_by)
+    if error:
+        return error
+
+    plan = _plan_cycle_query(
+        username,
+        engine,
+        start_vid,
+        max_depth,
+        direction,
+        vertex_filter_v_type,
+        vertex_filter_min_balance,
+        edge_filter_e_type,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        order_by,
+    )
+    if plan.get("status") == "error":
+        return plan
+
+    # 内存图已缓存且分量索引已构建时,起点不满足过滤条件或不在任何环上则不必进入搜索。
+    # 删除操作丢弃的索引不在这里重建(全图 Tarjan),由内存引擎下次查询时重建
+    with graph_cache.pinned_graph(username, load=False) as graph:
+        if graph is not None and graph.scc_index is not None:
+            # 起点不存在时由引擎报告
+            start_vertex = graph.get_vertex(start_vid)
+            message = None
+            if start_vertex is not None:
+                if not mem_cycle_ag._vertex_matches_filter(
+                    start_vertex, vertex_filter_v_type, vertex_filter_min_balance
+                ):
+                    message = "Start vertex does not match filters"
+                elif not graph.scc_index.on_cycle(graph.vertex_index(start_vid)):
+                    message = "Start vertex is not on any cycle"
+            if message is not None:
+                return {
+                    "status": "success",
+                    "found": False,
+                    "message": message,
+                    "meta": {
+                        "execution_time_ms": int((time.time() - start_time) * 1000),
+                        "plan": plan,
+                    },
+                }
+
+    module, extra_params = _engine_module(plan, order_by)
+    result = module.query_cycles(
+        start_vid,
+        max_depth,
+        username,
+        direction,
+        vertex_filter_v_type,
+        vertex_filter_min_balance,
+        edge_filter_e_type,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        limit,
+        allow_duplicate_vertices,
+        allow_duplicate_edges,
+        timeout_ms,
+        *extra_params,
+    )
+    if "meta" in result:
+        result["meta"]["plan"] = plan
+    return result
+
+
+def iter_cycles_batch(
+    username: str,
+    start_vids: List[int],
+    max_depth: int,
+    direction: str = "forward",
+    vertex_filter_v_type: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_type: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    limit: int = 10,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    engine: str = cycle_planner.AUTO,
+    workers: Optional[int] = None,
+    timeout_ms: Optional[int] = None,
+    order_by: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """批量查询多个起点的环路,按完成顺序逐个产出每个起点的结果。
+
+    过滤条件对所有起点相同。内存引擎整批共用固定的内存图,在 batch_runner 的
+    工作进程中并行搜索,每个工作进程只准备一次图和过滤条件;数据库引擎在
+    batch_runner 的线程池中执行。每个结果是单起点查询结果加上 start_vid 字段;
+    参数不合法时只产出一个错误结果。
+
+    Args:
+        username: 用户名，用于确定查询哪个用户的表
+        start_vids: 起点ID列表(重复的起点只查询一次)
+        engine: 搜索引擎,同 query_cycles;"auto" 按平均度数为整批选择一个引擎
+        workers: 并发数。内存引擎为工作进程数,默认按起点数计算(起点较少时在
+            当前线程中执行);数据库引擎为线程数,默认为 CPU 核数
+        timeout_ms: 每个起点的搜索时间预算(毫秒),同 query_cycles
+        order_by: 每个起点返回得分最优的 limit 个环,同 query_cycles
+    """
+    if not start_vids:
+        yield {"status": "error", "message": "Start vertex list cannot be empty"}
+        return
+
+    if len(start_vids) > MAX_BATCH_STARTS:
+        yield {
+            "status": "error",
+            "message": f"Batch cannot exceed {MAX_BATCH_STARTS} start vertices",
+        }
+        return
+
+    if any(not isinstance(vid, int) or vid <= 0 for vid in start_vids):
+        yield {
+            "status": "error",
+            "message": "Start vertex ID must be a positive integer",
+        }
+        return
+
+    if workers is not None and workers <= 0:
+        yield {"status": "error", "message": "Workers must be a positive integer"}
+        return
+
+    error = _validate_cycle_params(
+        max_depth,
+        direction,
+        vertex_filter_min_balance,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        limit,
+        timeout_ms,
+    )
+    if error:
+        yield error
+        return
+
+    error = _validate_engine(engine, order_by)
+    if error:
+        yield error
+        return
+
+    plan = _plan_cycle_query(
+        username,
+        engine,
+        None,
+        max_depth,
+        direction,
+        vertex_filter_v_type,
+        vertex_filter_min_balance,
+        edge_filter_e_type,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        order_by,
+    )
+    if plan.get("status") == "error":
+        yield plan
+        return
+
+    module, extra_params = _engine_module(plan, order_by)
+    params = (
+        max_depth,
+        username,
+        direction,
+        vertex_filter_v_type,
+        vertex_filter_min_balance,
+        edge_filter_e_type,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        limit,
+        allow_duplicate_vertices,
+        allow_duplicate_edges,
+        timeout_ms,
+        *extra_params,
+    )
+
+    start_vids = list(dict.fromkeys(start_vids))
+    with ExitStack() as stack:
+        # 内存引擎提供 make_searcher,在工作进程中准备图和过滤条件(纯 Python 的
+        # 搜索在线程中受 GIL 限制);整批搜索期间固定内存图,并发的写操作修补副本
+        if hasattr(module, "make_searcher"):
+            try:
+                graph = stack.enter_context(graph_cache.pinned_graph(username))
+            except Exception as e:
+                yield {"status": "error", "message": f"Cycle query failed: {e}"}
+                return
+            results = batch_runner.run_batch_processes(
+                graph, module.make_searcher, params, start_vids, workers
+            )
+        else:
+
+            def search(start_vid: int) -> Dict[str, Any]:
+                return module.query_cycles(start_vid, *params)
+
+            results = batch_runner.run_batch(search, start_vids, workers)
+
+        try:
+            for start_vid, result in results:
+                if "meta" in result:
+                    result["meta"]["plan"] = plan
+                yield {"start_vid": start_vid, **result}
+        except Exception as e:
+            yield {"status": "error", "message": f"Cycle query failed: {e}"}
+
+
+def query_cycles_batch(username: str, start_vids: List[int], **kwargs: Any) -> Dict[str, Any]:
+    """批量查询环路,收集全部结果后一次返回。参数同 iter_cycles_batch。"""
+    results = list(iter_cycles_batch(username, start_vids, **kwargs))
+    if len(results) == 1 and "start_vid" not in results[0]:
+        return results[0]
+
+    return {
+        "status": "success",
+        "count": len(results),
+        "found_count": sum(1 for r in results if r.get("found")),
+        "data": results,
+    }
+
+
+def scan_cycles(
+    username: str,
+    max_depth: int,
+    direction: str = "forward",
+    vertex_filter_v_type: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_type: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    limit: Optional[int] = None,
+    workers: Optional[int] = None,
+    progress_every: int = cycle_scan.PROGRESS_INTERVAL,
+) -> Iterator[Dict[str, Any]]:
+    """扫描用户全图中所有长度不超过 max_depth 的环,逐个产出进度、环路和汇总。
+
+    每个环只报告一次。参数不合法时只产出一个错误汇总。
+
+    Args:
+        username: 用户名，用于确定查询哪个用户的表
+        limit: 最多产出的环路数量, None 表示不限
+        workers: 工作进程数,默认按候选起点数计算
+        progress_every: 每完成多少个起点产出一条进度
+    """
+    error = _validate_cycle_params(
+        max_depth,
+        direction,
+        vertex_filter_min_balance,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        None,
+    )
+    if error is None and limit is not None and limit <= 0:
+        error = {"status": "error", "message": "Limit must be a positive integer"}
+    if error is None and workers is not None and workers <= 0:
+        error = {"status": "error", "message": "Workers must be a positive integer"}
+    if error is None and progress_every <= 0:
+        error = {"status": "error", "message": "Progress interval must be a positive integer"}
+    if error:
+        yield {"type": "summary", **error}
+        return
+
+    yield from cycle_scan.scan_cycles(
+        username,
+        max_depth,
+        direction,
+        vertex_filter_v_type,
+        vertex_filter_min_balance,
+        edge_filter_e_type,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+        allow_duplicate_vertices,
+        allow_duplicate_edges,
+        limit=limit,
+        workers=workers,
+        progress_every=progress_every,
+    )
+
+
+def query_scc(
+    username: str, vid: Optional[int] = None, limit: int = 100, **db_kwargs: Any
+) -> Dict[str, Any]:
+    """查询强连通分量(全图,不带过滤条件)。
+
+    Args:
+        username: 用户名，用于确定查询哪个用户的表
+        vid: 指定点时返回该点所在的分量,否则返回全图的分量统计
+        limit: 返回的分量成员最多多少个
+
+    Returns:
+        Dict: 包含status和data。指定点时 data 包含 vid, size, on_cycle, members
+    """
+    if vid is not None and (not isinstance(vid, int) or vid <= 0):
+        return {"status": "error", "message": "Vertex ID must be a positive integer"}
+
+    if not isinstance(limit, int) or limit <= 0:
+        return {"status": "error", "message": "Limit must be a positive integer"}
+
+    try:
+        with graph_cache.pinned_graph(username, **db_kwargs) as graph:
+            index = scc.get_index(graph)
+
+            if vid is None:
+                return {"status": "success", "data": index.summary()}
+
+            vi = graph.vertex_index(vid)
+            if vi is None:
+                return {"status": "error", "message": f"Vertex {vid} not found"}
+
+            component = index.comp[vi]
+            members = sorted(
+                graph.vids[wi] for wi, c in enumerate(index.comp) if c == component
+            )
+            return {
+                "status": "success",
+                "data": {
+                    "vid": vid,
+                    "size": index.component_size(vi),
+                    "on_cycle": index.on_cycle(vi),
+                    "members": members[:limit],
+                    "truncated": len(members) > limit,
+                },
+            }
+
+    except Exception as e:
+        return {"status": "error", "message": f"Query SCC failed: {e}"}
+
+
+def _validate_cycle_params(
+    max_depth: int,
+    direction: str,
+    vertex_filter_min_balance: Optional[int],
+    edge_filter_min_amount: Optional[int],
+    edge_filter_max_amount: Optional[int],
+    limit: Optional[int],
+    timeout_ms: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """校验环路查询的公共参数,不合法时返回错误结果。limit 为 None 时不校验。"""
     if not isinstance(max_depth, int) or max_depth <= 0:
         return {"status": "error", "message": "Max depth must be a positive integer"}
 
@@ -457,6 +879,12 @@ def query_cycles(
                 "message": "Edge minimum amount cannot be greater than maximum amount",
             }
 
+    if timeout_ms is not None and (not isinstance(timeout_ms, int) or timeout_ms <= 0):
+        return {"status": "error", "message": "Timeout must be a positive integer"}
+
+    if limit is None:
+        return None
+
     if limit <= 0:
         return {"status": "error", "message": "Limit must be a positive integer"}
 
@@ -466,37 +894,38 @@ def query_cycles(
             "message": "Limit cannot exceed 1000 for performance reasons",
         }
 
-    # 根据参数选择使用哪个版本
-    if use_memory:
-        return mem_cycle_ag.query_cycles(
-            start_vid,
-            max_depth,
-            username,
-            direction,
-            vertex_filter_v_type,
-            vertex_filter_min_balance,
-            edge_filter_e_type,
-            edge_filter_min_amount,
-            edge_filter_max_amount,
-            limit,
-            allow_duplicate_vertices,
-            allow_duplicate_edges,
-        )
-    else:
-        return cycle_ag.query_cycles(
-            start_vid,
-            max_depth,
-            username,
-            direction,
-            vertex_filter_v_type,
-            vertex_filter_min_balance,
-            edge_filter_e_type,
-            edge_filter_min_amount,
-            edge_filter_max_amount,
-            limit,
-            allow_duplicate_vertices,
-            allow_duplicate_edges,
-        )
+    return None
+
+
+def _validate_engine(engine: str, order_by: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    if engine != cycle_planner.AUTO and engine not in CYCLE_ENGINES:
+        return {
+            "status": "error",
+            "message": f"Engine must be one of: {', '.join([cycle_planner.AUTO, *CYCLE_ENGINES])}",
+        }
+    if order_by is not None and order_by not in cycle_topk.ORDER_BY:
+        return {
+            "status": "error",
+            "message": f"Order by must be one of: {', '.join(cycle_topk.ORDER_BY)}",
+        }
+    return None
+
+
+def _engine_module(plan: Dict[str, Any], order_by: Optional[str]) -> Tuple[Any, Tuple]:
+    """返回计划选定的引擎模块,以及追加在公共参数之后的引擎专属参数。"""
+    if plan["engine"] == cycle_planner.TOPK:
+        return cycle_topk, (order_by,)
+    return CYCLE_ENGINES[plan["engine"]], ()
+
+
+def _plan_cycle_query(username: str, engine: str, *args: Any) -> Dict[str, Any]:
+    """选择搜索引擎,返回计划;超出内存预算或估算失败时返回错误结果。"""
+    try:
+        return cycle_planner.plan_cycle_query(username, engine, *args)
+    except cycle_planner.PlanRejected as e:
+        return {"status": "error", "message": str(e), "meta": {"plan": e.plan}}
+    except Exception as e:
+        return {"status": "error", "message": f"Plan cycle query failed: {e}"}
 
 
 # 在文件末尾添加删除函数
@@ -582,9 +1011,12 @@ def delete_vertex(username: str, vid: int, **db_kwargs: Any) -> Dict[str, Any]:
             f"DELETE FROM {vertex_table_name} WHERE vid = %s",
             (vid,),
         ))
+        sql_list.append(graph_log.log_statement(username, "delete_vertex", vid=vid))
         
         # 在同一事务中执行所有操作
+        graph_log.ensure_log_table(username, **db_kwargs)
         execute_multi(sql_list, **db_kwargs)
+        graph_cache.patch(username, lambda g: g.delete_vertex(vid), **db_kwargs)
 
         return {
             "status": "success",
@@ -638,8 +1070,11 @@ def delete_edge(username: str, eid: int, **db_kwargs: Any) -> Dict[str, Any]:
                 f"DELETE FROM {edge_table_name} WHERE eid = %s",
                 (eid,),
             ),
+            graph_log.log_statement(username, "delete_edge", eid=eid),
         ]
+        graph_log.ensure_log_table(username, **db_kwargs)
         execute_multi(sql_list, **db_kwargs)
+        graph_cache.patch(username, lambda g: g.delete_edge(eid), **db_kwargs)
 
         return {
             "status": "success",
@@ -729,7 +1164,19 @@ def update_vertex(
         sql = (
             f"UPDATE {vertex_table_name} SET {', '.join(update_fields)} WHERE vid = %s"
         )
-        execute_dml(sql, tuple(params), **db_kwargs)
+        graph_log.ensure_log_table(username, **db_kwargs)
+        execute_multi(
+            [
+                (sql, tuple(params)),
+                graph_log.log_statement(
+                    username, "update_vertex", vid=vid, v_type=v_type, balance=balance
+                ),
+            ],
+            **db_kwargs,
+        )
+        graph_cache.patch(
+            username, lambda g: g.update_vertex(vid, v_type, balance), **db_kwargs
+        )
 
         # 查询更新后的数据
         updated = fetch_one(
@@ -861,9 +1308,25 @@ def update_edge(
 
         sql = f"UPDATE {edge_table_name} SET {', '.join(update_fields)} WHERE eid = %s"
         sql_list.append((sql, tuple(params)))
+        sql_list.append(
+            graph_log.log_statement(
+                username,
+                "update_edge",
+                eid=eid,
+                amount=amount,
+                occur_time=occur_time,
+                e_type=e_type,
+            )
+        )
         
         # 在同一事务中执行所有操作
+        graph_log.ensure_log_table(username, **db_kwargs)
         execute_multi(sql_list, **db_kwargs)
+        graph_cache.patch(
+            username,
+            lambda g: g.update_edge(eid, amount, occur_time, e_type),
+            **db_kwargs,
+        )
 
         # 查询更新后的数据
         updated = fetch_one(
@@ -4,16 +4,18 @@
 使用 Flask 框架,单个 POST 路由接收所有命令。
 """
 
-from flask import Flask, request, jsonify, make_response
-from typing import Dict, Any
+from flask import Flask, Response, request, jsonify, make_response
+from typing import Dict, Any, List, Optional, Tuple
+import json
 import sys
 import os
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
-from server.core.cli import execute_command
+from server.core.cli import execute_command, execute_command_stream, local_only_error
 from server.core.auth_service import verify_token, clear_token
+from server.core import graph_cache
 
 app = Flask(__name__)
 
@@ -27,6 +29,47 @@ class RequestContext:
 NO_AUTH_COMMANDS = {"register", "login", "logout"}
 
 
+def _error_response(message: str, code: int) -> Tuple[Response, int]:
+    return jsonify({"status": "error", "message": message}), code
+
+
+def _parse_request() -> Tuple[List[str], Optional[str], Optional[Tuple[Response, int]]]:
+    """解析请求中的命令并验证 token。
+
+    Returns:
+        Tuple: (命令参数列表, 用户名, 错误响应)。请求合法时错误响应为 None。
+    """
+    # 获取请求数据
+    data = request.get_json()
+    if not data or "command" not in data:
+        return [], None, _error_response("Invalid request: missing 'command' field", 400)
+
+    command = data["command"]
+    if not isinstance(command, list) or len(command) == 0:
+        return [], None, _error_response(
+            "Invalid command format: must be a non-empty list", 400
+        )
+
+    # 会访问服务器上文件的命令和参数只允许在本地 CLI 中使用
+    local_only = local_only_error(command)
+    if local_only:
+        return [], None, _error_response(local_only, 400)
+
+    # register, login 不需要验证
+    username = None
+    if command[0] not in NO_AUTH_COMMANDS:
+        # 其他命令需要验证 token
+        token = request.cookies.get("token")
+        username = verify_token(token) if token else None
+        if not username:
+            print(f"invalid token {token}")
+            return command, None, _error_response(
+                "Invalid or expired token. Please login again.", 401
+            )
+
+    return command, username, None
+
+
 @app.route("/execute", methods=["POST"])
 def execute():
     """执行客户端发送的命令。
@@ -43,54 +86,12 @@ def execute():
     }
     """
     try:
-        # 获取请求数据
-        data = request.get_json()
-        if not data or "command" not in data:
-            return (
-                jsonify(
-                    {
-                        "status": "error",
-                        "message": "Invalid request: missing 'command' field",
-                    }
-                ),
-                400,
-            )
-
-        command = data["command"]
-        if not isinstance(command, list) or len(command) == 0:
-            return (
-                jsonify(
-                    {
-                        "status": "error",
-                        "message": "Invalid command format: must be a non-empty list",
-                    }
-                ),
-                400,
-            )
-
-        # 获取 cookie 中的 token
+        command, username, error = _parse_request()
+        if error:
+            return error
+        command_name = command[0]
         token = request.cookies.get("token")
 
-        # 判断是否需要验证 token
-        command_name = command[0] if command else ""
-
-        # register, login 不需要验证
-        username = None
-        if command_name not in NO_AUTH_COMMANDS:
-            # 其他命令需要验证 token
-            username = verify_token(token) if token else None
-            if not username:
-                print(f"invalid token {token}")
-                return (
-                    jsonify(
-                        {
-                            "status": "error",
-                            "message": "Invalid or expired token. Please login again.",
-                        }
-                    ),
-                    401,
-                )
-
         # 执行命令，传入 username
         result = execute_command(command, username=username)
 
@@ -118,6 +119,32 @@ def execute():
         return jsonify({"status": "error", "message": f"Server error: {str(e)}"}), 500
 
 
+@app.route("/execute/stream", methods=["POST"])
+def execute_stream():
+    """执行命令并以 NDJSON 流式返回结果,每行一个 JSON 对象。
+
+    请求格式与 /execute 相同。批量命令(如 query cycles-batch)每完成一项
+    就输出一行;其它命令只输出一行。
+    """
+    try:
+        command, username, error = _parse_request()
+        if error:
+            return error
+        if command[0] in NO_AUTH_COMMANDS:
+            return _error_response(
+                f"Command '{command[0]}' is not supported on /execute/stream", 400
+            )
+
+        def generate():
+            for result in execute_command_stream(command, username=username):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Server error: {str(e)}"}), 500
+
+
 @app.route("/health", methods=["GET"])
 def health():
     """健康检查接口。"""
@@ -133,6 +160,7 @@ def index():
             "version": "1.0.0",
             "endpoints": {
                 "execute": "POST /execute - Execute cgql commands",
+                "execute_stream": "POST /execute/stream - Execute cgql commands, NDJSON results",
                 "health": "GET /health - Health check",
             },
         }
@@ -147,9 +175,17 @@ def run(args):
     print("=" * 50)
     print(f"Server running on http://{args.host}:{args.port}")
     print(f"Debug mode: {args.debug}")
+    if getattr(args, "memory_budget_mb", None):
+        graph_cache.set_memory_budget(args.memory_budget_mb * 1024 * 1024)
+    print(f"Memory budget: {graph_cache.memory_budget() // (1024 * 1024)} MB")
+    warm_users = getattr(args, "warm_users", None)
+    if warm_users:
+        graph_cache.warm_graphs(warm_users)
+        print(f"Warming graphs in background: {', '.join(warm_users)}")
     print("=" * 50)
     print("\nEndpoints:")
     print(f"  POST http://{args.host}:{args.port}/execute - Execute commands")
+    print(f"  POST http://{args.host}:{args.port}/execute/stream - Execute commands (NDJSON)")
     print(f"  GET  http://{args.host}:{args.port}/health  - Health check")
     print("\nPress Ctrl+C to stop the server\n")
 
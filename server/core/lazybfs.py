@@ -0,0 +1,531 @@
+"""环路查找服务 - 按需分页加载邻接的双向BFS环检测算法。
+
+不预先加载用户全图,也不在数据库中物化路径。每扩展一层,只对当前层中
+尚未取过邻接的点发一条批量查询(WHERE src_vid = ANY(%s) / dst_vid = ANY(%s)),
+时间和金额等过滤条件直接下推到SQL,走 (src_vid, occur_time) /
+(dst_vid, occur_time) 索引。取回的邻接保存在单次查询内的LRU缓存中。
+
+对大图上的浅层查询,只会访问起点附近可达的一小部分边,而不是整张边表。
+指定 timeout_ms 时邻接查询受 statement_timeout 约束,扩展中逐个状态检查期限。
+"""
+
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Set, Tuple
+from server.opengauss.graph_dao import (
+    fetch_all,
+    fetch_one,
+    statement_deadline,
+    TypeDict,
+    Vertex,
+    Edge,
+    get_user_table_name,
+)
+from server.core.deadline import Deadline, SearchTimeout
+from server.core.frontier_schedule import FORWARD, FrontierSchedule
+from server.core.membibfs import _detect_cycles_memory, _vertex_matches_filter
+from server.core.path_arena import PathArena
+
+
+DEFAULT_MAX_NEIGHBORHOODS = 100000  # 单次查询LRU缓存最多保留的邻接表数量
+FETCH_BATCH_SIZE = 1000  # 单条批量查询最多携带的点数
+
+
+class LazyGraph:
+    """单次查询内按需加载的局部图。
+
+    点和边按首次出现的顺序编号为局部下标,列名与 MemGraph 保持一致,
+    因此可以直接复用 membibfs 的碰撞检测。每个点的出/入邻接以
+    (取数时间界, 按时间排序的边下标列表) 的形式保存在LRU缓存中。
+    """
+
+    def __init__(
+        self,
+        username: str,
+        vertex_filter_v_types: Optional[List[str]],
+        vertex_filter_min_balance: Optional[int],
+        edge_filter_e_types: Optional[List[str]],
+        edge_filter_min_amount: Optional[int],
+        edge_filter_max_amount: Optional[int],
+        max_neighborhoods: int = DEFAULT_MAX_NEIGHBORHOODS,
+        **db_kwargs: Any,
+    ) -> None:
+        self.username = username
+        self.vertex_filter_v_types = vertex_filter_v_types
+        self.vertex_filter_min_balance = vertex_filter_min_balance
+        self.edge_filter_e_types = edge_filter_e_types
+        self.edge_filter_min_amount = edge_filter_min_amount
+        self.edge_filter_max_amount = edge_filter_max_amount
+        self.max_neighborhoods = max_neighborhoods
+        self.db_kwargs = db_kwargs
+
+        # 点列
+        self.vids = array("q")
+        self.index: Dict[int, int] = {}
+
+        # 边列
+        self.eids = array("q")
+        self.src = array("i")
+        self.dst = array("i")
+        self.amount = array("q")
+        self.occur_time = array("q")
+        self.e_type = array("i")
+        self.e_types = TypeDict()
+        self._edge_index: Dict[int, int] = {}
+
+        # 邻接LRU: (是否出边, 点下标) -> (时间界, 边下标列表)
+        self._neighborhoods: "OrderedDict[Tuple[bool, int], Tuple[Optional[int], List[int]]]" = OrderedDict()
+        self.queries = 0
+        self.fetched_edges = 0
+
+    def vertex_index(self, vid: int) -> int:
+        """返回点的局部下标,首次出现时分配。"""
+        vi = self.index.get(vid)
+        if vi is None:
+            vi = len(self.vids)
+            self.vids.append(vid)
+            self.index[vid] = vi
+        return vi
+
+    def edge(self, ei: int) -> Edge:
+        return Edge(
+            self.eids[ei],
+            self.vids[self.src[ei]],
+            self.vids[self.dst[ei]],
+            self.amount[ei],
+            self.occur_time[ei],
+            self.e_types.decode(self.e_type[ei]),
+        )
+
+    def out_edge_indices(self, vi: int, after: Optional[int] = None) -> List[int]:
+        """点 vi 的出边(时间严格晚于 after)。"""
+        edges = self._adjacency(True, vi, after)
+        if after is None:
+            return edges
+        return edges[bisect_right(edges, after, key=self.occur_time.__getitem__):]
+
+    def in_edge_indices(self, vi: int, before: Optional[int] = None) -> List[int]:
+        """点 vi 的入边(时间严格早于 before)。"""
+        edges = self._adjacency(False, vi, before)
+        if before is None:
+            return edges
+        return edges[: bisect_left(edges, before, key=self.occur_time.__getitem__)]
+
+    def _adjacency(self, outgoing: bool, vi: int, bound: Optional[int]) -> List[int]:
+        """取缓存中的邻接;通常已由 prefetch 整层加载,被LRU淘汰时单独补取。"""
+        key = (outgoing, vi)
+        cached = self._neighborhoods.get(key)
+        if cached is None or not _bound_covers(outgoing, cached[0], bound):
+            self._fetch(outgoing, [vi], bound)
+            cached = self._neighborhoods[key]
+        self._neighborhoods.move_to_end(key)
+        return cached[1]
+
+    def prefetch(self, outgoing: bool, bounds: Dict[int, Optional[int]]) -> None:
+        """批量加载一层点的邻接。
+
+        Args:
+            outgoing: True 加载出边,False 加载入边
+            bounds: 点下标 -> 时间界。出边只需要晚于时间界的边,入边只需要
+                    早于时间界的边; None 表示不限时间。已缓存且时间界覆盖
+                    本次需求的点不会重复查询。
+        """
+        missing = {}
+        for vi, bound in bounds.items():
+            cached = self._neighborhoods.get((outgoing, vi))
+            if cached is not None and _bound_covers(outgoing, cached[0], bound):
+                continue
+            missing[vi] = bound
+
+        if not missing:
+            return
+
+        vis = list(missing)
+        for i in range(0, len(vis), FETCH_BATCH_SIZE):
+            chunk = vis[i : i + FETCH_BATCH_SIZE]
+            # 同一批次共用最宽的时间界
+            chunk_bounds = [missing[vi] for vi in chunk]
+            if any(b is None for b in chunk_bounds):
+                bound = None
+            else:
+                bound = min(chunk_bounds) if outgoing else max(chunk_bounds)
+            self._fetch(outgoing, chunk, bound)
+
+    def _fetch(self, outgoing: bool, chunk: List[int], bound: Optional[int]) -> None:
+        vertex_table_name, edge_table_name = get_user_table_name(self.username)
+        key_col, other_col = ("src_vid", "dst_vid") if outgoing else ("dst_vid", "src_vid")
+
+        conditions = [f"e.{key_col} = ANY(%s)"]
+        params: List[Any] = [[self.vids[vi] for vi in chunk]]
+
+        # 时序过滤
+        if bound is not None:
+            conditions.append("e.occur_time > %s" if outgoing else "e.occur_time < %s")
+            params.append(bound)
+
+        # 边过滤
+        if self.edge_filter_e_types:
+            conditions.append("e.e_type = ANY(%s)")
+            params.append(self.edge_filter_e_types)
+        if self.edge_filter_min_amount is not None:
+            conditions.append("e.amount >= %s")
+            params.append(self.edge_filter_min_amount)
+        if self.edge_filter_max_amount is not None:
+            conditions.append("e.amount <= %s")
+            params.append(self.edge_filter_max_amount)
+
+        # 点过滤(作用于邻接的另一端,当前端在到达时已经检查过)
+        join = ""
+        if self.vertex_filter_v_types or self.vertex_filter_min_balance is not None:
+            join = f"JOIN {vertex_table_name} v ON v.vid = e.{other_col}"
+            if self.vertex_filter_v_types:
+                conditions.append("v.v_type = ANY(%s)")
+                params.append(self.vertex_filter_v_types)
+            if self.vertex_filter_min_balance is not None:
+                conditions.append("v.balance >= %s")
+                params.append(self.vertex_filter_min_balance)
+
+        sql = f"""
+        SELECT e.eid, e.src_vid, e.dst_vid, e.amount, e.occur_time, e.e_type
+        FROM {edge_table_name} e
+        {join}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY e.{key_col}, e.occur_time
+        """
+        rows = fetch_all(sql, tuple(params), **self.db_kwargs)
+        self.queries += 1
+        self.fetched_edges += len(rows)
+
+        adjacency: Dict[int, List[int]] = {vi: [] for vi in chunk}
+        for eid, src_vid, dst_vid, amount, occur_time, e_type in rows:
+            ei = self._edge_index.get(eid)
+            if ei is None:
+                ei = len(self.eids)
+                self.eids.append(eid)
+                self.src.append(self.vertex_index(src_vid))
+                self.dst.append(self.vertex_index(dst_vid))
+                self.amount.append(amount)
+                self.occur_time.append(occur_time)
+                self.e_type.append(self.e_types.encode(e_type))
+                self._edge_index[eid] = ei
+            adjacency[self.index[src_vid if outgoing else dst_vid]].append(ei)
+
+        while self._neighborhoods and len(self._neighborhoods) + len(adjacency) > self.max_neighborhoods:
+            self._neighborhoods.popitem(last=False)
+        for vi, edges in adjacency.items():
+            self._neighborhoods[(outgoing, vi)] = (bound, edges)
+            self._neighborhoods.move_to_end((outgoing, vi))
+
+
+def _bound_covers(outgoing: bool, cached: Optional[int], needed: Optional[int]) -> bool:
+    """已缓存邻接的时间界是否覆盖本次需要的时间范围。"""
+    if cached is None:
+        return True
+    if needed is None:
+        return False
+    return cached <= needed if outgoing else cached >= needed
+
+
+def query_cycles(
+    start_vid: int,
+    max_depth: int,
+    username: str,
+    direction: str = "forward",
+    vertex_filter_v_types: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_types: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    limit: int = 10,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
+    **db_kwargs: Any,
+) -> Dict[str, Any]:
+    """查询环路 - 使用按需加载邻接的双向BFS算法。
+
+    Args:
+        start_vid: 起始点ID
+        max_depth: 最大搜索深度(环路长度)
+        username: 用户名，用于确定查询哪个用户的表
+        direction: 时序方向, "forward"(时间递增) 或 "any"(无时序要求)
+        vertex_filter_v_types: 点类型过滤列表
+        vertex_filter_min_balance: 点最小余额过滤
+        edge_filter_e_types: 边类型过滤列表
+        edge_filter_min_amount: 边最小金额过滤
+        edge_filter_max_amount: 边最大金额过滤
+        limit: 最多返回的环数量
+        allow_duplicate_vertices: 是否允许环中出现重复点(除起点外)
+        allow_duplicate_edges: 是否允许环中出现重复边
+        timeout_ms: 搜索时间预算(毫秒),到期后返回已找到的环并标记 meta.truncated
+        **db_kwargs: 数据库连接参数
+
+    Returns:
+        Dict: 包含status, found, data(环列表), meta等信息
+    """
+    start_time = time.time()
+    deadline = Deadline(timeout_ms)
+
+    try:
+        # 1. 验证起始点存在
+        start_vertex = _get_vertex(start_vid, username, **db_kwargs)
+        if not start_vertex:
+            return {"status": "error", "message": f"Start vertex {start_vid} not found"}
+
+        # 2. 检查起始点是否满足过滤条件
+        if not _vertex_matches_filter(
+            start_vertex, vertex_filter_v_types, vertex_filter_min_balance
+        ):
+            return {
+                "status": "success",
+                "found": False,
+                "message": "Start vertex does not match filters",
+            }
+
+        # 3. 执行按需加载的双向BFS搜索
+        graph = LazyGraph(
+            username,
+            vertex_filter_v_types,
+            vertex_filter_min_balance,
+            edge_filter_e_types,
+            edge_filter_min_amount,
+            edge_filter_max_amount,
+            **db_kwargs,
+        )
+        with statement_deadline(deadline.expires_at):
+            cycles, schedule = _lazy_bidirectional_bfs(
+                start_vid=start_vid,
+                max_depth=max_depth,
+                direction=direction,
+                graph=graph,
+                limit=limit,
+                allow_duplicate_vertices=allow_duplicate_vertices,
+                allow_duplicate_edges=allow_duplicate_edges,
+                deadline=deadline,
+            )
+
+        # 4. 构造返回结果
+        execution_time = int((time.time() - start_time) * 1000)
+        meta = {
+            "execution_time_ms": execution_time,
+            "fetch_queries": graph.queries,
+            "fetched_edges": graph.fetched_edges,
+            **schedule.meta(),
+        }
+
+        if not cycles:
+            return {"status": "success", "found": False, "meta": meta}
+
+        # 5. 获取环的详细信息(边已在局部图中,点一次批量查询)
+        cycle_data = _get_cycle_details(cycles, graph, **db_kwargs)
+
+        return {
+            "status": "success",
+            "found": True,
+            "count": len(cycle_data),
+            "data": cycle_data,
+            "meta": meta,
+        }
+
+    except Exception as e:
+        return {"status": "error", "message": f"Cycle query failed: {e}"}
+
+
+def _lazy_bidirectional_bfs(
+    start_vid: int,
+    max_depth: int,
+    direction: str,
+    graph: LazyGraph,
+    limit: int,
+    allow_duplicate_vertices: bool,
+    allow_duplicate_edges: bool,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[List[List[Tuple[int, int, int, int]]], FrontierSchedule]:
+    """按需加载的双向BFS核心算法,搜索过程与 membibfs 一致。
+
+    邻接在取回之前度数未知,扩展代价按该侧当前层的状态数估计。
+    deadline 到期时丢弃正在扩展的一层,返回已找到的环,schedule.truncated 为 True。
+
+    Returns:
+        Tuple: (环路列表, 扩展调度记录),环路是(src_vid, dst_vid, eid, edge_idx)的列表
+    """
+    schedule = FrontierSchedule(max_depth)
+    start = graph.vertex_index(start_vid)
+
+    fwd_arena, bwd_arena = PathArena(), PathArena()
+    fwd_state: Dict[int, int] = {start: fwd_arena.add_root(start)}
+    bwd_state: Dict[int, int] = {start: bwd_arena.add_root(start)}
+
+    fwd_frontier = [fwd_state[start]]
+    bwd_frontier = [bwd_state[start]]
+
+    cycles = []
+    seen_cycles: Set[Tuple] = set()
+
+    while len(cycles) < limit:
+        side = schedule.next_side(len(fwd_frontier), len(bwd_frontier))
+        if side is None:
+            break
+        if deadline is not None and deadline.expired():
+            schedule.truncate()
+            break
+
+        forward = side == FORWARD
+        arena, state = (fwd_arena, fwd_state) if forward else (bwd_arena, bwd_state)
+        try:
+            new_frontier = _expand_lazy(
+                fwd_frontier if forward else bwd_frontier,
+                arena,
+                state,
+                graph,
+                forward,
+                direction,
+                schedule.depth[side] + 1,
+                deadline,
+            )
+        except SearchTimeout:
+            schedule.truncate()
+            break
+        except Exception:
+            # 邻接查询因期限到期被数据库取消
+            if deadline is None or not deadline.expired():
+                raise
+            schedule.truncate()
+            break
+        if not new_frontier:
+            schedule.exhaust(side)
+            continue
+        schedule.advance(side)
+        if forward:
+            fwd_frontier = new_frontier
+        else:
+            bwd_frontier = new_frontier
+
+        # 检查碰撞: 只用新扩展出的一层探测另一方向的状态
+        cycles.extend(
+            _detect_cycles_memory(
+                new_frontier,
+                forward,
+                fwd_arena,
+                fwd_state,
+                bwd_arena,
+                bwd_state,
+                start,
+                graph,
+                allow_duplicate_vertices,
+                allow_duplicate_edges,
+                limit - len(cycles),
+                seen_cycles,
+            )
+        )
+
+    return cycles, schedule
+
+
+def _expand_lazy(
+    frontier: List[int],
+    arena: PathArena,
+    state: Dict[int, int],
+    graph: LazyGraph,
+    forward: bool,
+    direction: str,
+    target_depth: int,
+    deadline: Optional[Deadline] = None,
+) -> List[int]:
+    """扩展一层: 先批量加载整层邻接,再逐个状态扩展,返回新一层的状态 id 列表。
+
+    每扩展一个状态检查一次 deadline,到期时抛出 SearchTimeout。
+    """
+    temporal = direction == "forward"
+
+    # 每个点取该层所有状态中最宽的时间界
+    bounds: Dict[int, Optional[int]] = {}
+    for sid in frontier:
+        vi = arena.vi[sid]
+        t = arena.time[sid]
+        bound = t if temporal and (forward or t != 0) else None
+        if vi not in bounds:
+            bounds[vi] = bound
+        elif bounds[vi] is not None:
+            if bound is None:
+                bounds[vi] = None
+            else:
+                bounds[vi] = min(bounds[vi], bound) if forward else max(bounds[vi], bound)
+    graph.prefetch(forward, bounds)
+
+    new_frontier = []
+    next_col = graph.dst if forward else graph.src
+    time_col = graph.occur_time
+    depth_col = arena.depth
+
+    for sid in frontier:
+        if deadline is not None:
+            deadline.check()
+        vi = arena.vi[sid]
+        t = arena.time[sid]
+        if forward:
+            neighbors = graph.out_edge_indices(vi, after=t if temporal else None)
+        else:
+            neighbors = graph.in_edge_indices(vi, before=t if temporal and t != 0 else None)
+
+        for ei in neighbors:
+            # 避免重复访问已在路径中的点
+            nxt = next_col[ei]
+            if arena.on_path(sid, nxt):
+                continue
+
+            # 如果该点已经在这一层被访问过,跳过(保留第一次访问的路径)
+            prev = state.get(nxt)
+            if prev is not None and depth_col[prev] == target_depth:
+                continue
+
+            new_sid = arena.add(sid, nxt, ei, time_col[ei])
+            state[nxt] = new_sid
+            new_frontier.append(new_sid)
+
+    return new_frontier
+
+
+def _get_cycle_details(
+    cycles: List[List[Tuple[int, int, int, int]]], graph: LazyGraph, **db_kwargs: Any
+) -> List[Dict[str, Any]]:
+    """组装环路详细信息,所有环路上的点用一次批量查询取回。"""
+    vids = set()
+    for cycle_path in cycles:
+        vids.add(cycle_path[0][0])
+        for _, dst, _, _ in cycle_path:
+            vids.add(dst)
+
+    vertex_table_name, _ = get_user_table_name(graph.username)
+    rows = fetch_all(
+        f"SELECT vid, v_type, create_time, balance FROM {vertex_table_name} WHERE vid = ANY(%s)",
+        (list(vids),),
+        **db_kwargs,
+    )
+    vertices = {row[0]: Vertex.from_tuple(row).to_dict() for row in rows}
+
+    cycle_data = []
+    for cycle_path in cycles:
+        cycle_vids = {cycle_path[0][0]}
+        for _, dst, _, _ in cycle_path:
+            cycle_vids.add(dst)
+        cycle_data.append(
+            {
+                "vertices": [vertices[vid] for vid in cycle_vids if vid in vertices],
+                "edges": [graph.edge(ei).to_dict() for _, _, _, ei in cycle_path],
+            }
+        )
+    return cycle_data
+
+
+def _get_vertex(vid: int, username: str, **db_kwargs: Any) -> Optional[Vertex]:
+    """获取点信息。"""
+    vertex_table_name, _ = get_user_table_name(username)
+    result = fetch_one(
+        f"SELECT vid, v_type, create_time, balance FROM {vertex_table_name} WHERE vid = %s",
+        (vid,),
+        **db_kwargs,
+    )
+    return Vertex.from_tuple(result) if result else None
@@ -0,0 +1,559 @@
+"""内存图结构 - 供内存环路检测使用的用户全图。
+
+从数据库一次性读取用户的全部点和边,以紧凑的列式数组保存:
+- 点的 BIGINT vid 重映射为连续的 int32 下标,点属性按下标存放在并列数组中;
+- 边属性(eid、金额、时间、字典编码后的类型)存放在并列数组中;
+- 出/入邻接关系以 CSR(偏移数组 + 边下标数组)表示,每个点的邻接边按
+  occur_time 升序排列,时序剪枝时用二分查找直接定位满足时间条件的区间。
+
+每个点另外维护时间包络(出边/入边 occur_time 的最小值和最大值),时序搜索时
+不必读取邻接表就能判断一个点能否继续向后延伸。
+
+加载后的 CSR 部分只读,graph_service 写操作产生的新边记录在增量邻接表中,
+删除只打标记;增量积累到一定比例时重建 CSR。修补会原地修改图,图正被查询
+使用时由 graph_cache 修补 copy() 得到的副本。
+"""
+
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from server.opengauss.graph_dao import (
+    fetch_iter,
+    TypeDict,
+    Vertex,
+    Edge,
+    get_user_table_name,
+)
+
+
+# 增量(新增/删除)边数超过基础边数的该比例时重建 CSR
+COMPACT_RATIO = 0.25
+COMPACT_MIN_EDGES = 4096
+
+# 没有出边(入边)的点的时间包络为 (TIME_MAX, TIME_MIN),任何时间比较都不成立
+TIME_MIN = -(1 << 63)
+TIME_MAX = (1 << 63) - 1
+
+
+class MemGraph:
+    """单个用户的内存全图(不带任何过滤条件)。
+
+    点和边在内部都以下标表示: 点下标 vi 对应 vids[vi],边下标 ei 对应 eids[ei]。
+    """
+
+    def __init__(self, username: str):
+        self.username = username
+        self.version = 0  # 每次修补后递增
+
+        # 点列: 下标 -> 属性
+        self.vids = array("q")
+        self.v_type = array("i")
+        self.create_time = array("q")
+        self.balance = array("q")
+        self.v_alive = bytearray()
+        self.index: Dict[int, int] = {}  # vid -> 点下标(仅存活的点)
+
+        # 点的时间包络: 出边/入边 occur_time 的最小值和最大值
+        self.out_time_min = array("q")
+        self.out_time_max = array("q")
+        self.in_time_min = array("q")
+        self.in_time_max = array("q")
+
+        # 边列: 下标 -> 属性
+        self.eids = array("q")
+        self.src = array("i")
+        self.dst = array("i")
+        self.amount = array("q")
+        self.occur_time = array("q")
+        self.e_type = array("i")
+        self.e_alive = bytearray()
+
+        # 类型字典: v_type/e_type 列只保存编码,还原 Vertex/Edge 时解码
+        self.v_types = TypeDict()
+        self.e_types = TypeDict()
+
+        # CSR 邻接(覆盖前 base_vertices 个点、前 base_edges 条边)
+        self.base_vertices = 0
+        self.base_edges = 0
+        self.out_offsets = array("q", [0])
+        self.out_edges = array("i")
+        self.in_offsets = array("q", [0])
+        self.in_edges = array("i")
+
+        # 增量邻接: 点下标 -> [边下标],同样按 occur_time 升序
+        self._extra_out: Dict[int, List[int]] = {}
+        self._extra_in: Dict[int, List[int]] = {}
+        self._extra_eid_index: Dict[int, int] = {}  # 新增边 eid -> 边下标
+        self._dead_edges = 0
+
+        # 强连通分量索引(scc.SccIndex),首次使用时构建
+        self.scc_index: Optional[Any] = None
+        # 过滤视图(filter_view.FilterView),按规范化的过滤条件缓存
+        self.filter_views: "OrderedDict[Any, Any]" = OrderedDict()
+
+    # ==================== 查询 ====================
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.index)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.eids) - self._dead_edges
+
+    def vertex_index(self, vid: int) -> Optional[int]:
+        return self.index.get(vid)
+
+    def edge_index(self, eid: int) -> Optional[int]:
+        ei = self._extra_eid_index.get(eid)
+        if ei is not None:
+            return ei
+        # 基础边按 eid 升序存放
+        ei = bisect_left(self.eids, eid, 0, self.base_edges)
+        if ei < self.base_edges and self.eids[ei] == eid and self.e_alive[ei]:
+            return ei
+        return None
+
+    def get_vertex(self, vid: int) -> Optional[Vertex]:
+        vi = self.index.get(vid)
+        return self.vertex(vi) if vi is not None else None
+
+    def vertex(self, vi: int) -> Vertex:
+        """按点下标还原 Vertex 对象。"""
+        return Vertex(
+            self.vids[vi],
+            self.v_types.decode(self.v_type[vi]),
+            self.create_time[vi],
+            self.balance[vi],
+        )
+
+    def edge(self, ei: int) -> Edge:
+        """按边下标还原 Edge 对象。"""
+        return Edge(
+            self.eids[ei],
+            self.vids[self.src[ei]],
+            self.vids[self.dst[ei]],
+            self.amount[ei],
+            self.occur_time[ei],
+            self.e_types.decode(self.e_type[ei]),
+        )
+
+    def out_edge_indices(self, vi: int, after: Optional[int] = None) -> Iterable[int]:
+        """点的出边下标; 指定 after 时只返回 occur_time > after 的边。"""
+        return self._adjacent(
+            vi, self.out_offsets, self.out_edges, self._extra_out, after, None
+        )
+
+    def in_edge_indices(self, vi: int, before: Optional[int] = None) -> Iterable[int]:
+        """点的入边下标; 指定 before 时只返回 occur_time < before 的边。"""
+        return self._adjacent(
+            vi, self.in_offsets, self.in_edges, self._extra_in, None, before
+        )
+
+    def out_degree(self, vi: int) -> int:
+        """点的出度估计(CSR 中未压缩掉的已删除边也计入),用于搜索调度。"""
+        return self._degree(vi, self.out_offsets, self._extra_out)
+
+    def in_degree(self, vi: int) -> int:
+        """点的入度估计,同 out_degree。"""
+        return self._degree(vi, self.in_offsets, self._extra_in)
+
+    def v_type_code(self, v_type: str) -> Optional[int]:
+        return self.v_types.code(v_type)
+
+    def e_type_code(self, e_type: str) -> Optional[int]:
+        return self.e_types.code(e_type)
+
+    def estimated_bytes(self) -> int:
+        """估算图占用的内存字节数。"""
+        columns = (
+            self.vids, self.v_type, self.create_time, self.balance,
+            self.out_time_min, self.out_time_max, self.in_time_min, self.in_time_max,
+            self.eids, self.src, self.dst, self.amount, self.occur_time, self.e_type,
+            self.out_offsets, self.out_edges, self.in_offsets, self.in_edges,
+        )
+        total = sum(col.itemsize * len(col) for col in columns)
+        total += len(self.v_alive) + len(self.e_alive)
+        # dict 每项约 100 字节,增量邻接每条边约 2 个列表槽位
+        total += (len(self.index) + len(self._extra_eid_index)) * 100
+        total += (len(self.eids) - self.base_edges) * 16
+        if self.scc_index is not None:
+            total += self.scc_index.estimated_bytes()
+        for view in list(self.filter_views.values()):
+            total += len(view.vertex_mask) + len(view.edge_mask)
+        return total
+
+    def copy(self) -> "MemGraph":
+        """复制出可以独立修补的图,修补副本不影响正在使用原图的查询。
+
+        当前版本的过滤视图复制位图,修补副本时继续同步修补。
+        """
+        graph = MemGraph(self.username)
+        graph.version = self.version
+        for name in (*_VERTEX_COLUMNS, *_EDGE_COLUMNS, *_CSR_COLUMNS):
+            setattr(graph, name, getattr(self, name)[:])
+        graph.index = dict(self.index)
+        graph.v_types = TypeDict(self.v_types.names)
+        graph.e_types = TypeDict(self.e_types.names)
+        graph.base_vertices = self.base_vertices
+        graph.base_edges = self.base_edges
+        graph._extra_out = {vi: list(edges) for vi, edges in self._extra_out.items()}
+        graph._extra_in = {vi: list(edges) for vi, edges in self._extra_in.items()}
+        graph._extra_eid_index = dict(self._extra_eid_index)
+        graph._dead_edges = self._dead_edges
+        if self.scc_index is not None:
+            graph.scc_index = self.scc_index.copy()
+        for key, view in self.filter_views.items():
+            if view.version == self.version:
+                graph.filter_views[key] = view.copy()
+        return graph
+
+    # ==================== 修补(与 graph_service 写操作对应) ====================
+
+    def insert_vertex(self, vertex: Vertex) -> None:
+        vi = self._append_vertex(
+            vertex.vid, vertex.v_type, vertex.create_time, vertex.balance
+        )
+        if self.scc_index is not None:
+            self.scc_index.add_vertex(vi)
+        self.version += 1
+        self._refresh_views()
+
+    def update_vertex(
+        self, vid: int, v_type: Optional[str] = None, balance: Optional[int] = None
+    ) -> None:
+        vi = self.index[vid]
+        if v_type is not None:
+            self.v_type[vi] = self.v_types.encode(v_type)
+        if balance is not None:
+            self.balance[vi] = balance
+        self.version += 1
+        self._refresh_views(vertices=(vi,))
+
+    def delete_vertex(self, vid: int) -> None:
+        """删除点及其相关的所有边,并恢复相关点的余额。"""
+        vi = self.index[vid]
+        related = set(self.out_edge_indices(vi)) | set(self.in_edge_indices(vi))
+        neighbors = set()
+        for ei in related:
+            src, dst, amount = self.src[ei], self.dst[ei], self.amount[ei]
+            self._unlink_edge(ei)
+            if src != vi:
+                self.balance[src] += amount
+            if dst != vi:
+                self.balance[dst] -= amount
+            neighbors.add(src)
+            neighbors.add(dst)
+        for ni in neighbors:
+            self._refresh_time_envelope(ni)
+        self.v_alive[vi] = 0
+        del self.index[vid]
+        self.scc_index = None  # 删除可能拆分分量
+        self.version += 1
+        self._refresh_views(vertices=neighbors)
+        self._maybe_compact()
+
+    def insert_edge(self, edge: Edge) -> None:
+        """插入边,并从源点向目标点转移余额。"""
+        src = self.index[edge.src_vid]
+        dst = self.index[edge.dst_vid]
+        self.balance[src] -= edge.amount
+        self.balance[dst] += edge.amount
+        ei = self._append_edge(
+            edge.eid, src, dst, edge.amount, edge.occur_time, edge.e_type
+        )
+        self._link_extra(ei)
+        self._widen_time_envelope(ei)
+        if self.scc_index is not None:
+            self.scc_index.add_edge(self, src, dst)
+        self.version += 1
+        self._refresh_views(vertices=(src, dst))
+        self._maybe_compact()
+
+    def update_edge(
+        self,
+        eid: int,
+        amount: Optional[int] = None,
+        occur_time: Optional[int] = None,
+        e_type: Optional[str] = None,
+    ) -> None:
+        ei = self.edge_index(eid)
+        if ei is None:
+            raise KeyError(eid)
+        if amount is not None and amount != self.amount[ei]:
+            diff = amount - self.amount[ei]
+            self.balance[self.src[ei]] -= diff
+            self.balance[self.dst[ei]] += diff
+            self.amount[ei] = amount
+        if e_type is not None:
+            self.e_type[ei] = self.e_types.encode(e_type)
+        if occur_time is not None and occur_time != self.occur_time[ei]:
+            # 时间变化会破坏邻接表的时间顺序: 以新时间复制一条边放入增量部分
+            new_ei = self._append_edge(
+                eid,
+                self.src[ei],
+                self.dst[ei],
+                self.amount[ei],
+                occur_time,
+                self.e_types.decode(self.e_type[ei]),
+            )
+            self._unlink_edge(ei)
+            self._link_extra(new_ei)
+            self._refresh_time_envelope(self.src[ei])
+            self._refresh_time_envelope(self.dst[ei])
+        self.version += 1
+        self._refresh_views(vertices=(self.src[ei], self.dst[ei]), edges=(ei,))
+        self._maybe_compact()
+
+    def delete_edge(self, eid: int) -> None:
+        """删除边,并恢复源点和目标点的余额。"""
+        ei = self.edge_index(eid)
+        if ei is None:
+            raise KeyError(eid)
+        self.balance[self.src[ei]] += self.amount[ei]
+        self.balance[self.dst[ei]] -= self.amount[ei]
+        self._unlink_edge(ei)
+        self._refresh_time_envelope(self.src[ei])
+        self._refresh_time_envelope(self.dst[ei])
+        self.scc_index = None  # 删除可能拆分分量
+        self.version += 1
+        self._refresh_views(vertices=(self.src[ei], self.dst[ei]))
+        self._maybe_compact()
+
+    # ==================== 构建 ====================
+
+    def build_csr(self) -> None:
+        """用当前所有存活的边重建 CSR,清空增量部分。
+
+        有已删除的边时会重新编号所有边下标,按边下标计算的过滤视图随之作废。
+        只能在没有查询使用的图上调用: graph_cache 中被固定的图不会被原地修补,
+        修补(及其触发的压缩)发生在副本上。
+        """
+        n = len(self.vids)
+        live = [ei for ei in range(len(self.eids)) if self.e_alive[ei]]
+        if len(live) != len(self.eids) or not self._eids_sorted():
+            self._rewrite_edges(sorted(live, key=self.eids.__getitem__))
+            self.filter_views.clear()
+            self.version += 1
+
+        # 按时间顺序做稳定的计数排序,使每个点的邻接区间按 occur_time 升序
+        by_time = sorted(range(len(self.eids)), key=self.occur_time.__getitem__)
+        self.out_offsets, self.out_edges = _counting_sort(self.src, n, by_time)
+        self.in_offsets, self.in_edges = _counting_sort(self.dst, n, by_time)
+        self.base_vertices = n
+        self.base_edges = len(self.eids)
+        self._extra_out.clear()
+        self._extra_in.clear()
+        self._extra_eid_index.clear()
+        self._dead_edges = 0
+        self._build_time_envelope()
+
+    def _append_vertex(
+        self, vid: int, v_type: str, create_time: int, balance: int
+    ) -> int:
+        vi = len(self.vids)
+        self.vids.append(vid)
+        self.v_type.append(self.v_types.encode(v_type))
+        self.create_time.append(create_time)
+        self.balance.append(balance)
+        self.v_alive.append(1)
+        for column, empty in (
+            (self.out_time_min, TIME_MAX),
+            (self.out_time_max, TIME_MIN),
+            (self.in_time_min, TIME_MAX),
+            (self.in_time_max, TIME_MIN),
+        ):
+            column.append(empty)
+        self.index[vid] = vi
+        return vi
+
+    def _append_edge(
+        self, eid: int, src: int, dst: int, amount: int, occur_time: int, e_type: str
+    ) -> int:
+        ei = len(self.eids)
+        self.eids.append(eid)
+        self.src.append(src)
+        self.dst.append(dst)
+        self.amount.append(amount)
+        self.occur_time.append(occur_time)
+        self.e_type.append(self.e_types.encode(e_type))
+        self.e_alive.append(1)
+        return ei
+
+    # ==================== 内部工具 ====================
+
+    def _adjacent(
+        self,
+        vi: int,
+        offsets: array,
+        targets: array,
+        extra: Dict[int, List[int]],
+        after: Optional[int],
+        before: Optional[int],
+    ) -> List[int]:
+        """返回点的邻接边下标,按 (after, before) 开区间二分截取时间范围。"""
+        time_key = self.occur_time.__getitem__
+        result: List[int] = []
+        if vi < self.base_vertices:
+            lo, hi = offsets[vi], offsets[vi + 1]
+            if after is not None:
+                lo = bisect_right(targets, after, lo, hi, key=time_key)
+            if before is not None:
+                hi = bisect_left(targets, before, lo, hi, key=time_key)
+            if lo < hi:
+                alive = self.e_alive
+                result = [ei for ei in targets[lo:hi] if alive[ei]]
+        more = extra.get(vi)
+        if more:
+            lo, hi = 0, len(more)
+            if after is not None:
+                lo = bisect_right(more, after, key=time_key)
+            if before is not None:
+                hi = bisect_left(more, before, lo, key=time_key)
+            result.extend(more[lo:hi])
+        return result
+
+    def _degree(self, vi: int, offsets: array, extra: Dict[int, List[int]]) -> int:
+        degree = offsets[vi + 1] - offsets[vi] if vi < self.base_vertices else 0
+        more = extra.get(vi)
+        return degree + len(more) if more else degree
+
+    def _build_time_envelope(self) -> None:
+        """由 CSR 计算所有点的时间包络: 邻接区间按时间升序,首尾即最小/最大值。"""
+        n = len(self.vids)
+        time_col = self.occur_time
+        for offsets, targets, lo_col, hi_col in (
+            (self.out_offsets, self.out_edges, "out_time_min", "out_time_max"),
+            (self.in_offsets, self.in_edges, "in_time_min", "in_time_max"),
+        ):
+            lo = array("q", [TIME_MAX]) * n
+            hi = array("q", [TIME_MIN]) * n
+            for vi in range(n):
+                first, last = offsets[vi], offsets[vi + 1]
+                if first < last:
+                    lo[vi] = time_col[targets[first]]
+                    hi[vi] = time_col[targets[last - 1]]
+            setattr(self, lo_col, lo)
+            setattr(self, hi_col, hi)
+
+    def _widen_time_envelope(self, ei: int) -> None:
+        """新增边后扩大两个端点的时间包络。"""
+        t = self.occur_time[ei]
+        src, dst = self.src[ei], self.dst[ei]
+        self.out_time_min[src] = min(self.out_time_min[src], t)
+        self.out_time_max[src] = max(self.out_time_max[src], t)
+        self.in_time_min[dst] = min(self.in_time_min[dst], t)
+        self.in_time_max[dst] = max(self.in_time_max[dst], t)
+
+    def _refresh_time_envelope(self, vi: int) -> None:
+        """删除或修改边后按当前邻接重新计算点的时间包络。"""
+        time_col = self.occur_time
+        out_times = [time_col[ei] for ei in self.out_edge_indices(vi)]
+        in_times = [time_col[ei] for ei in self.in_edge_indices(vi)]
+        self.out_time_min[vi] = min(out_times, default=TIME_MAX)
+        self.out_time_max[vi] = max(out_times, default=TIME_MIN)
+        self.in_time_min[vi] = min(in_times, default=TIME_MAX)
+        self.in_time_max[vi] = max(in_times, default=TIME_MIN)
+
+    def _link_extra(self, ei: int) -> None:
+        """把新边按时间顺序加入增量邻接表。"""
+        time_key = self.occur_time.__getitem__
+        self._extra_eid_index[self.eids[ei]] = ei
+        insort(self._extra_out.setdefault(self.src[ei], []), ei, key=time_key)
+        insort(self._extra_in.setdefault(self.dst[ei], []), ei, key=time_key)
+
+    def _unlink_edge(self, ei: int) -> None:
+        self.e_alive[ei] = 0
+        self._dead_edges += 1
+        if self._extra_eid_index.get(self.eids[ei]) == ei:
+            del self._extra_eid_index[self.eids[ei]]
+        for extra, vi in ((self._extra_out, self.src[ei]), (self._extra_in, self.dst[ei])):
+            edges = extra.get(vi)
+            if edges and ei in edges:
+                edges.remove(ei)
+
+    def _refresh_views(
+        self, vertices: Iterable[int] = (), edges: Iterable[int] = ()
+    ) -> None:
+        """修补后同步修补上一版本的过滤视图,更早版本的视图丢弃。
+
+        新增的点和边由视图自行补齐,vertices/edges 是属性可能变化的点和边。
+        只在未被固定的图上修补,期间没有查询读取视图。
+        """
+        for key, view in list(self.filter_views.items()):
+            if view.version == self.version - 1:
+                view.refresh(self, vertices, edges)
+            else:
+                del self.filter_views[key]
+
+    def _maybe_compact(self) -> None:
+        delta = self._dead_edges + len(self.eids) - self.base_edges
+        if delta > max(COMPACT_MIN_EDGES, self.base_edges * COMPACT_RATIO):
+            self.build_csr()
+
+    def _eids_sorted(self) -> bool:
+        eids = self.eids
+        return all(eids[i] < eids[i + 1] for i in range(len(eids) - 1))
+
+    def _rewrite_edges(self, order: List[int]) -> None:
+        """按给定的边下标顺序重写边列(丢弃未列出的边)。"""
+        for name in ("eids", "src", "dst", "amount", "occur_time", "e_type"):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, [column[ei] for ei in order]))
+        self.e_alive = bytearray(b"\x01" * len(order))
+
+
+# 按下标存放的列,copy() 逐列复制
+_VERTEX_COLUMNS = (
+    "vids", "v_type", "create_time", "balance", "v_alive",
+    "out_time_min", "out_time_max", "in_time_min", "in_time_max",
+)
+_EDGE_COLUMNS = ("eids", "src", "dst", "amount", "occur_time", "e_type", "e_alive")
+_CSR_COLUMNS = ("out_offsets", "out_edges", "in_offsets", "in_edges")
+
+
+def _counting_sort(keys: array, n: int, order: List[int]) -> Tuple[array, array]:
+    """按点下标对边做稳定计数排序,返回 CSR 的 (偏移数组, 边下标数组)。
+
+    同一个点的边在区间内保持 order 中的先后顺序。
+    """
+    offsets = array("q", bytes(8 * (n + 1)))
+    for key in keys:
+        offsets[key + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+
+    targets = array("i", bytes(4 * len(keys)))
+    cursor = array("q", offsets[:n])
+    for ei in order:
+        key = keys[ei]
+        targets[cursor[key]] = ei
+        cursor[key] += 1
+    return offsets, targets
+
+
+def load_graph(username: str, **db_kwargs: Any) -> MemGraph:
+    """从数据库全量加载用户的点和边,构建内存图。"""
+    vertex_table_name, edge_table_name = get_user_table_name(username)
+    graph = MemGraph(username)
+
+    for vid, v_type, create_time, balance in fetch_iter(
+        f"SELECT vid, v_type, create_time, balance FROM {vertex_table_name}",
+        **db_kwargs,
+    ):
+        graph._append_vertex(vid, v_type, create_time, balance)
+
+    index = graph.index
+    for eid, src_vid, dst_vid, amount, occur_time, e_type in fetch_iter(
+        f"SELECT eid, src_vid, dst_vid, amount, occur_time, e_type FROM {edge_table_name} ORDER BY eid",
+        **db_kwargs,
+    ):
+        # 只保留源点和目标点都存在的边
+        src = index.get(src_vid)
+        dst = index.get(dst_vid)
+        if src is not None and dst is not None:
+            graph._append_edge(eid, src, dst, amount, occur_time, e_type)
+
+    graph.build_csr()
+    return graph
@@ -1,12 +1,13 @@
 """环路查找服务 - 基于内存的双向BFS高效环检测算法。
 
-一次性从数据库读取所有数据到内存,然后在内存中进行双向BFS搜索。
+用户的全图由 graph_cache 在首次查询时一次性读入内存并常驻,之后的查询
+直接在内存中按过滤条件进行双向BFS搜索,不再访问数据库。
 相比于bibfs.py,避免了频繁的数据库访问,大幅提升性能。
 """
 
 import time
-from typing import List, Dict, Any, Optional, Set, Tuple
-from collections import deque, defaultdict
+from collections import deque
+from typing import Callable, List, Dict, Any, Optional, Set, Tuple
 from server.opengauss.graph_dao import (
     fetch_all,
     fetch_one,
@@ -14,6 +15,11 @@ from server.opengauss.graph_dao import (
     Edge,
     get_user_table_name,
 )
+from server.core import filter_view, frontier_kernel, graph_cache, scc
+from server.core.deadline import Deadline, SearchTimeout
+from server.core.frontier_schedule import BACKWARD, FORWARD, FrontierSchedule
+from server.core.mem_graph import MemGraph
+from server.core.path_arena import PathArena
 
 
 def query_cycles(
@@ -29,6 +35,7 @@ def query_cycles(
     limit: int = 10,
     allow_duplicate_vertices: bool = False,
     allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
     **db_kwargs: Any,
 ) -> Dict[str, Any]:
     """查询环路 - 使用纯内存双向BFS算法。
@@ -43,224 +50,311 @@ def query_cycles(
         edge_filter_min_amount: 边最小金额过滤
         edge_filter_max_amount: 边最大金额过滤
         limit: 最多返回的环数量
+        timeout_ms: 搜索时间预算(毫秒),到期后返回已找到的环并标记 meta.truncated
         **db_kwargs: 数据库连接参数
 
     Returns:
         Dict: 包含status, found, data(环列表), meta等信息
     """
-    start_time = time.time()
-    print(username)
     try:
-        # 1. 验证起始点存在
-        start_vertex = _get_vertex(start_vid, username, **db_kwargs)
-        if not start_vertex:
-            return {"status": "error", "message": f"Start vertex {start_vid} not found"}
-
-        # 2. 检查起始点是否满足过滤条件
-        if not _vertex_matches_filter(
-            start_vertex, vertex_filter_v_types, vertex_filter_min_balance
-        ):
-            return {
-                "status": "success",
-                "found": False,
-                "message": "Start vertex does not match filters",
-            }
-
-        # 3. 一次性加载所有点和边数据到内存
-        vertices_map, edges_out, edges_in = _load_graph_data(
-            vertex_filter_v_types,
-            vertex_filter_min_balance,
-            edge_filter_e_types,
-            edge_filter_min_amount,
-            edge_filter_max_amount,
-            username,
-            **db_kwargs,
-        )
-
-        # 4. 执行内存双向BFS搜索
-        cycles, seen_cycles = _memory_bidirectional_bfs(
-            start_vid=start_vid,
-            max_depth=max_depth,
-            direction=direction,
-            vertices_map=vertices_map,
-            edges_out=edges_out,
-            edges_in=edges_in,
-            limit=limit,
-            allow_duplicate_vertices=allow_duplicate_vertices,
-            allow_duplicate_edges=allow_duplicate_edges,
-        )
-
-        # 5. 构造返回结果
-        execution_time = int((time.time() - start_time) * 1000)
-
-        if not cycles:
-            return {
-                "status": "success",
-                "found": False,
-                "meta": {"execution_time_ms": execution_time},
-            }
-
-        # 6. 获取环的详细信息
-        cycle_data = []
-        for cycle_path in cycles:
-            vertices_data, edges_data = _get_cycle_details_from_memory(
-                cycle_path, vertices_map
+        # 搜索期间固定内存图,并发的写操作修补副本,不影响本次搜索
+        with graph_cache.pinned_graph(username, **db_kwargs):
+            search = make_searcher(
+                max_depth,
+                username,
+                direction,
+                vertex_filter_v_types,
+                vertex_filter_min_balance,
+                edge_filter_e_types,
+                edge_filter_min_amount,
+                edge_filter_max_amount,
+                limit,
+                allow_duplicate_vertices,
+                allow_duplicate_edges,
+                timeout_ms,
+                **db_kwargs,
             )
-            cycle_data.append({"vertices": vertices_data, "edges": edges_data})
-
-        return {
-            "status": "success",
-            "found": True,
-            "count": len(cycle_data),
-            "data": cycle_data,
-            "meta": {"execution_time_ms": execution_time},
-        }
-
+            return search(start_vid)
     except Exception as e:
         return {"status": "error", "message": f"Cycle query failed: {e}"}
 
 
-def _load_graph_data(
-    vertex_filter_v_types: Optional[List[str]],
-    vertex_filter_min_balance: Optional[int],
-    edge_filter_e_types: Optional[List[str]],
-    edge_filter_min_amount: Optional[int],
-    edge_filter_max_amount: Optional[int],
+def make_searcher(
+    max_depth: int,
     username: str,
+    direction: str = "forward",
+    vertex_filter_v_types: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_types: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    limit: int = 10,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
     **db_kwargs: Any,
-) -> Tuple[Dict[int, Vertex], Dict[int, List[Edge]], Dict[int, List[Edge]]]:
-    """一次性加载所有符合条件的点和边数据到内存。
+) -> Callable[[int], Dict[str, Any]]:
+    """获取内存图并构建过滤条件,返回对单个起点执行搜索的函数。
 
-    Returns:
-        vertices_map: vid -> Vertex 映射
-        edges_out: src_vid -> [Edge] 出边邻接表
-        edges_in: dst_vid -> [Edge] 入边邻接表
+    批量查询时所有起点共用同一个搜索函数,图和过滤条件只准备一次。
+    参数含义同 query_cycles,timeout_ms 对每个起点单独计时。
+    返回的函数一直使用此时取得的图,调用方应在 graph_cache.pinned_graph 内使用它。
     """
-    # 1. 加载点数据
-    vertex_conditions = []
-    vertex_params = []
-    vertex_table_name, edge_table_name = get_user_table_name(username)
-    if vertex_filter_v_types:
-        placeholders = ",".join(["%s"] * len(vertex_filter_v_types))
-        vertex_conditions.append(f"v_type IN ({placeholders})")
-        vertex_params.extend(vertex_filter_v_types)
-
-    if vertex_filter_min_balance is not None:
-        vertex_conditions.append("balance >= %s")
-        vertex_params.append(vertex_filter_min_balance)
-
-    vertex_sql = f"SELECT vid, v_type, create_time, balance FROM {vertex_table_name}"
-    if vertex_conditions:
-        vertex_sql += " WHERE " + " AND ".join(vertex_conditions)
-
-    vertex_rows = fetch_all(
-        vertex_sql, tuple(vertex_params) if vertex_params else None, **db_kwargs
+    # 获取用户的内存图(进程级缓存,只在首次查询时从数据库加载)
+    graph = graph_cache.get_graph(username, **db_kwargs)
+
+    # 选择过滤视图(按过滤条件缓存的点/边位图)
+    view = filter_view.get_view(
+        graph,
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
     )
-    vertices_map = {row[0]: Vertex.from_tuple(row) for row in vertex_rows} # vid -> Vertex
+    edge_ok = view.edge_ok if view is not None else None
+    scc_index = scc.get_index(graph)
+
+    def search(start_vid: int) -> Dict[str, Any]:
+        start_time = time.time()
+        deadline = Deadline(timeout_ms)
+        try:
+            # 1. 验证起始点存在
+            start_vertex = graph.get_vertex(start_vid)
+            if not start_vertex:
+                return {"status": "error", "message": f"Start vertex {start_vid} not found"}
+
+            # 2. 检查起始点是否满足过滤条件
+            if not _vertex_matches_filter(
+                start_vertex, vertex_filter_v_types, vertex_filter_min_balance
+            ):
+                return {
+                    "status": "success",
+                    "found": False,
+                    "message": "Start vertex does not match filters",
+                }
+
+            # 3. 起点不在任何环上时直接返回,否则只在起点所在的强连通分量内搜索
+            start = graph.vertex_index(start_vid)
+            if not scc_index.on_cycle(start):
+                return {
+                    "status": "success",
+                    "found": False,
+                    "message": "Start vertex is not on any cycle",
+                }
+            component_ok = scc.component_edge_filter(graph, scc_index, start, edge_ok)
+            kernel = None
+            if frontier_kernel.available():
+                kernel = frontier_kernel.FrontierKernel(
+                    graph,
+                    view.edge_mask if view is not None else None,
+                    scc_index.comp,
+                    scc_index.comp[start],
+                )
+
+            # 4. 执行内存双向BFS搜索
+            cycles, schedule = _memory_bidirectional_bfs(
+                start_vid=start_vid,
+                max_depth=max_depth,
+                direction=direction,
+                graph=graph,
+                edge_ok=component_ok,
+                limit=limit,
+                allow_duplicate_vertices=allow_duplicate_vertices,
+                allow_duplicate_edges=allow_duplicate_edges,
+                kernel=kernel,
+                deadline=deadline,
+            )
 
-    # 2. 加载边数据
-    edge_conditions = []
-    edge_params = []
+            # 5. 构造返回结果
+            execution_time = int((time.time() - start_time) * 1000)
+            meta = {"execution_time_ms": execution_time, **schedule.meta()}
 
-    if edge_filter_e_types:
-        placeholders = ",".join(["%s"] * len(edge_filter_e_types))
-        edge_conditions.append(f"e_type IN ({placeholders})")
-        edge_params.extend(edge_filter_e_types)
+            if not cycles:
+                return {"status": "success", "found": False, "meta": meta}
 
-    if edge_filter_min_amount is not None:
-        edge_conditions.append("amount >= %s")
-        edge_params.append(edge_filter_min_amount)
+            # 6. 获取环的详细信息
+            cycle_data = []
+            for cycle_path in cycles:
+                vertices_data, edges_data = _get_cycle_details_from_memory(
+                    cycle_path, graph
+                )
+                cycle_data.append({"vertices": vertices_data, "edges": edges_data})
 
-    if edge_filter_max_amount is not None:
-        edge_conditions.append("amount <= %s")
-        edge_params.append(edge_filter_max_amount)
+            return {
+                "status": "success",
+                "found": True,
+                "count": len(cycle_data),
+                "data": cycle_data,
+                "meta": meta,
+            }
 
-    edge_sql = f"SELECT eid, src_vid, dst_vid, amount, occur_time, e_type FROM {edge_table_name}"
-    if edge_conditions:
-        edge_sql += " WHERE " + " AND ".join(edge_conditions)
+        except Exception as e:
+            return {"status": "error", "message": f"Cycle query failed: {e}"}
 
-    edge_rows = fetch_all(
-        edge_sql, tuple(edge_params) if edge_params else None, **db_kwargs
-    )
+    return search
 
-    # 3. 构建邻接表
-    edges_out = defaultdict(list)  # src_vid -> [Edge]
-    edges_in = defaultdict(list)  # dst_vid -> [Edge]
 
-    for row in edge_rows:
-        edge = Edge.from_tuple(row)
-        # 只保留源点和目标点都存在的边
-        if edge.src_vid in vertices_map and edge.dst_vid in vertices_map:
-            edges_out[edge.src_vid].append(edge)
-            edges_in[edge.dst_vid].append(edge)
+def _edge_filter(
+    graph: MemGraph,
+    vertex_filter_v_types: Optional[List[str]],
+    vertex_filter_min_balance: Optional[int],
+    edge_filter_e_types: Optional[List[str]],
+    edge_filter_min_amount: Optional[int],
+    edge_filter_max_amount: Optional[int],
+) -> Optional[Callable[[int], bool]]:
+    """返回按边下标判断是否满足过滤条件的函数,无过滤条件时返回 None。
 
-    return vertices_map, dict(edges_out), dict(edges_in)
+    边需要自身满足边过滤条件,且源点和目标点都满足点过滤条件。
+    判断基于 filter_view 缓存的边位图。
+    """
+    view = filter_view.get_view(
+        graph,
+        vertex_filter_v_types,
+        vertex_filter_min_balance,
+        edge_filter_e_types,
+        edge_filter_min_amount,
+        edge_filter_max_amount,
+    )
+    return view.edge_ok if view is not None else None
 
 
 def _memory_bidirectional_bfs(
     start_vid: int,
     max_depth: int,
     direction: str,
-    vertices_map: Dict[int, Vertex],
-    edges_out: Dict[int, List[Edge]],
-    edges_in: Dict[int, List[Edge]],
+    graph: MemGraph,
+    edge_ok: Optional[Callable[[int], bool]],
     limit: int,
     allow_duplicate_vertices: bool,
     allow_duplicate_edges: bool,
-) -> Tuple[List[List[Tuple[int, int, int, Edge]]], Set[Tuple]]:
-    """纯内存双向BFS核心算法。
+    kernel: Optional[frontier_kernel.FrontierKernel] = None,
+    deadline: Optional[Deadline] = None,
+) -> Tuple[List[List[Tuple[int, int, int, int]]], FrontierSchedule]:
+    """纯内存双向BFS核心算法,直接在 MemGraph 的 CSR 数组上搜索。
+
+    每一步扩展当前层度数之和较小的一侧,两侧深度之和不超过 max_depth。
+    搜索前先反向BFS计算每个点回到起点的最少边数,正向扩展时丢弃剩余深度
+    不足以回到起点的点。给出 kernel 且待扩展的边足够多时使用向量化扩展,
+    结果与逐边扩展相同。
+
+    deadline 到期时丢弃正在扩展的一层,返回已找到的环,schedule.truncated 为 True。
 
     Returns:
-        Tuple: (环路列表, 已见环路签名集合)
+        Tuple: (环路列表, 扩展调度记录)
     """
+    schedule = FrontierSchedule(max_depth)
+
     # 检查起点是否在图中
-    if start_vid not in vertices_map:
-        return [], set()
-
-    # 正向搜索状态: vid -> (parent_vid, edge, depth, path_vids, path_edges_full, occur_time)
-    # path_edges_full 存储完整的 Edge 对象
-    fwd_state: Dict[
-        int, Tuple[Optional[int], Optional[Edge], int, List[int], List[Edge], int]
-    ] = {}
-    # 反向搜索状态: vid -> (parent_vid, edge, depth, path_vids, path_edges_full, occur_time)
-    bwd_state: Dict[
-        int, Tuple[Optional[int], Optional[Edge], int, List[int], List[Edge], int]
-    ] = {}
-
-    # 初始化起点
-    fwd_state[start_vid] = (None, None, 0, [start_vid], [], 0)
-    bwd_state[start_vid] = (None, None, 0, [start_vid], [], 0)
-
-    # 当前层的节点
-    fwd_frontier = {start_vid}
-    bwd_frontier = {start_vid}
+    start = graph.vertex_index(start_vid)
+    if start is None:
+        return [], schedule
+
+    # 预处理: 每个点回到起点的最少边数
+    try:
+        dist_to_start, _ = distance_to_start(graph, start, max_depth, edge_ok, deadline)
+    except SearchTimeout:
+        schedule.truncate()
+        return [], schedule
+    if kernel is not None:
+        kernel.use_distances(dist_to_start)
+    temporal = direction == "forward"
+
+    # 正向/反向搜索状态以父指针树保存,state 记录每个点当前保留的状态 id
+    fwd_arena, bwd_arena = PathArena(), PathArena()
+    fwd_state: Dict[int, int] = {start: fwd_arena.add_root(start)}
+    bwd_state: Dict[int, int] = {start: bwd_arena.add_root(start)}
+
+    # 当前层的状态及其扩展代价
+    fwd_frontier = [fwd_state[start]]
+    bwd_frontier = [bwd_state[start]]
+    fwd_cost = graph.out_degree(start)
+    bwd_cost = graph.in_degree(start)
 
     cycles = []
     seen_cycles = set()  # 存储已见环路的签名
-    current_depth = 1
 
-    while current_depth <= max_depth and len(cycles) < limit:
-        # 正向扩展
-        new_fwd_frontier = _expand_forward_memory(
-            fwd_frontier,
-            fwd_state,
-            edges_out,
-            direction,
-            current_depth,
-        )
-
-        if not new_fwd_frontier:
+    while len(cycles) < limit:
+        side = schedule.next_side(fwd_cost, bwd_cost)
+        if side is None:
+            break
+        if deadline is not None and deadline.expired():
+            schedule.truncate()
             break
 
-        fwd_frontier = new_fwd_frontier
+        try:
+            if side == FORWARD:
+                # 正向扩展
+                if kernel is not None and fwd_cost >= frontier_kernel.VECTOR_MIN_EDGES:
+                    new_frontier = kernel.expand_forward(
+                        fwd_frontier,
+                        fwd_arena,
+                        fwd_state,
+                        schedule.depth[FORWARD] + 1,
+                        temporal,
+                        max_depth,
+                    )
+                else:
+                    new_frontier = _expand_forward_memory(
+                        fwd_frontier,
+                        fwd_arena,
+                        fwd_state,
+                        graph,
+                        edge_ok,
+                        direction,
+                        schedule.depth[FORWARD] + 1,
+                        dist_to_start,
+                        max_depth,
+                        deadline,
+                    )
+                if not new_frontier:
+                    schedule.exhaust(FORWARD)
+                    continue
+                schedule.advance(FORWARD)
+                fwd_frontier = new_frontier
+                fwd_cost = sum(graph.out_degree(fwd_arena.vi[sid]) for sid in fwd_frontier)
+            else:
+                # 反向扩展
+                if kernel is not None and bwd_cost >= frontier_kernel.VECTOR_MIN_EDGES:
+                    new_frontier = kernel.expand_backward(
+                        bwd_frontier,
+                        bwd_arena,
+                        bwd_state,
+                        schedule.depth[BACKWARD] + 1,
+                        temporal,
+                    )
+                else:
+                    new_frontier = _expand_backward_memory(
+                        bwd_frontier,
+                        bwd_arena,
+                        bwd_state,
+                        graph,
+                        edge_ok,
+                        direction,
+                        schedule.depth[BACKWARD] + 1,
+                        deadline,
+                    )
+                if not new_frontier:
+                    schedule.exhaust(BACKWARD)
+                    continue
+                schedule.advance(BACKWARD)
+                bwd_frontier = new_frontier
+                bwd_cost = sum(graph.in_degree(bwd_arena.vi[sid]) for sid in bwd_frontier)
+        except SearchTimeout:
+            # 期限已到,丢弃正在扩展的一层
+            schedule.truncate()
+            break
 
-        # 检查碰撞
+        # 检查碰撞: 只用新扩展出的一层探测另一方向的状态
         new_cycles = _detect_cycles_memory(
+            new_frontier,
+            side == FORWARD,
+            fwd_arena,
             fwd_state,
+            bwd_arena,
             bwd_state,
-            start_vid,
-            edges_out,
-            edges_in,
+            start,
+            graph,
             allow_duplicate_vertices,
             allow_duplicate_edges,
             limit - len(cycles),
@@ -268,195 +362,215 @@ def _memory_bidirectional_bfs(
         )
         cycles.extend(new_cycles)
 
-        if len(cycles) >= limit:
-            break
-
-        # 反向扩展
-        new_bwd_frontier = _expand_backward_memory(
-            bwd_frontier,
-            bwd_state,
-            edges_in,
-            direction,
-            current_depth,
-        )
-
-        if not new_bwd_frontier:
-            break
+    return cycles, schedule
 
-        bwd_frontier = new_bwd_frontier
 
-        # 再次检查碰撞
-        new_cycles = _detect_cycles_memory(
-            fwd_state,
-            bwd_state,
-            start_vid,
-            edges_out,
-            edges_in,
-            allow_duplicate_vertices,
-            allow_duplicate_edges,
-            limit - len(cycles),
-            seen_cycles,
-        )
-        cycles.extend(new_cycles)
+def distance_to_start(
+    graph: MemGraph,
+    start: int,
+    max_depth: int,
+    edge_ok: Optional[Callable[[int], bool]],
+    deadline: Optional[Deadline] = None,
+) -> Tuple[Dict[int, int], List[int]]:
+    """沿入边反向BFS,计算每个点回到起点的最少边数(不超过 max_depth)。
 
-        if len(cycles) >= limit:
-            break
+    只经过满足 edge_ok 的边。不在结果中的点无法在 max_depth 步内回到起点。
+    每访问一个点检查一次 deadline,到期时抛出 SearchTimeout。
 
-        current_depth += 1
+    Returns:
+        Tuple: (点下标 -> 最少边数, 反向BFS中经过的边下标列表)
+    """
+    dist = {start: 0}
+    ball_edges: List[int] = []
+    src_col = graph.src
+    queue = deque([start])
+
+    while queue:
+        if deadline is not None:
+            deadline.check()
+        vi = queue.popleft()
+        d = dist[vi]
+        if d >= max_depth:
+            continue
+        for ei in graph.in_edge_indices(vi):
+            if edge_ok is not None and not edge_ok(ei):
+                continue
+            ball_edges.append(ei)
+            src = src_col[ei]
+            if src not in dist:
+                dist[src] = d + 1
+                queue.append(src)
 
-    return cycles, seen_cycles
+    return dist, ball_edges
 
 
 def _expand_forward_memory(
-    frontier: Set[int],
-    state: Dict[
-        int, Tuple[Optional[int], Optional[Edge], int, List[int], List[Edge], int]
-    ],
-    edges_out: Dict[int, List[Edge]],
+    frontier: List[int],
+    arena: PathArena,
+    state: Dict[int, int],
+    graph: MemGraph,
+    edge_ok: Optional[Callable[[int], bool]],
     direction: str,
     target_depth: int,
-) -> Set[int]:
-    """内存正向扩展一层。"""
-    new_frontier = set()
-
-    for vid in frontier:
-        parent_vid, parent_edge, depth, path_vids, path_edges, occur_time = state[vid]
-
-        if depth != target_depth - 1:
+    dist_to_start: Dict[int, int],
+    max_depth: int,
+    deadline: Optional[Deadline] = None,
+) -> List[int]:
+    """内存正向扩展一层,返回新一层的状态 id 列表。
+
+    dist_to_start 中没有、或回到起点所需边数超过剩余深度的点直接丢弃。
+    时序搜索时还用点的时间包络剪枝: 到达时间不早于该点最晚出边、或不早于
+    起点最晚入边的路径不可能再按时序回到起点。
+    每扩展一个状态检查一次 deadline,到期时抛出 SearchTimeout。
+    """
+    new_frontier = []
+    dst_col, time_col = graph.dst, graph.occur_time
+    depth_col = arena.depth
+    remaining = max_depth - target_depth
+    temporal = direction == "forward"
+    out_time_max = graph.out_time_max
+    latest_return = graph.in_time_max[arena.vi[0]]  # 状态 0 是起点
+
+    for sid in frontier:
+        if deadline is not None:
+            deadline.check()
+        vi = arena.vi[sid]
+        occur_time = arena.time[sid]
+        if temporal and occur_time >= latest_return:
             continue
 
-        # 获取出边
-        out_edges = edges_out.get(vid, [])
+        # 获取出边(时序过滤: 邻接表按时间有序,二分直接跳过不晚于到达时间的边)
+        after = occur_time if temporal else None
+        for ei in graph.out_edge_indices(vi, after=after):
+            if edge_ok is not None and not edge_ok(ei):
+                continue
 
-        for edge in out_edges:
-            # 时序过滤
-            if direction == "forward" and edge.occur_time <= occur_time:
+            # 剩余深度不足以回到起点
+            dst = dst_col[ei]
+            if dist_to_start.get(dst, remaining + 1) > remaining:
+                continue
+
+            # 时间包络: 到达后无法再按时序离开该点或回到起点
+            t = time_col[ei]
+            if temporal and (t >= out_time_max[dst] or t >= latest_return):
                 continue
 
             # 避免重复访问已在路径中的点
-            if edge.dst_vid in path_vids:
+            if arena.on_path(sid, dst):
                 continue
 
             # 如果该点已经在这一层被访问过,跳过(保留第一次访问的路径)
-            if edge.dst_vid in state and state[edge.dst_vid][2] == target_depth:
+            prev = state.get(dst)
+            if prev is not None and depth_col[prev] == target_depth:
                 continue
 
-            # 添加到新状态，保存完整Edge对象
-            new_path_vids = path_vids + [edge.dst_vid]
-            new_path_edges = path_edges + [edge]
-
-            state[edge.dst_vid] = (
-                vid,
-                edge,
-                target_depth,
-                new_path_vids,
-                new_path_edges,
-                edge.occur_time,
-            )
-            new_frontier.add(edge.dst_vid)
+            new_sid = arena.add(sid, dst, ei, t)
+            state[dst] = new_sid
+            new_frontier.append(new_sid)
 
     return new_frontier
 
 
 def _expand_backward_memory(
-    frontier: Set[int],
-    state: Dict[
-        int, Tuple[Optional[int], Optional[Edge], int, List[int], List[Edge], int]
-    ],
-    edges_in: Dict[int, List[Edge]],
+    frontier: List[int],
+    arena: PathArena,
+    state: Dict[int, int],
+    graph: MemGraph,
+    edge_ok: Optional[Callable[[int], bool]],
     direction: str,
     target_depth: int,
-) -> Set[int]:
-    """内存反向扩展一层。"""
-    new_frontier = set()
-
-    for vid in frontier:
-        parent_vid, parent_edge, depth, path_vids, path_edges, occur_time = state[vid]
-
-        if depth != target_depth - 1:
-            continue
-
-        # 获取入边
-        in_edges = edges_in.get(vid, [])
-
-        for edge in in_edges:
-            # 时序过滤(反向搜索时间更早)
-            if (
-                direction == "forward"
-                and occur_time != 0
-                and edge.occur_time >= occur_time
-            ):
+    deadline: Optional[Deadline] = None,
+) -> List[int]:
+    """内存反向扩展一层,返回新一层的状态 id 列表。期限检查同正向扩展。"""
+    new_frontier = []
+    src_col, time_col = graph.src, graph.occur_time
+    depth_col = arena.depth
+
+    for sid in frontier:
+        if deadline is not None:
+            deadline.check()
+        vi = arena.vi[sid]
+        occur_time = arena.time[sid]
+
+        # 获取入边(时序过滤: 反向搜索时间更早,二分截取早于当前时间的边)
+        before = occur_time if direction == "forward" and occur_time != 0 else None
+        for ei in graph.in_edge_indices(vi, before=before):
+            if edge_ok is not None and not edge_ok(ei):
                 continue
 
             # 避免重复访问已在路径中的点
-            if edge.src_vid in path_vids:
+            src = src_col[ei]
+            if arena.on_path(sid, src):
                 continue
 
-            # 添加到新状态，保存完整Edge对象
-            new_path_vids = path_vids + [edge.src_vid]
-            new_path_edges = path_edges + [edge]
-
             # 如果该点已经在这一层被访问过,跳过
-            if edge.src_vid in state and state[edge.src_vid][2] == target_depth:
+            prev = state.get(src)
+            if prev is not None and depth_col[prev] == target_depth:
                 continue
 
-            state[edge.src_vid] = (
-                vid,
-                edge,
-                target_depth,
-                new_path_vids,
-                new_path_edges,
-                edge.occur_time,
-            )
-            new_frontier.add(edge.src_vid)
+            new_sid = arena.add(sid, src, ei, time_col[ei])
+            state[src] = new_sid
+            new_frontier.append(new_sid)
 
     return new_frontier
 
 
 def _detect_cycles_memory(
-    fwd_state: Dict[
-        int, Tuple[Optional[int], Optional[Edge], int, List[int], List[Edge], int]
-    ],
-    bwd_state: Dict[
-        int, Tuple[Optional[int], Optional[Edge], int, List[int], List[Edge], int]
-    ],
-    start_vid: int,
-    edges_out: Dict[int, List[Edge]],
-    edges_in: Dict[int, List[Edge]],
+    new_layer: List[int],
+    layer_is_forward: bool,
+    fwd_arena: PathArena,
+    fwd_state: Dict[int, int],
+    bwd_arena: PathArena,
+    bwd_state: Dict[int, int],
+    start: int,
+    graph: MemGraph,
     allow_duplicate_vertices: bool,
     allow_duplicate_edges: bool,
     remaining_limit: int,
     seen_cycles: Set[Tuple],
-) -> List[List[Tuple[int, int, int, Edge]]]:
-    """检测两个方向的碰撞,找出环路。"""
-    cycles = []
+) -> List[List[Tuple[int, int, int, int]]]:
+    """检测新扩展的一层与另一方向状态的碰撞,找出环路。
 
-    # 找到碰撞点(同时在正向和反向状态中,且不是起点)
-    collision_vids = (set(fwd_state.keys()) & set(bwd_state.keys())) - {start_vid}
+    更早的层之间的碰撞在它们各自扩展时已经检测过,这里不再重复。
+    只为碰撞点回溯完整路径。返回的环路格式为 [(src_vid, dst_vid, eid, edge_idx), ...]。
+    """
+    cycles = []
+    vids, eids = graph.vids, graph.eids
+    start_vid = vids[start]
+    layer_arena = fwd_arena if layer_is_forward else bwd_arena
+    opposite_state = bwd_state if layer_is_forward else fwd_state
 
-    for meet_vid in collision_vids:
+    for sid in new_layer:
         if len(cycles) >= remaining_limit:
             break
 
-        # 获取正向和反向路径
-        _, _, _, fwd_path_vids, fwd_path_edges, _ = fwd_state[meet_vid]
-        _, _, _, bwd_path_vids, bwd_path_edges, _ = bwd_state[meet_vid]
+        # 碰撞点: 新状态所在的点也出现在另一方向的状态中(且不是起点)
+        meet_vi = layer_arena.vi[sid]
+        opposite_sid = opposite_state.get(meet_vi)
+        if opposite_sid is None or meet_vi == start:
+            continue
+
+        fwd_sid, bwd_sid = (sid, opposite_sid) if layer_is_forward else (opposite_sid, sid)
+
+        # 沿父指针回溯正向和反向路径
+        fwd_path_vis, fwd_path_eis = fwd_arena.path(fwd_sid)
+        bwd_path_vis, bwd_path_eis = bwd_arena.path(bwd_sid)
 
         # 构造完整环路
         # 正向路径: start_vid -> ... -> meet_vid
         fwd_path = []
-        for i, edge in enumerate(fwd_path_edges):
-            src = fwd_path_vids[i]
-            dst = fwd_path_vids[i + 1]
-            fwd_path.append((src, dst, edge.eid, edge))
+        for i, ei in enumerate(fwd_path_eis):
+            src = vids[fwd_path_vis[i]]
+            dst = vids[fwd_path_vis[i + 1]]
+            fwd_path.append((src, dst, eids[ei], ei))
 
         # 反向路径: meet_vid -> ... -> start_vid (需要反转)
         bwd_path = []
-        for i in range(len(bwd_path_edges) - 1, -1, -1):
-            edge = bwd_path_edges[i]
-            src = bwd_path_vids[i + 1]
-            dst = bwd_path_vids[i]
-            bwd_path.append((src, dst, edge.eid, edge))
+        for i in range(len(bwd_path_eis) - 1, -1, -1):
+            ei = bwd_path_eis[i]
+            src = vids[bwd_path_vis[i + 1]]
+            dst = vids[bwd_path_vis[i]]
+            bwd_path.append((src, dst, eids[ei], ei))
 
         # 合并路径
         full_cycle = fwd_path + bwd_path
@@ -475,7 +589,7 @@ def _detect_cycles_memory(
 
 
 def _validate_cycle(
-    cycle: List[Tuple[int, int, int, Edge]],
+    cycle: List[Tuple[int, int, int, int]],
     start_vid: int,
     allow_duplicate_vertices: bool,
     allow_duplicate_edges: bool,
@@ -493,8 +607,8 @@ def _validate_cycle(
 
 
 def _get_cycle_details_from_memory(
-    cycle_path: List[Tuple[int, int, int, Edge]],
-    vertices_map: Dict[int, Vertex],
+    cycle_path: List[Tuple[int, int, int, int]],
+    graph: MemGraph,
 ) -> Tuple[List[Dict], List[Dict]]:
     """从内存中获取环路的详细信息。"""
     # 收集所有vid
@@ -506,13 +620,14 @@ def _get_cycle_details_from_memory(
     # 从内存获取点信息
     vertices = []
     for vid in vids:
-        if vid in vertices_map:
-            vertices.append(vertices_map[vid].to_dict())
+        vertex = graph.get_vertex(vid)
+        if vertex is not None:
+            vertices.append(vertex.to_dict())
 
-    # 从cycle_path中获取完整边信息
+    # 从边下标还原完整边信息
     edges = []
-    for src, dst, eid, edge in cycle_path:
-        edges.append(edge.to_dict())
+    for src, dst, eid, ei in cycle_path:
+        edges.append(graph.edge(ei).to_dict())
 
     return vertices, edges
 
@@ -568,14 +683,14 @@ def _vertex_matches_filter(
     return True
 
 
-def _get_cycle_signature(cycle: List[Tuple[int, int, int, Edge]]) -> Tuple:
+def _get_cycle_signature(cycle: List[Tuple[int, int, int, int]]) -> Tuple:
     """生成环路的唯一签名，用于去重。
 
     同一个环路，无论从哪个点开始，都应该生成相同的签名。
     例如: 1->2->3->1, 2->3->1->2, 3->1->2->3 是同一个环
 
     Args:
-        cycle: 环路，格式为 [(src_vid, dst_vid, eid, edge_obj), ...]
+        cycle: 环路，格式为 [(src_vid, dst_vid, eid, edge_idx), ...]
 
     Returns:
         环路的归一化签名
@@ -0,0 +1,84 @@
+"""搜索路径存储 - 以父指针树保存 BFS/DFS 的搜索状态。
+
+每个搜索状态只记录 (点下标, 边下标, 父状态, 深度, 时间),路径通过父指针
+共享前缀,只有最终返回的环才回溯出完整路径。
+
+路径成员判断使用 64 位路径签名: 每个状态保存其路径上所有点下标按 64 取模
+后的位图。签名中对应位为 0 时可以 O(1) 确定点不在路径上,只有位冲突时才
+沿父指针回溯确认。
+"""
+
+from array import array
+from typing import List, Tuple
+
+
+NO_PARENT = -1
+SIGNATURE_BITS = 64
+
+
+class PathArena:
+    """父指针树形式的搜索状态池,状态以整数 id 引用。"""
+
+    __slots__ = ("vi", "ei", "parent", "depth", "time", "sig")
+
+    def __init__(self) -> None:
+        self.vi = array("i")  # 状态所在的点下标
+        self.ei = array("i")  # 到达该状态的边下标(根状态为 -1)
+        self.parent = array("i")  # 父状态 id(根状态为 -1)
+        self.depth = array("i")
+        self.time = array("q")  # 到达该状态的边时间(根状态为 0)
+        self.sig = array("Q")  # 路径签名
+
+    def __len__(self) -> int:
+        return len(self.vi)
+
+    def add_root(self, vi: int) -> int:
+        """添加起点状态,返回状态 id。"""
+        return self._append(vi, -1, NO_PARENT, 0, 0, 1 << (vi % SIGNATURE_BITS))
+
+    def add(self, parent: int, vi: int, ei: int, time: int) -> int:
+        """在 parent 状态之后经边 ei 到达点 vi,返回新状态 id。"""
+        return self._append(
+            vi,
+            ei,
+            parent,
+            self.depth[parent] + 1,
+            time,
+            self.sig[parent] | (1 << (vi % SIGNATURE_BITS)),
+        )
+
+    def on_path(self, sid: int, vi: int) -> bool:
+        """判断点 vi 是否在状态 sid 的路径上。"""
+        if not (self.sig[sid] >> (vi % SIGNATURE_BITS)) & 1:
+            return False
+        vis, parents = self.vi, self.parent
+        while sid != NO_PARENT:
+            if vis[sid] == vi:
+                return True
+            sid = parents[sid]
+        return False
+
+    def path(self, sid: int) -> Tuple[List[int], List[int]]:
+        """回溯状态 sid 的完整路径,返回 (点下标列表, 边下标列表),从根开始。"""
+        vis: List[int] = []
+        eis: List[int] = []
+        while sid != NO_PARENT:
+            vis.append(self.vi[sid])
+            if self.ei[sid] >= 0:
+                eis.append(self.ei[sid])
+            sid = self.parent[sid]
+        vis.reverse()
+        eis.reverse()
+        return vis, eis
+
+    def _append(
+        self, vi: int, ei: int, parent: int, depth: int, time: int, sig: int
+    ) -> int:
+        sid = len(self.vi)
+        self.vi.append(vi)
+        self.ei.append(ei)
+        self.parent.append(parent)
+        self.depth.append(depth)
+        self.time.append(time)
+        self.sig.append(sig)
+        return sid
@@ -0,0 +1,245 @@
+"""环路查找服务 - 在数据库内执行的双向BFS(存储过程)。
+
+算法与 bibfs 相同(过滤条件、时序规则、扩展调度、limit 一致),但整个扩展/碰撞
+循环由 PL/pgSQL 函数 cycle_bibfs(定义在 sql/init_schema.py)在数据库内执行,
+一次调用返回全部环路,不再为每一层付出一次网络往返。适合应用服务器与数据库
+之间延迟较高的部署。init_schema 会安装该函数;没有运行过 init_schema(或安装的
+是旧版本)的数据库在第一次查询时自动安装,每个进程对每个数据库只检查一次。
+
+指定 timeout_ms 时函数在每次扩展之前检查期限,到期后返回已找到的环并标记
+meta.truncated;单层扩展本身不会被中断,因此语句的 statement_timeout 在期限之后
+再留 STATEMENT_GRACE_MS 作为兜底,兜底超时时已找到的环一并丢弃。
+"""
+
+import threading
+import time
+from typing import List, Dict, Any, Optional, Set, Tuple
+from server.opengauss.connection import database_key
+from server.opengauss.graph_dao import (
+    execute_ddl,
+    fetch_all,
+    fetch_one,
+    statement_deadline,
+    get_user_table_name,
+)
+from server.core.bibfs import _get_cycle_details, _get_vertex, _vertex_matches_filter
+from server.core.deadline import Deadline
+from server.core.frontier_schedule import FrontierSchedule
+from sql.init_schema import get_cycle_function_ddl
+
+
+# 数据库内的环路搜索函数,定义见 sql/init_schema.py
+CYCLE_FUNCTION = "cycle_bibfs"
+
+# 已确认安装了当前版本 cycle_bibfs 的数据库(进程内)
+_installed: Set[str] = set()
+_installed_lock = threading.Lock()
+
+# 函数只在两层之间检查期限,语句超时在期限之后留出的余量(毫秒)
+STATEMENT_GRACE_MS = 1000
+
+
+def query_cycles(
+    start_vid: int,
+    max_depth: int,
+    username: str,
+    direction: str = "forward",
+    vertex_filter_v_types: Optional[List[str]] = None,
+    vertex_filter_min_balance: Optional[int] = None,
+    edge_filter_e_types: Optional[List[str]] = None,
+    edge_filter_min_amount: Optional[int] = None,
+    edge_filter_max_amount: Optional[int] = None,
+    limit: int = 10,
+    allow_duplicate_vertices: bool = False,
+    allow_duplicate_edges: bool = False,
+    timeout_ms: Optional[int] = None,
+    **db_kwargs: Any,
+) -> Dict[str, Any]:
+    """查询环路 - 调用数据库内的双向BFS函数。
+
+    Args:
+        start_vid: 起始点ID
+        max_depth: 最大搜索深度(环路长度)
+        username: 用户名，用于确定查询哪个用户的表
+        direction: 时序方向, "forward"(时间递增) 或 "any"(无时序要求)
+        vertex_filter_v_types: 点类型过滤列表
+        vertex_filter_min_balance: 点最小余额过滤
+        edge_filter_e_types: 边类型过滤列表
+        edge_filter_min_amount: 边最小金额过滤
+        edge_filter_max_amount: 边最大金额过滤
+        limit: 最多返回的环数量
+        allow_duplicate_vertices: 是否允许环中出现重复点(除起点外)
+        allow_duplicate_edges: 是否允许环中出现重复边
+        timeout_ms: 搜索时间预算(毫秒),到期后返回已找到的环并标记 meta.truncated
+        **db_kwargs: 数据库连接参数
+
+    Returns:
+        Dict: 包含status, found, data(环列表), meta等信息
+    """
+    start_time = time.time()
+    deadline = Deadline(timeout_ms)
+
+    try:
+        # 1. 验证起始点存在
+        start_vertex = _get_vertex(start_vid, username, **db_kwargs)
+        if not start_vertex:
+            return {"status": "error", "message": f"Start vertex {start_vid} not found"}
+
+        # 2. 检查起始点是否满足过滤条件
+        if not _vertex_matches_filter(
+            start_vertex, vertex_filter_v_types, vertex_filter_min_balance
+        ):
+            return {
+                "status": "success",
+                "found": False,
+                "message": "Start vertex does not match filters",
+            }
+
+        # 3. 在数据库内执行双向BFS搜索
+        cycles, schedule_meta = _call_cycle_function(
+            start_vid,
+            max_depth,
+            username,
+            direction,
+            vertex_filter_v_types,
+            vertex_filter_min_balance,
+            edge_filter_e_types,
+            edge_filter_min_amount,
+            edge_filter_max_amount,
+            limit,
+            allow_duplicate_vertices,
+            allow_duplicate_edges,
+            deadline,
+            **db_kwargs,
+        )
+
+        # 4. 构造返回结果
+        execution_time = int((time.time() - start_time) * 1000)
+        meta = {"execution_time_ms": execution_time, **schedule_meta}
+
+        if not cycles:
+            return {"status": "success", "found": False, "meta": meta}
+
+        # 5. 获取环的详细信息
+        cycle_data = []
+        for cycle_path in cycles:
+            vertices_data, edges_data = _get_cycle_details(cycle_path, username, **db_kwargs)
+            cycle_data.append({"vertices": vertices_data, "edges": edges_data})
+
+        return {
+            "status": "success",
+            "found": True,
+            "count": len(cycle_data),
+            "data": cycle_data,
+            "meta": meta,
+        }
+
+    except Exception as e:
+        return {"status": "error", "message": f"Cycle query failed: {e}"}
+
+
+def ensure_cycle_function(**db_kwargs: Any) -> None:
+    """确保数据库中安装了当前版本的 cycle_bibfs(表参数为 REGCLASS),缺失时安装。"""
+    key = database_key(**db_kwargs)
+    with _installed_lock:
+        if key in _installed:
+            return
+    row = fetch_one(
+        "SELECT COUNT(*) FROM pg_proc WHERE proname = %s AND proargtypes[0] = 'regclass'::regtype",
+        (CYCLE_FUNCTION,),
+        **db_kwargs,
+    )
+    if not row or row[0] == 0:
+        try:
+            execute_ddl(get_cycle_function_ddl(), **db_kwargs)
+        except Exception as e:
+            raise Exception(
+                f"Database function {CYCLE_FUNCTION} is not installed and could not be "
+                f"created ({e}); run sql/init_schema.py as a user allowed to create functions"
+            ) from e
+    with _installed_lock:
+        _installed.add(key)
+
+
+def _call_cycle_function(
+    start_vid: int,
+    max_depth: int,
+    username: str,
+    direction: str,
+    vertex_filter_v_types: Optional[List[str]],
+    vertex_filter_min_balance: Optional[int],
+    edge_filter_e_types: Optional[List[str]],
+    edge_filter_min_amount: Optional[int],
+    edge_filter_max_amount: Optional[int],
+    limit: int,
+    allow_duplicate_vertices: bool,
+    allow_duplicate_edges: bool,
+    deadline: Deadline,
+    **db_kwargs: Any,
+) -> Tuple[List[List[Tuple[int, int, int]]], Dict[str, Any]]:
+    """调用 cycle_bibfs,返回 (环路列表, 扩展调度信息)。
+
+    环路是(src_vid, dst_vid, eid)的列表;调度信息与 FrontierSchedule.meta() 格式相同。
+    """
+    ensure_cycle_function(**db_kwargs)
+    vertex_table_name, edge_table_name = get_user_table_name(username)
+    timeout_ms = None
+    hard_stop = None
+    if deadline.expires_at is not None:
+        remaining = deadline.expires_at - time.monotonic()
+        timeout_ms = max(0, int(remaining * 1000))
+        hard_stop = deadline.expires_at + STATEMENT_GRACE_MS / 1000
+
+    try:
+        with statement_deadline(hard_stop):
+            rows = fetch_all(
+                f"""
+                SELECT cycle_vids, cycle_eids, steps, forward_depth, backward_depth, truncated
+                FROM {CYCLE_FUNCTION}(
+                    %s::REGCLASS, %s::REGCLASS, %s, %s, %s, %s::TEXT[], %s, %s::TEXT[],
+                    %s, %s, %s, %s, %s, %s
+                )
+                """,
+                (
+                    vertex_table_name,
+                    edge_table_name,
+                    start_vid,
+                    max_depth,
+                    direction == "forward",
+                    vertex_filter_v_types or None,
+                    vertex_filter_min_balance,
+                    edge_filter_e_types or None,
+                    edge_filter_min_amount,
+                    edge_filter_max_amount,
+                    limit,
+                    allow_duplicate_vertices,
+                    allow_duplicate_edges,
+                    timeout_ms,
+                ),
+                **db_kwargs,
+            )
+    except Exception:
+        # 兜底的语句超时: 函数的结果全部丢失,只能报告已截断
+        if not deadline.expired():
+            raise
+        schedule = FrontierSchedule(max_depth)
+        schedule.truncate()
+        return [], schedule.meta()
+
+    _, _, steps, forward_depth, backward_depth, truncated = rows[0]
+    schedule_meta = {
+        "schedule": list(steps),
+        "forward_depth": forward_depth,
+        "backward_depth": backward_depth,
+        "depth_reached": forward_depth + backward_depth,
+        "truncated": truncated,
+    }
+
+    cycles = []
+    for cycle_vids, cycle_eids, *_ in rows:
+        if cycle_eids is None:
+            continue
+        cycles.append(
+            [(cycle_vids[i], cycle_vids[i + 1], eid) for i, eid in enumerate(cycle_eids)]
+        )
+    return cycles, schedule_meta
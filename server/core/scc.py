@@ -0,0 +1,271 @@
+"""强连通分量 - 在内存图上计算 SCC,用于剪掉不可能位于环上的点。
+
+环上的所有点必然属于同一个强连通分量。只含一个点且没有自环的分量
+(平凡分量)中的点不可能位于任何环上。
+
+SccIndex 是用户全图(不带过滤条件)的分量索引,挂在 MemGraph 上随图常驻,
+插入点和边时增量维护,供环路查询提前返回并把搜索限制在起点所在分量内。
+"""
+
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from server.core.mem_graph import MemGraph
+
+
+UNVISITED = -1
+
+
+def strongly_connected_components(
+    graph: MemGraph, edge_ok: Optional[Callable[[int], bool]] = None
+) -> Tuple[array, int]:
+    """迭代版 Tarjan 算法,只使用满足 edge_ok 的边。
+
+    Returns:
+        Tuple: (点下标 -> 分量编号, 分量数量)。已删除的点分量编号为 -1。
+    """
+    n = len(graph.vids)
+    order = array("i", [UNVISITED]) * n  # 访问次序
+    low = array("i", [0]) * n
+    comp = array("i", [UNVISITED]) * n
+    on_stack = bytearray(n)
+    stack: List[int] = []
+    counter = 0
+    n_comp = 0
+    dst_col, alive = graph.dst, graph.v_alive
+
+    def successors(vi: int) -> Iterator[int]:
+        for ei in graph.out_edge_indices(vi):
+            if edge_ok is None or edge_ok(ei):
+                yield dst_col[ei]
+
+    for root in range(n):
+        if order[root] != UNVISITED or not alive[root]:
+            continue
+
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, successors(root))]
+
+        while work:
+            vi, it = work[-1]
+            descended = False
+            for w in it:
+                if order[w] == UNVISITED:
+                    order[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = 1
+                    work.append((w, successors(w)))
+                    descended = True
+                    break
+                if on_stack[w] and order[w] < low[vi]:
+                    low[vi] = order[w]
+            if descended:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                if low[vi] < low[parent]:
+                    low[parent] = low[vi]
+
+            # vi 是分量的根,弹出整个分量
+            if low[vi] == order[vi]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = 0
+                    comp[w] = n_comp
+                    if w == vi:
+                        break
+                n_comp += 1
+
+    return comp, n_comp
+
+
+def cyclic_vertices(
+    graph: MemGraph,
+    comp: array,
+    n_comp: int,
+    edge_ok: Optional[Callable[[int], bool]] = None,
+) -> List[int]:
+    """返回可能位于环上的点下标: 属于非平凡分量,或带有自环。"""
+    sizes = [0] * n_comp
+    for c in comp:
+        if c != UNVISITED:
+            sizes[c] += 1
+
+    result = []
+    src_col, dst_col = graph.src, graph.dst
+    for vi, c in enumerate(comp):
+        if c == UNVISITED:
+            continue
+        if sizes[c] > 1:
+            result.append(vi)
+            continue
+        for ei in graph.out_edge_indices(vi):
+            if src_col[ei] == dst_col[ei] and (edge_ok is None or edge_ok(ei)):
+                result.append(vi)
+                break
+    return result
+
+
+class SccIndex:
+    """用户全图的强连通分量索引。
+
+    分量之间维护一个拓扑序 rank: 分量间的每条边都从 rank 小的分量指向 rank
+    大的分量。插入边时按 Pearce-Kelly 算法只在两端 rank 之间的窗口内搜索:
+    新边形成环时合并环上的分量,否则只调整窗口内分量的先后顺序。
+    删除点或边可能拆分分量,MemGraph 会直接丢弃索引,下次使用时重建。
+    """
+
+    __slots__ = ("comp", "rank", "size", "self_loop", "_next_rank")
+
+    def __init__(self, graph: MemGraph):
+        comp, n_comp = strongly_connected_components(graph)
+        self.comp = comp  # 点下标 -> 分量编号
+        # Tarjan 先弹出下游分量,编号越小越靠后
+        self.rank = array("q", range(n_comp - 1, -1, -1))
+        self.size = array("i", [0]) * n_comp
+        for c in comp:
+            if c != UNVISITED:
+                self.size[c] += 1
+        self.self_loop = bytearray(len(comp))
+        src_col, dst_col, alive = graph.src, graph.dst, graph.e_alive
+        for ei in range(len(graph.eids)):
+            if alive[ei] and src_col[ei] == dst_col[ei]:
+                self.self_loop[src_col[ei]] = 1
+        self._next_rank = n_comp
+
+    def copy(self) -> "SccIndex":
+        """复制索引,随 MemGraph.copy() 一起使用。"""
+        index = SccIndex.__new__(SccIndex)
+        index.comp = self.comp[:]
+        index.rank = self.rank[:]
+        index.size = self.size[:]
+        index.self_loop = self.self_loop[:]
+        index._next_rank = self._next_rank
+        return index
+
+    def on_cycle(self, vi: int) -> bool:
+        """点是否可能位于环上: 属于非平凡分量,或带有自环。"""
+        c = self.comp[vi]
+        return c != UNVISITED and (self.size[c] > 1 or bool(self.self_loop[vi]))
+
+    def component_size(self, vi: int) -> int:
+        c = self.comp[vi]
+        return self.size[c] if c != UNVISITED else 0
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        """分量统计: 分量数、非平凡分量数、位于环上的点数和最大的若干分量。"""
+        sizes = [size for size in self.size if size > 0]
+        on_cycle = sum(1 for vi in range(len(self.comp)) if self.on_cycle(vi))
+        return {
+            "components": len(sizes),
+            "cyclic_components": sum(1 for size in sizes if size > 1),
+            "vertices_on_cycles": on_cycle,
+            "largest": sorted(sizes, reverse=True)[:top],
+        }
+
+    def estimated_bytes(self) -> int:
+        columns = (self.comp, self.rank, self.size)
+        return sum(col.itemsize * len(col) for col in columns) + len(self.self_loop)
+
+    # ==================== 增量维护(由 MemGraph 调用) ====================
+
+    def add_vertex(self, vi: int) -> None:
+        """新点自成一个分量,排在所有分量之后。"""
+        assert vi == len(self.comp)
+        self.comp.append(len(self.size))
+        self.size.append(1)
+        self.rank.append(self._next_rank)
+        self._next_rank += 1
+        self.self_loop.append(0)
+
+    def add_edge(self, graph: MemGraph, src: int, dst: int) -> None:
+        """新边 src -> dst 已加入图后更新分量和拓扑序。"""
+        if src == dst:
+            self.self_loop[src] = 1
+            return
+
+        comp, rank = self.comp, self.rank
+        cs, cd = comp[src], comp[dst]
+        if cs == cd or rank[cs] < rank[cd]:
+            return
+
+        # 窗口内从 dst 可达的分量,以及能到达 src 的分量
+        lower, upper = rank[cd], rank[cs]
+        reached = self._collect(graph, dst, True, lower, upper)
+        reaching = self._collect(graph, src, False, lower, upper)
+        slots = sorted(rank[c] for c in reached.keys() | reaching.keys())
+
+        # 新边形成环: 既从 dst 可达又能到达 src 的分量合并为一个
+        merged = reached.keys() & reaching.keys() if cs in reached else set()
+        before = sorted(reaching.keys() - merged, key=rank.__getitem__)
+        after = sorted(reached.keys() - merged, key=rank.__getitem__)
+        if merged:
+            for c in merged:
+                if c == cs:
+                    continue
+                for vi in reached[c]:
+                    comp[vi] = cs
+                self.size[cs] += self.size[c]
+                self.size[c] = 0
+            before.append(cs)
+
+        # 能到达 src 的分量(含合并后的分量)占用最小的若干位置,
+        # 从 dst 可达的分量占用最大的若干位置
+        for c, r in zip(before, slots):
+            rank[c] = r
+        for c, r in zip(after, slots[len(slots) - len(after):]):
+            rank[c] = r
+
+    def _collect(
+        self, graph: MemGraph, root: int, outgoing: bool, lower: int, upper: int
+    ) -> Dict[int, List[int]]:
+        """从 root 沿出边(或入边)搜索 rank 在 [lower, upper] 内的点,按分量分组返回。
+
+        分量内的点互相可达,因此进入过的分量总是被完整收集。
+        """
+        comp, rank = self.comp, self.rank
+        ends = graph.dst if outgoing else graph.src
+        adjacent = graph.out_edge_indices if outgoing else graph.in_edge_indices
+        found: Dict[int, List[int]] = {}
+        seen = {root}
+        stack = [root]
+        while stack:
+            vi = stack.pop()
+            found.setdefault(comp[vi], []).append(vi)
+            for ei in adjacent(vi):
+                w = ends[ei]
+                if w not in seen and lower <= rank[comp[w]] <= upper:
+                    seen.add(w)
+                    stack.append(w)
+        return found
+
+
+def get_index(graph: MemGraph) -> SccIndex:
+    """获取图的分量索引,不存在(首次使用或被删除操作丢弃)时重新计算。"""
+    index = graph.scc_index
+    if index is None:
+        index = graph.scc_index = SccIndex(graph)
+    return index
+
+
+def component_edge_filter(
+    graph: MemGraph,
+    index: SccIndex,
+    start: int,
+    edge_ok: Optional[Callable[[int], bool]],
+) -> Callable[[int], bool]:
+    """只允许起点所在分量内部的边,再叠加 edge_ok。"""
+    src_col, dst_col, comp = graph.src, graph.dst, index.comp
+    component = comp[start]
+
+    def component_ok(ei: int) -> bool:
+        if comp[src_col[ei]] != component or comp[dst_col[ei]] != component:
+            return False
+        return edge_ok is None or edge_ok(ei)
+
+    return component_ok
@@ -0,0 +1,280 @@
+"""bibfs 工作表池 - 复用预先创建的 UNLOGGED 工作表,避免每次搜索建表、删表。
+
+每次搜索租用一组工作表(一个租约):
+    scratch_<lease>_dist, scratch_<lease>_fwd_<d>, scratch_<lease>_bwd_<d> (d = 0..layers-1)
+表在第一次需要时创建并提交,之后一直保留,不再为每次搜索向 pg_class/pg_attribute
+写入和删除表定义、持有建表删表的系统表锁。搜索在一个事务内写入工作表,结束时回滚,
+写入的行成为工作表中的死元组,由 autovacuum 回收;搜索开始时在事务内用 DELETE
+清空(不使用 TRUNCATE,它为表和索引分配新文件并改写 pg_class 的行,回滚后留下
+死元组)。只有较大的层会被 ANALYZE(见 bibfs.ANALYZE_MIN_ROWS)。
+
+租约登记在表 scratch_lease 中(owner 为 "主机名:进程号",heartbeat 为最近心跳的
+Unix 时间)。归还的租约留在进程内的空闲列表中复用,超过 MAX_IDLE_LEASES 时删除,
+同时释放各连接上引用其工作表的预备语句(graph_dao.discard_prepared)。
+后台清扫线程每 SWEEP_INTERVAL 秒为本进程的租约更新心跳,并删除孤儿租约的工作表:
+同一主机上进程已不存在的,或心跳超过 ORPHAN_AFTER 秒未更新的。
+"""
+
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Tuple
+from server.opengauss.graph_dao import (
+    discard_prepared,
+    execute_ddl,
+    execute_dml,
+    execute_multi,
+    fetch_all,
+)
+
+
+LEASE_TABLE = "scratch_lease"
+
+# 每个数据库配置在进程内最多保留的空闲租约数
+MAX_IDLE_LEASES = 8
+
+# 清扫线程的运行间隔(秒)
+SWEEP_INTERVAL = 60
+
+# 心跳超过该时间(秒)未更新的租约视为孤儿
+ORPHAN_AFTER = 10 * SWEEP_INTERVAL
+
+_lock = threading.Lock()
+# 数据库配置 -> 空闲租约
+_idle: Dict[Tuple, List["Lease"]] = {}
+# 数据库配置 -> 连接参数(已确认 scratch_lease 表存在的配置)
+_configs: Dict[Tuple, Dict[str, Any]] = {}
+_sweeper: "threading.Thread | None" = None
+
+
+def _reset_after_fork() -> None:
+    """子进程不继承父进程的租约和清扫线程。"""
+    global _lock, _sweeper
+    _lock = threading.Lock()
+    _idle.clear()
+    _configs.clear()
+    _sweeper = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@dataclass(slots=True)
+class Lease:
+    """一组工作表的租约。layers 为每一侧已创建的层表数。"""
+
+    lease_id: str
+    layers: int = 0
+
+    @property
+    def table_prefix(self) -> str:
+        """租约所有工作表名的公共前缀。"""
+        return f"scratch_{self.lease_id}_"
+
+    @property
+    def dist_table(self) -> str:
+        return f"{self.table_prefix}dist"
+
+    def layer_table(self, side: str, depth: int) -> str:
+        """某一侧第 depth 层的工作表名。"""
+        return f"{self.table_prefix}{side}_{depth}"
+
+    def tables(self) -> List[str]:
+        return [self.dist_table] + [
+            self.layer_table(side, depth)
+            for side in ("fwd", "bwd")
+            for depth in range(self.layers)
+        ]
+
+
+@contextmanager
+def lease(layers: int, **db_kwargs: Any) -> Iterator[Lease]:
+    """租用一组工作表,每一侧至少有 layers 张层表。退出时归还。
+
+    工作表可能留有上一次使用的数据(例如上一次的事务已提交),使用前应在
+    本次的事务内 DELETE 全部 tables()。
+    """
+    key = _config_key(db_kwargs)
+    _ensure_registry(key, db_kwargs)
+    with _lock:
+        idle = _idle.setdefault(key, [])
+        scratch = idle.pop() if idle else None
+    if scratch is None:
+        scratch = Lease(uuid.uuid4().hex[:12])
+        execute_dml(
+            f"INSERT INTO {LEASE_TABLE} (lease_id, owner, heartbeat, layers) VALUES (%s, %s, %s, 0)",
+            (scratch.lease_id, _owner(), int(time.time())),
+            **db_kwargs,
+        )
+
+    try:
+        _ensure_layers(scratch, layers, **db_kwargs)
+    except Exception:
+        _drop_lease(scratch, **db_kwargs)
+        raise
+
+    try:
+        yield scratch
+    finally:
+        with _lock:
+            idle = _idle.setdefault(key, [])
+            if len(idle) < MAX_IDLE_LEASES:
+                idle.append(scratch)
+                scratch = None
+        if scratch is not None:
+            _drop_lease(scratch, **db_kwargs)
+
+
+def sweep_orphans(**db_kwargs: Any) -> int:
+    """删除孤儿租约的工作表和登记记录,返回删除的租约数。"""
+    now = int(time.time())
+    host = socket.gethostname()
+    rows = fetch_all(f"SELECT lease_id, owner, heartbeat, layers FROM {LEASE_TABLE}", **db_kwargs)
+
+    swept = 0
+    for lease_id, owner, heartbeat, layers in rows:
+        if owner == _owner():
+            continue
+        owner_host, _, owner_pid = owner.rpartition(":")
+        dead = owner_host == host and owner_pid.isdigit() and not _pid_alive(int(owner_pid))
+        if dead or heartbeat < now - ORPHAN_AFTER:
+            _drop_lease(Lease(lease_id, layers), **db_kwargs)
+            swept += 1
+    return swept
+
+
+def _ensure_registry(key: Tuple, db_kwargs: Dict[str, Any]) -> None:
+    """第一次使用某个数据库配置时建登记表,并启动清扫线程。"""
+    global _sweeper
+    with _lock:
+        if key in _configs:
+            return
+    execute_ddl(
+        f"""
+        CREATE TABLE IF NOT EXISTS {LEASE_TABLE} (
+            lease_id  VARCHAR(32) PRIMARY KEY,
+            owner     VARCHAR(256) NOT NULL,
+            heartbeat BIGINT NOT NULL,
+            layers    INT NOT NULL
+        ) WITH (ORIENTATION = ROW);
+        """,
+        **db_kwargs,
+    )
+    with _lock:
+        _configs[key] = dict(db_kwargs)
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_loop, name="scratch-sweeper", daemon=True)
+            _sweeper.start()
+            atexit.register(_drop_idle_leases)
+
+
+def _ensure_layers(scratch: Lease, layers: int, **db_kwargs: Any) -> None:
+    """补建租约缺少的工作表(已有的表保留),并提交。"""
+    if scratch.layers >= layers and scratch.layers > 0:
+        return
+    statements: List[Tuple[str, Any]] = []
+    if scratch.layers == 0:
+        statements += [
+            (
+                f"CREATE UNLOGGED TABLE IF NOT EXISTS {scratch.dist_table} ("
+                f"vid BIGINT NOT NULL, dist INT NOT NULL) WITH (ORIENTATION = ROW)",
+                None,
+            ),
+            (
+                f"CREATE INDEX IF NOT EXISTS idx_{scratch.dist_table}_vid "
+                f"ON {scratch.dist_table}(vid)",
+                None,
+            ),
+        ]
+    for depth in range(scratch.layers, layers):
+        for side in ("fwd", "bwd"):
+            table = scratch.layer_table(side, depth)
+            statements += [
+                (
+                    f"""
+                    CREATE UNLOGGED TABLE IF NOT EXISTS {table} (
+                        vid BIGINT NOT NULL,
+                        parent_vid BIGINT,
+                        occur_time BIGINT NOT NULL,
+                        eid BIGINT,
+                        path_vids BIGINT[],
+                        path_eids BIGINT[]
+                    ) WITH (ORIENTATION = ROW)
+                    """,
+                    None,
+                ),
+                (f"CREATE INDEX IF NOT EXISTS idx_{table}_vid ON {table}(vid)", None),
+            ]
+    layers = max(layers, scratch.layers)
+    statements.append(
+        (
+            f"UPDATE {LEASE_TABLE} SET layers = %s, heartbeat = %s WHERE lease_id = %s",
+            (layers, int(time.time()), scratch.lease_id),
+        )
+    )
+    execute_multi(statements, **db_kwargs)
+    scratch.layers = layers
+
+
+def _drop_lease(scratch: Lease, **db_kwargs: Any) -> None:
+    """删除租约的工作表和登记记录,并释放各连接上引用这些表的预备语句。"""
+    statements: List[Tuple[str, Any]] = [
+        (f"DROP TABLE IF EXISTS {table}", None) for table in scratch.tables()
+    ]
+    statements.append((f"DELETE FROM {LEASE_TABLE} WHERE lease_id = %s", (scratch.lease_id,)))
+    execute_multi(statements, **db_kwargs)
+    discard_prepared(scratch.table_prefix)
+
+
+def _drop_idle_leases() -> None:
+    """进程退出时删除本进程的空闲租约;仍在使用的租约由其它进程的清扫线程回收。"""
+    with _lock:
+        idle = {key: list(leases) for key, leases in _idle.items()}
+        _idle.clear()
+        configs = dict(_configs)
+    for key, leases in idle.items():
+        for scratch in leases:
+            try:
+                _drop_lease(scratch, **configs[key])
+            except Exception:
+                pass  # 忽略清理错误,交给清扫线程
+
+
+def _sweep_loop() -> None:
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        with _lock:
+            configs = list(_configs.values())
+        for db_kwargs in configs:
+            try:
+                execute_dml(
+                    f"UPDATE {LEASE_TABLE} SET heartbeat = %s WHERE owner = %s",
+                    (int(time.time()), _owner()),
+                    **db_kwargs,
+                )
+                sweep_orphans(**db_kwargs)
+            except Exception as e:
+                print(f"清扫工作表失败: {e}")
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _config_key(db_kwargs: Dict[str, Any]) -> Tuple:
+    return tuple(sorted(db_kwargs.items()))
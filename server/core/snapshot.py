@@ -0,0 +1,366 @@
+"""内存图快照 - 把 MemGraph 的列式数组保存为二进制文件,进程启动后直接映射加载。
+
+从数据库全量加载大图需要逐行读取、重映射和构建 CSR,耗时与图规模成正比。
+MemGraph 的数据本来就是一组定长数组,快照文件按列原样保存这些数组:
+
+    MAGIC | 头部(格式版本, 元数据长度, 日志序号) | 元数据(JSON) | 各列数据
+
+每列按 8 字节对齐,元数据记录类型字典、CSR 覆盖范围和每列的 (类型码, 偏移, 长度)。
+加载时 mmap 文件,每列用一次 frombytes 整块复制到 array 中(MemGraph 的列需要
+支持修补时追加,不能直接使用只读映射),再由 vids 重建 vid -> 下标的字典。
+
+快照记录写入时图变更日志(graph_log)的序号,加载后重放之后的日志追上数据库。
+快照缺失、损坏、序号比数据库还新(日志被清空)、之后的日志已被删除或重放失败
+时回退到全量加载,全量加载前后日志序号不变时顺便写入新快照。写入快照后删除
+快照已包含的日志(graph_log.prune)。服务运行期间 graph_cache.patch 每次写操作
+调用 record_write,同一用户累计 REFRESH_AFTER 次写操作后在后台线程中刷新快照
+(读取快照、重放日志、重写并删除日志,refresh_snapshot),日志表不会在两次加载
+之间无限增长。
+
+快照文件按数据库(主机、端口、库名)和用户名区分,连接不同数据库的同名用户
+不会读到彼此的快照。
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from typing import Any, Dict, List, Optional, Set, Tuple
+from server.core import graph_log
+from server.core import mem_graph
+from server.core.mem_graph import MemGraph
+from server.opengauss.connection import database_key
+from server.opengauss.graph_dao import TypeDict
+
+
+# 快照目录,可用环境变量 CGQL_SNAPSHOT_DIR 覆盖
+SNAPSHOT_DIR = os.environ.get(
+    "CGQL_SNAPSHOT_DIR", os.path.join(os.path.expanduser("~"), ".cgql", "snapshots")
+)
+
+MAGIC = b"CGQLSNAP"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<IIq")  # 格式版本, 元数据长度, 日志序号
+_ALIGN = 8
+
+# 重放的日志条数超过该值时,加载完成后重写快照
+REWRITE_AFTER = 10000
+
+# 服务运行期间同一用户每累计多少次写操作在后台刷新一次快照
+REFRESH_AFTER = REWRITE_AFTER
+
+# 快照文件路径 -> 上次刷新后累计的写操作数
+_writes: Dict[str, int] = {}
+# 正在后台刷新的快照文件路径
+_refreshing: Set[str] = set()
+_refresh_lock = threading.Lock()
+
+# 保存的列: (MemGraph 属性名, 类型码),"B" 表示 bytearray
+_COLUMNS: List[Tuple[str, str]] = [
+    ("vids", "q"),
+    ("v_type", "i"),
+    ("create_time", "q"),
+    ("balance", "q"),
+    ("v_alive", "B"),
+    ("out_time_min", "q"),
+    ("out_time_max", "q"),
+    ("in_time_min", "q"),
+    ("in_time_max", "q"),
+    ("eids", "q"),
+    ("src", "i"),
+    ("dst", "i"),
+    ("amount", "q"),
+    ("occur_time", "q"),
+    ("e_type", "i"),
+    ("e_alive", "B"),
+    ("out_offsets", "q"),
+    ("out_edges", "i"),
+    ("in_offsets", "q"),
+    ("in_edges", "i"),
+]
+
+
+def snapshot_path(username: str, **db_kwargs: Any) -> str:
+    return os.path.join(SNAPSHOT_DIR, database_key(**db_kwargs), f"{username}.snap")
+
+
+def write_snapshot(graph: MemGraph, log_seq: int, **db_kwargs: Any) -> str:
+    """把图写入快照文件(先写临时文件再原子替换),返回文件路径。
+
+    增量邻接不写入快照,有增量时先重建 CSR,因此只能对尚未放入 graph_cache
+    (没有其他线程使用)的图调用。
+    """
+    path = snapshot_path(graph.username, **db_kwargs)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_file(graph, log_seq, path)
+    return path
+
+
+def export_graph(graph: MemGraph, path: str) -> None:
+    """把图写入指定路径的快照文件,不修改原图,可以对固定中的图调用。
+
+    batch_runner 的工作进程用 read_snapshot 加载导出的图。有增量邻接时
+    复制一份再重建 CSR;日志序号记为 0,导出的文件不作为用户的快照使用。
+    """
+    if graph._extra_out or graph._extra_in or graph._dead_edges:
+        graph = graph.copy()
+    _write_file(graph, 0, path)
+
+
+def _write_file(graph: MemGraph, log_seq: int, path: str) -> None:
+    """写入快照文件: 先写临时文件,再原子替换 path。"""
+    if graph._extra_out or graph._extra_in or graph._dead_edges:
+        graph.build_csr()
+
+    columns: Dict[str, List[Any]] = {}
+    offset = 0
+    for name, typecode in _COLUMNS:
+        data = getattr(graph, name)
+        columns[name] = [typecode, offset, len(data)]
+        offset += _aligned(memoryview(data).nbytes)
+
+    meta = json.dumps(
+        {
+            "username": graph.username,
+            "byteorder": sys.byteorder,
+            "v_type_names": graph.v_types.names,
+            "e_type_names": graph.e_types.names,
+            "base_vertices": graph.base_vertices,
+            "base_edges": graph.base_edges,
+            "columns": columns,
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+    # 元数据用空格补齐,使列数据从 8 字节对齐的位置开始
+    prefix = len(MAGIC) + _HEADER.size
+    meta += b" " * (_aligned(prefix + len(meta)) - prefix - len(meta))
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER.pack(FORMAT_VERSION, len(meta), log_seq))
+            f.write(meta)
+            for name, _ in _COLUMNS:
+                data = getattr(graph, name)
+                nbytes = memoryview(data).nbytes
+                f.write(data)
+                f.write(b"\0" * (_aligned(nbytes) - nbytes))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_snapshot(path: str) -> Tuple[MemGraph, int]:
+    """读取快照文件,返回 (图, 日志序号)。文件格式不符时抛出 ValueError。"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        prefix = len(MAGIC) + _HEADER.size
+        if len(mm) < prefix or mm[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a graph snapshot")
+        version, meta_len, log_seq = _HEADER.unpack_from(mm, len(MAGIC))
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version {version}")
+        meta = json.loads(mm[prefix : prefix + meta_len].decode("utf-8"))
+        if meta["byteorder"] != sys.byteorder:
+            raise ValueError("Snapshot was written on a machine with different byte order")
+
+        graph = MemGraph(meta["username"])
+        data_start = prefix + meta_len
+        for name, (typecode, offset, count) in meta["columns"].items():
+            start = data_start + offset
+            if typecode == "B":
+                column: Any = bytearray(mm[start : start + count])
+            else:
+                column = array(typecode)
+                column.frombytes(mm[start : start + count * column.itemsize])
+            if len(column) != count:
+                raise ValueError(f"Snapshot column {name} is truncated")
+            setattr(graph, name, column)
+
+    graph.v_types = TypeDict(meta["v_type_names"])
+    graph.e_types = TypeDict(meta["e_type_names"])
+    graph.base_vertices = meta["base_vertices"]
+    graph.base_edges = meta["base_edges"]
+
+    vids, alive = graph.vids, graph.v_alive
+    if all(alive):
+        graph.index = dict(zip(vids, range(len(vids))))
+    else:
+        graph.index = {vids[vi]: vi for vi in range(len(vids)) if alive[vi]}
+    return graph, log_seq
+
+
+def build_snapshot(username: str, **db_kwargs: Any) -> Dict[str, Any]:
+    """从数据库全量加载用户的图并写入快照。
+
+    Args:
+        username: 用户名
+        **db_kwargs: 数据库连接参数
+
+    Returns:
+        Dict: 包含status, data(快照路径、日志序号、点数、边数、文件大小)等信息
+    """
+    try:
+        graph_log.ensure_log_table(username, **db_kwargs)
+        graph, log_seq = _load_from_database(username, **db_kwargs)
+        if log_seq is None:
+            return {
+                "status": "error",
+                "message": "Graph changed while loading, please retry",
+            }
+        path = write_snapshot(graph, log_seq, **db_kwargs)
+        graph_log.prune(username, log_seq, **db_kwargs)
+        return {
+            "status": "success",
+            "message": f"Snapshot for {username} written to {path}.",
+            "data": {
+                "path": path,
+                "log_seq": log_seq,
+                "vertices": graph.vertex_count,
+                "edges": graph.edge_count,
+                "bytes": os.path.getsize(path),
+            },
+        }
+    except Exception as e:
+        return {"status": "error", "message": f"Build snapshot failed: {e}"}
+
+
+def refresh_snapshot(username: str, **db_kwargs: Any) -> Dict[str, Any]:
+    """读取用户的快照,重放之后的日志后重写快照并删除已包含的日志。
+
+    没有可用的快照时从数据库全量加载并写入快照(同 build_snapshot)。
+
+    Returns:
+        Dict: 包含status, data(快照路径、日志序号、重放的日志条数)等信息
+    """
+    try:
+        seqs = graph_log.seq_range(username, **db_kwargs)
+        if seqs is None:
+            return {"status": "error", "message": f"User {username} has no change log"}
+        replayed = _replay_snapshot(username, *seqs, **db_kwargs)
+        if replayed is None:
+            return build_snapshot(username, **db_kwargs)
+        graph, log_seq, count = replayed
+        path = write_snapshot(graph, log_seq, **db_kwargs) if count else snapshot_path(username, **db_kwargs)
+        graph_log.prune(username, log_seq, **db_kwargs)
+        return {
+            "status": "success",
+            "message": f"Snapshot for {username} refreshed.",
+            "data": {"path": path, "log_seq": log_seq, "replayed": count},
+        }
+    except Exception as e:
+        return {"status": "error", "message": f"Refresh snapshot failed: {e}"}
+
+
+def record_write(username: str, **db_kwargs: Any) -> None:
+    """记录用户的一次写操作,累计 REFRESH_AFTER 次时在后台线程中刷新快照。
+
+    同一用户同时只有一个刷新线程,刷新期间的写操作计入下一轮。
+    """
+    path = snapshot_path(username, **db_kwargs)
+    with _refresh_lock:
+        count = _writes.get(path, 0) + 1
+        if count < REFRESH_AFTER or path in _refreshing:
+            _writes[path] = count
+            return
+        _writes[path] = 0
+        _refreshing.add(path)
+
+    def run() -> None:
+        try:
+            refresh_snapshot(username, **db_kwargs)
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(path)
+
+    threading.Thread(target=run, name=f"snapshot-{username}", daemon=True).start()
+
+
+def load_graph(username: str, **db_kwargs: Any) -> MemGraph:
+    """graph_cache 的加载函数: 优先读取快照并重放之后的变更日志,否则全量加载。"""
+    seqs = graph_log.seq_range(username, **db_kwargs)
+    if seqs is None:
+        # 没有日志表(旧用户尚未写入过数据),无法判断快照是否过期
+        return mem_graph.load_graph(username, **db_kwargs)
+
+    graph = _load_from_snapshot(username, *seqs, **db_kwargs)
+    if graph is not None:
+        return graph
+
+    graph, log_seq = _load_from_database(username, **db_kwargs)
+    if log_seq is not None:
+        _save_snapshot(graph, log_seq, **db_kwargs)
+    return graph
+
+
+def _load_from_snapshot(
+    username: str, first_seq: int, current_seq: int, **db_kwargs: Any
+) -> Optional[MemGraph]:
+    """读取快照并重放之后直到 current_seq 的日志,快照不可用时返回 None。"""
+    replayed = _replay_snapshot(username, first_seq, current_seq, **db_kwargs)
+    if replayed is None:
+        return None
+    graph, log_seq, count = replayed
+    if count >= REWRITE_AFTER:
+        _save_snapshot(graph, log_seq, **db_kwargs)
+    return graph
+
+
+def _replay_snapshot(
+    username: str, first_seq: int, current_seq: int, **db_kwargs: Any
+) -> Optional[Tuple[MemGraph, int, int]]:
+    """读取快照并重放之后直到 current_seq 的日志,返回 (图, 日志序号, 重放条数)。
+
+    快照不可用时返回 None。
+    """
+    path = snapshot_path(username, **db_kwargs)
+    if not os.path.exists(path):
+        return None
+    try:
+        graph, log_seq = read_snapshot(path)
+        if graph.username != username or log_seq > current_seq:
+            return None
+        if not graph_log.replayable(log_seq, first_seq):
+            return None
+
+        replayed = 0
+        for log_seq, op, payload in graph_log.read_since(
+            username, log_seq, current_seq, **db_kwargs
+        ):
+            graph_log.apply(graph, op, payload)
+            replayed += 1
+    except Exception:
+        return None
+
+    graph.version = 0
+    return graph, log_seq, replayed
+
+
+def _load_from_database(username: str, **db_kwargs: Any) -> Tuple[MemGraph, Optional[int]]:
+    """全量加载,返回 (图, 日志序号)。加载期间有写操作提交时日志序号为 None。"""
+    seqs_before = graph_log.seq_range(username, **db_kwargs)
+    graph = mem_graph.load_graph(username, **db_kwargs)
+    seqs_after = graph_log.seq_range(username, **db_kwargs)
+    if seqs_before is None or seqs_after is None or seqs_before[1] != seqs_after[1]:
+        return graph, None
+    return graph, seqs_before[1]
+
+
+def _save_snapshot(graph: MemGraph, log_seq: int, **db_kwargs: Any) -> None:
+    """加载过程中顺便写入快照并删除已包含的日志,失败时忽略(快照只是加速手段)。"""
+    try:
+        write_snapshot(graph, log_seq, **db_kwargs)
+        graph_log.prune(graph.username, log_seq, **db_kwargs)
+    except Exception:
+        pass
+
+
+def _aligned(nbytes: int) -> int:
+    return (nbytes + _ALIGN - 1) // _ALIGN * _ALIGN
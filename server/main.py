@@ -11,6 +11,19 @@ if __name__ == "__main__":
         "--port", type=int, default=8000, help="Port to bind (default: 8000)"
     )
     parser.add_argument("--debug", action="store_true", help="Enable debug mode")
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=None,
+        help="Memory budget for cached graphs in MB (default: 8192)",
+    )
+    parser.add_argument(
+        "--warm-users",
+        nargs="+",
+        default=None,
+        metavar="USERNAME",
+        help="Load these users' graphs (from snapshots when available) in the background at startup",
+    )
 
     args = parser.parse_args()
     run(args)
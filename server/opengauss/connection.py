@@ -11,6 +11,7 @@
 
 from __future__ import annotations
 
+import re
 import threading
 from queue import Queue, Empty
 from contextlib import contextmanager
@@ -94,6 +95,16 @@ def _config_hash(config: Dict[str, Any]) -> int:
     return hash(key)
 
 
+def database_key(**db_kwargs: Any) -> str:
+    """返回标识目标数据库的字符串 host_port_dbname(可用作文件名)。
+
+    供按数据库区分的本地文件(如内存图快照)使用,避免连接不同数据库的进程共用文件。
+    """
+    config = _get_db_config(db_kwargs)
+    key = f"{config.get('host', '')}_{config.get('port', '')}_{config.get('dbname', '')}"
+    return re.sub(r"[^A-Za-z0-9._-]", "_", key)
+
+
 def _create_raw_connection(config: Dict[str, Any]) -> psycopg2.extensions.connection:
     """创建真实的数据库连接"""
     return psycopg2.connect(**config)
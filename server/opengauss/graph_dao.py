@@ -3,9 +3,15 @@
 提供通用 SQL 执行接口和数据类定义。
 """
 
-from typing import Any, List, Optional, Tuple
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
 from dataclasses import dataclass
+import itertools
+import threading
 import time
+import uuid
+import weakref
 
 import psycopg2
 
@@ -15,7 +21,7 @@ from server.opengauss.connection import connect
 # ==================== 数据类定义 ====================
 
 
-@dataclass
+@dataclass(slots=True)
 class Vertex:
     """点数据类"""
 
@@ -39,7 +45,7 @@ class Vertex:
         return cls(vid=data[0], v_type=data[1], create_time=data[2], balance=data[3])
 
 
-@dataclass
+@dataclass(slots=True)
 class Edge:
     """边数据类"""
 
@@ -74,6 +80,39 @@ class Edge:
         )
 
 
+class TypeDict:
+    """类型字典: 把点/边类型字符串编码为从 0 开始的小整数。
+
+    批量加载时行数据只保存类型编码,返回结果时再按编码解码。
+    类型只增不减,编码在字典的生命周期内保持不变。
+    """
+
+    __slots__ = ("names", "codes")
+
+    def __init__(self, names: Optional[List[str]] = None) -> None:
+        self.names: List[str] = list(names or [])
+        self.codes: Dict[str, int] = {name: code for code, name in enumerate(self.names)}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def encode(self, name: str) -> int:
+        """返回类型的编码,新类型追加到字典末尾。"""
+        code = self.codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.names.append(name)
+            self.codes[name] = code
+        return code
+
+    def code(self, name: str) -> Optional[int]:
+        """返回已有类型的编码,未出现过的类型返回 None。"""
+        return self.codes.get(name)
+
+    def decode(self, code: int) -> str:
+        return self.names[code]
+
+
 @dataclass
 class User:
     """用户数据类"""
@@ -108,6 +147,80 @@ class User:
 # ==================== 通用 SQL 执行接口 ====================
 
 
+_local = threading.local()
+
+
+@contextmanager
+def statement_deadline(expires_at: Optional[float]) -> Iterator[None]:
+    """在当前线程内为之后执行的 SQL 设置截止时间(time.monotonic() 的时间点)。
+
+    每次调用把距截止时间的剩余毫秒数设为 statement_timeout,超时的语句由数据库
+    取消并抛出异常。超时只在该次调用的事务内生效(SET LOCAL),连接归还连接池后
+    恢复默认值。expires_at 为 None 时不限制。
+    """
+    previous = getattr(_local, "expires_at", None)
+    _local.expires_at = expires_at
+    try:
+        yield
+    finally:
+        _local.expires_at = previous
+
+
+class _PinnedConnection:
+    """固定连接的代理: 提交、回滚和归还都由 pinned_connection 统一处理。"""
+
+    def __init__(self, conn: Any) -> None:
+        self._conn = conn
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+@contextmanager
+def pinned_connection(**db_kwargs: Any) -> Iterator[None]:
+    """在当前线程内固定使用一个连接和一个事务。
+
+    期间的 execute_*/fetch_* 调用都在这个连接上执行,不再逐次从连接池检出连接、
+    也不逐条提交;结束时回滚事务并归还连接,事务内创建的临时表随之删除。
+    适合只读、只在事务内使用临时表的多步查询。已固定连接时直接复用外层的连接。
+    """
+    if getattr(_local, "pinned", None) is not None:
+        yield
+        return
+    conn = connect(**db_kwargs)
+    _local.pinned = _PinnedConnection(conn)
+    try:
+        yield
+    finally:
+        _local.pinned = None
+        conn.close()
+
+
+def _connect(**db_kwargs: Any) -> Any:
+    """获取连接(当前线程固定了连接时使用固定的连接),并应用当前线程的语句截止时间。"""
+    conn = getattr(_local, "pinned", None) or connect(**db_kwargs)
+    expires_at = getattr(_local, "expires_at", None)
+    if expires_at is not None:
+        timeout_ms = max(1, int((expires_at - time.monotonic()) * 1000))
+        try:
+            cur = conn.cursor()
+            cur.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+            cur.close()
+        except Exception:
+            conn.close()
+            raise
+    return conn
+
+
 def execute_ddl(sql: str, **db_kwargs: Any) -> None:
     """执行 DDL 语句（CREATE/DROP/ALTER 等无返回值操作）。
 
@@ -121,7 +234,7 @@ def execute_ddl(sql: str, **db_kwargs: Any) -> None:
     start = time.perf_counter()
     conn = None
     try:
-        conn = connect(**db_kwargs)
+        conn = _connect(**db_kwargs)
         cur = conn.cursor()
         cur.execute(sql)
         end = time.perf_counter()
@@ -154,7 +267,7 @@ def execute_dml(sql: str, params: Optional[Tuple] = None, **db_kwargs: Any) -> i
     start = time.perf_counter()
     conn = None
     try:
-        conn = connect(**db_kwargs)
+        conn = _connect(**db_kwargs)
         cur = conn.cursor()
         cur.execute(sql, params)
         rowcount = cur.rowcount
@@ -186,7 +299,7 @@ def execute_multi(sql_params_list: List[Tuple[str, Optional[Tuple]]], **db_kwarg
     start = time.perf_counter()
     conn = None
     try:
-        conn = connect(**db_kwargs)
+        conn = _connect(**db_kwargs)
         cur = conn.cursor()
         total_rows = 0
         
@@ -225,7 +338,7 @@ def fetch_all(
     start = time.perf_counter()
     conn = None
     try:
-        conn = connect(**db_kwargs)
+        conn = _connect(**db_kwargs)
         cur = conn.cursor()
         cur.execute(sql, params)
         results = cur.fetchall()
@@ -241,6 +354,48 @@ def fetch_all(
             conn.close()
 
 
+def fetch_iter(
+    sql: str,
+    params: Optional[Tuple] = None,
+    batch_size: int = 10000,
+    **db_kwargs: Any,
+) -> Iterator[Tuple]:
+    """执行 SELECT 查询并按批次逐行返回结果,适合全表扫描等大结果集。
+
+    使用服务端游标,客户端内存中最多只保留一个批次的数据。
+
+    Args:
+        sql: 查询 SQL 语句
+        params: 参数化查询的参数元组
+        batch_size: 每批从服务端读取的行数
+        **db_kwargs: 数据库连接参数
+
+    Yields:
+        Tuple: 查询结果行
+    """
+    start = time.perf_counter()
+    conn = None
+    try:
+        conn = _connect(**db_kwargs)
+        cur = conn.cursor(name=f"fetch_iter_{uuid.uuid4().hex}")
+        cur.itersize = batch_size
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+        cur.close()
+        end = time.perf_counter()
+
+        print(f"elapsed: {(end - start)*1000:.2f} ms")
+    except Exception as e:
+        raise Exception(f"查询失败: {sql[:100]}... | 错误: {e}") from e
+    finally:
+        if conn:
+            conn.close()
+
+
 def fetch_one(
     sql: str, params: Optional[Tuple] = None, **db_kwargs: Any
 ) -> Optional[Tuple]:
@@ -257,7 +412,7 @@ def fetch_one(
     start = time.perf_counter()
     conn = None
     try:
-        conn = connect(**db_kwargs)
+        conn = _connect(**db_kwargs)
         cur = conn.cursor()
         cur.execute(sql, params)
         end = time.perf_counter()
@@ -287,7 +442,7 @@ def execute_batch(sql: str, params_list: List[Tuple], **db_kwargs: Any) -> int:
     start = time.perf_counter()
     conn = None
     try:
-        conn = connect(**db_kwargs)
+        conn = _connect(**db_kwargs)
         cur = conn.cursor()
         total_rows = 0
         for params in params_list:
@@ -308,6 +463,123 @@ def execute_batch(sql: str, params_list: List[Tuple], **db_kwargs: Any) -> int:
             conn.close()
 
 
+# 每个连接上最多保留的预备语句数,超过时释放最久未使用的
+MAX_PREPARED = 128
+
+
+class _PreparedStatements:
+    """一个连接上的预备语句: 语句模板 -> 预备语句名(按最近使用排序),以及待释放的语句名。"""
+
+    __slots__ = ("names", "stale", "__weakref__")
+
+    def __init__(self) -> None:
+        self.names: "OrderedDict[str, str]" = OrderedDict()
+        self.stale: List[str] = []
+
+
+# 每个数据库连接上已 PREPARE 的语句。连接对象释放后随之删除
+_prepared: "weakref.WeakKeyDictionary[Any, _PreparedStatements]" = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+_prepared_ids = itertools.count(1)
+
+
+def _prepared_statements(conn: Any) -> _PreparedStatements:
+    """返回连接(连接池中的真实连接)上已 PREPARE 的语句。"""
+    while hasattr(conn, "_conn"):
+        conn = conn._conn
+    with _prepared_lock:
+        registry = _prepared.get(conn)
+        if registry is None:
+            registry = _prepared[conn] = _PreparedStatements()
+        return registry
+
+
+def discard_prepared(marker: str) -> None:
+    """把所有连接上文本包含 marker 的预备语句标记为待释放。
+
+    预备语句只能在创建它的连接上释放: 各连接下一次执行 fetch_prepared 时
+    先 DEALLOCATE 这些语句。scratch_pool 删除租约的工作表时以表名前缀调用。
+    """
+    with _prepared_lock:
+        for registry in list(_prepared.values()):
+            for sql in [sql for sql in registry.names if marker in sql]:
+                registry.stale.append(registry.names.pop(sql))
+
+
+def fetch_prepared(
+    statements: List[Tuple[str, Optional[Tuple]]], **db_kwargs: Any
+) -> List[Tuple]:
+    """在一次往返中依次执行多条语句并提交,返回最后一条语句的结果行。
+
+    params 不为 None 的语句是预备语句模板(参数占位符为 $1..$n): 在当前连接上
+    第一次出现时随本次往返一起 PREPARE,之后同一连接上只发送 EXECUTE,复用已
+    完成的解析和(适用时)执行计划。模板文本相同即视为同一条预备语句,因此模板
+    中不应内联随查询变化的值。params 为 None 的语句(DDL、ANALYZE 等)原样执行。
+    每个连接最多保留 MAX_PREPARED 条预备语句,超出的最久未使用的语句和
+    discard_prepared 标记的语句在该连接下一次调用时随往返一起 DEALLOCATE。
+
+    Args:
+        statements: (sql, params) 列表
+        **db_kwargs: 数据库连接参数
+
+    Returns:
+        List[Tuple]: 最后一条语句的结果行,最后一条语句没有结果时为空列表
+    """
+    start = time.perf_counter()
+    conn = None
+    try:
+        conn = _connect(**db_kwargs)
+        registry = _prepared_statements(conn)
+        with _prepared_lock:
+            stale, registry.stale = registry.stale, []
+            # 失败时不放回: DEALLOCATE 在最前面,多半已经执行,重复释放会让之后每次都失败
+            parts: List[str] = [f"DEALLOCATE {name}" for name in stale]
+            names = dict(registry.names)
+        args: List[Any] = []
+        new_names: Dict[str, str] = {}
+        for sql, params in statements:
+            if params is None:
+                parts.append(sql.replace("%", "%%"))
+                continue
+            name = names.get(sql) or new_names.get(sql)
+            if name is None:
+                name = f"q_{next(_prepared_ids)}"
+                parts.append(f"PREPARE {name} AS {sql.replace('%', '%%')}")
+                new_names[sql] = name
+            placeholders = ", ".join(["%s"] * len(params))
+            parts.append(f"EXECUTE {name}({placeholders})" if params else f"EXECUTE {name}")
+            args.extend(params)
+
+        text = ";\n".join(parts)
+        cur = conn.cursor()
+        if args:
+            cur.execute(text, tuple(args))
+        else:
+            cur.execute(text.replace("%%", "%"))
+        results = cur.fetchall() if cur.description is not None else []
+        end = time.perf_counter()
+        conn.commit()
+        cur.close()
+        # 只有整批成功才记录;失败时已执行的 PREPARE 留在会话中,下次换新名字重新准备
+        with _prepared_lock:
+            for sql, params in statements:
+                if params is not None and sql in registry.names:
+                    registry.names.move_to_end(sql)
+            registry.names.update(new_names)
+            while len(registry.names) > MAX_PREPARED:
+                registry.stale.append(registry.names.popitem(last=False)[1])
+
+        print(f"elapsed: {(end - start)*1000:.2f} ms")
+        return results
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        raise Exception(f"执行预备语句失败: {statements[-1][0][:100]}... | 错误: {e}") from e
+    finally:
+        if conn:
+            conn.close()
+
+
 # 用户个人表
 
 
@@ -369,6 +641,27 @@ def get_user_edge_indexes_ddl(username: str) -> List[str]:
     ]
 
 
+def get_user_log_table_ddl(username: str) -> str:
+    """返回用户专属变更日志表的 CREATE TABLE 语句。
+
+    每次写操作在同一事务中追加一行,内存图快照据此追赶快照之后的变更。
+
+    Args:
+        username: 用户名
+
+    Returns:
+        str: CREATE TABLE DDL
+    """
+    table_name = f"graph_log_{username}"
+    return f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        seq     BIGSERIAL PRIMARY KEY,
+        op      VARCHAR(32) NOT NULL,
+        payload TEXT NOT NULL
+    ) WITH (ORIENTATION = ROW);
+    """
+
+
 def init_user_tables(username: str, **db_kwargs: Any) -> None:
     """为用户创建专属的点表和边表。
 
@@ -390,6 +683,9 @@ def init_user_tables(username: str, **db_kwargs: Any) -> None:
         for idx_sql in get_user_edge_indexes_ddl(username):
             execute_ddl(idx_sql, **db_kwargs)
 
+        # 4. 创建用户变更日志表
+        execute_ddl(get_user_log_table_ddl(username), **db_kwargs)
+
     except Exception as e:
         raise Exception(f"创建用户 {username} 的表失败: {e}") from e
 
@@ -428,6 +724,10 @@ def get_user_table_name(username: str) -> Tuple[str, str]:
     return f"vertex_{username}", f"edge_{username}"
 
 
+def get_user_log_table_name(username: str) -> str:
+    return f"graph_log_{username}"
+
+
 # ==================== 便捷测试函数 ====================
 
 
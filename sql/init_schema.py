@@ -70,6 +70,268 @@ def get_user_indexes_ddl() -> List[str]:
     ]
 
 
+def get_cycle_function_ddl() -> str:
+    """返回服务端双向BFS环路搜索函数 cycle_bibfs 的 CREATE FUNCTION 语句。
+
+    整个扩展/碰撞循环在数据库内执行,一次调用返回全部环路(procbfs 引擎),
+    过滤条件、时序规则、扩展调度和 limit 与 server/core/bibfs.py 一致。
+    点表和边表按参数(REGCLASS)传入,适用于所有用户的表: 表名在调用时解析为
+    已存在的表,拼入动态 SQL 时输出为加引号的标识符,不会被当作 SQL 片段执行。
+    签名由 TEXT 改为 REGCLASS 后 CREATE OR REPLACE 不会替换旧函数,先删除旧签名。
+    每行返回一个环路
+    (cycle_vids 从起点出发并回到起点, cycle_eids 为依次经过的边),没有环路时
+    返回一行 cycle_vids/cycle_eids 为 NULL;其余列为扩展记录,每行相同。
+    timeout_ms 不为 NULL 时在每次扩展之前检查期限,到期后返回已找到的环路并
+    truncated 为 TRUE。
+    """
+    return """
+    DROP FUNCTION IF EXISTS cycle_bibfs(
+        TEXT, TEXT, BIGINT, INT, BOOLEAN, TEXT[], BIGINT, TEXT[], BIGINT, BIGINT, INT, BOOLEAN, BOOLEAN, INT
+    );
+    CREATE OR REPLACE FUNCTION cycle_bibfs(
+        p_vertex_table REGCLASS,
+        p_edge_table   REGCLASS,
+        p_start        BIGINT,
+        p_max_depth    INT,
+        p_temporal     BOOLEAN,
+        p_v_types      TEXT[],
+        p_min_balance  BIGINT,
+        p_e_types      TEXT[],
+        p_min_amount   BIGINT,
+        p_max_amount   BIGINT,
+        p_limit        INT,
+        p_allow_dup_v  BOOLEAN,
+        p_allow_dup_e  BOOLEAN,
+        p_timeout_ms   INT
+    ) RETURNS TABLE (
+        cycle_vids     BIGINT[],
+        cycle_eids     BIGINT[],
+        steps          TEXT[],
+        forward_depth  INT,
+        backward_depth INT,
+        truncated      BOOLEAN
+    ) AS $$
+    DECLARE
+        v_edge_cond   TEXT := '';
+        v_vertex_cond TEXT := '';
+        v_fwd_join    TEXT := '';
+        v_bwd_join    TEXT := '';
+        v_fwd_time    TEXT := '';
+        v_bwd_time    TEXT := '';
+        v_dup_cond    TEXT := '';
+        v_fwd_depth   INT := 0;
+        v_bwd_depth   INT := 0;
+        v_fwd_cost    BIGINT;
+        v_bwd_cost    BIGINT;
+        v_fwd_done    BOOLEAN := FALSE;
+        v_bwd_done    BOOLEAN := FALSE;
+        v_forward     BOOLEAN;
+        v_depth       INT;
+        v_latest      BIGINT;
+        v_rows        BIGINT;
+        v_found       INT := 0;
+        v_steps       TEXT[] := ARRAY[]::TEXT[];
+        v_truncated   BOOLEAN := FALSE;
+        v_deadline    TIMESTAMPTZ;
+    BEGIN
+        IF p_timeout_ms IS NOT NULL THEN
+            v_deadline := clock_timestamp() + p_timeout_ms * INTERVAL '1 millisecond';
+        END IF;
+
+        -- 过滤条件
+        IF p_e_types IS NOT NULL THEN
+            v_edge_cond := v_edge_cond || format(' AND e.e_type = ANY(%L::TEXT[])', p_e_types);
+        END IF;
+        IF p_min_amount IS NOT NULL THEN
+            v_edge_cond := v_edge_cond || format(' AND e.amount >= %s', p_min_amount);
+        END IF;
+        IF p_max_amount IS NOT NULL THEN
+            v_edge_cond := v_edge_cond || format(' AND e.amount <= %s', p_max_amount);
+        END IF;
+        IF p_v_types IS NOT NULL THEN
+            v_vertex_cond := v_vertex_cond || format(' AND v.v_type = ANY(%L::TEXT[])', p_v_types);
+        END IF;
+        IF p_min_balance IS NOT NULL THEN
+            v_vertex_cond := v_vertex_cond || format(' AND v.balance >= %s', p_min_balance);
+        END IF;
+        IF v_vertex_cond <> '' THEN
+            v_fwd_join := format(' JOIN %s v ON v.vid = e.dst_vid', p_vertex_table);
+            v_bwd_join := format(' JOIN %s v ON v.vid = e.src_vid', p_vertex_table);
+        END IF;
+        IF NOT p_allow_dup_v THEN
+            v_dup_cond := v_dup_cond || ' AND NOT (f.path_vids[2:array_length(f.path_vids, 1)]'
+                || ' && b.path_vids[2:array_length(b.path_vids, 1) - 1])';
+        END IF;
+        IF NOT p_allow_dup_e THEN
+            v_dup_cond := v_dup_cond || ' AND NOT (f.path_eids && b.path_eids)';
+        END IF;
+
+        -- 工作表: 事务结束时删除
+        EXECUTE 'CREATE TEMP TABLE cycle_fwd (vid BIGINT NOT NULL, occur_time BIGINT NOT NULL,'
+            || ' depth INT NOT NULL, path_vids BIGINT[], path_eids BIGINT[]) ON COMMIT DROP';
+        EXECUTE 'CREATE INDEX idx_cycle_fwd_vid ON cycle_fwd(vid)';
+        EXECUTE 'CREATE TEMP TABLE cycle_bwd (vid BIGINT NOT NULL, occur_time BIGINT NOT NULL,'
+            || ' depth INT NOT NULL, path_vids BIGINT[], path_eids BIGINT[]) ON COMMIT DROP';
+        EXECUTE 'CREATE INDEX idx_cycle_bwd_vid ON cycle_bwd(vid)';
+        EXECUTE 'CREATE TEMP TABLE cycle_dist (vid BIGINT NOT NULL, dist INT NOT NULL) ON COMMIT DROP';
+        EXECUTE 'CREATE INDEX idx_cycle_dist_vid ON cycle_dist(vid)';
+        EXECUTE 'CREATE TEMP TABLE cycle_found (found_no INT NOT NULL, vids BIGINT[] NOT NULL,'
+            || ' eids BIGINT[] NOT NULL) ON COMMIT DROP';
+
+        -- 预处理: 每个点回到起点的最少边数
+        EXECUTE format('INSERT INTO cycle_dist (vid, dist) VALUES (%s, 0)', p_start);
+        FOR i IN 0 .. p_max_depth - 2 LOOP
+            EXECUTE format(
+                'INSERT INTO cycle_dist (vid, dist)'
+                || ' SELECT DISTINCT e.src_vid, %s FROM cycle_dist r'
+                || ' JOIN %s e ON e.dst_vid = r.vid%s'
+                || ' WHERE r.dist = %s%s%s'
+                || ' AND NOT EXISTS (SELECT 1 FROM cycle_dist x WHERE x.vid = e.src_vid)',
+                i + 1, p_edge_table, v_bwd_join, i, v_edge_cond, v_vertex_cond
+            );
+            GET DIAGNOSTICS v_rows = ROW_COUNT;
+            EXIT WHEN v_rows = 0;
+        END LOOP;
+
+        -- 初始化起点(occur_time设为0表示起点)
+        EXECUTE format(
+            'INSERT INTO cycle_fwd VALUES (%s, 0, 0, ARRAY[%s]::BIGINT[], ARRAY[]::BIGINT[])',
+            p_start, p_start
+        );
+        EXECUTE format(
+            'INSERT INTO cycle_bwd VALUES (%s, 0, 0, ARRAY[%s]::BIGINT[], ARRAY[]::BIGINT[])',
+            p_start, p_start
+        );
+
+        -- 时序环的最后一条边必须晚于之前所有边: 起点最晚的入边时间是所有边的上界
+        IF p_temporal THEN
+            EXECUTE format('SELECT MAX(occur_time) FROM %s WHERE dst_vid = %s', p_edge_table, p_start)
+                INTO v_latest;
+            IF v_latest IS NULL THEN
+                v_fwd_done := TRUE;
+            END IF;
+            v_fwd_time := format(
+                ' AND e.occur_time > t.occur_time AND e.occur_time < %s'
+                || ' AND EXISTS (SELECT 1 FROM %s n WHERE n.src_vid = e.dst_vid AND n.occur_time > e.occur_time)',
+                v_latest, p_edge_table
+            );
+            v_bwd_time := ' AND (e.occur_time < t.occur_time OR t.occur_time = 0)';
+        END IF;
+
+        EXECUTE format(
+            'SELECT COUNT(*) FROM cycle_fwd t JOIN %s e ON e.src_vid = t.vid WHERE t.depth = 0',
+            p_edge_table
+        ) INTO v_fwd_cost;
+        EXECUTE format(
+            'SELECT COUNT(*) FROM cycle_bwd t JOIN %s e ON e.dst_vid = t.vid WHERE t.depth = 0',
+            p_edge_table
+        ) INTO v_bwd_cost;
+
+        WHILE v_found < p_limit LOOP
+            -- 选择扩展的一侧,规则同 FrontierSchedule.next_side
+            EXIT WHEN v_fwd_depth + v_bwd_depth >= p_max_depth;
+            EXIT WHEN (v_fwd_done AND v_fwd_depth = 0) OR (v_bwd_done AND v_bwd_depth = 0);
+            EXIT WHEN v_fwd_done AND v_bwd_done;
+            IF v_fwd_done THEN
+                v_forward := FALSE;
+            ELSIF v_bwd_done THEN
+                v_forward := TRUE;
+            ELSE
+                v_forward := v_fwd_cost < v_bwd_cost
+                    OR (v_fwd_cost = v_bwd_cost AND v_fwd_depth <= v_bwd_depth);
+            END IF;
+            IF v_deadline IS NOT NULL AND clock_timestamp() >= v_deadline THEN
+                v_truncated := TRUE;
+                EXIT;
+            END IF;
+
+            IF v_forward THEN
+                -- 正向扩展
+                EXECUTE format(
+                    'INSERT INTO cycle_fwd (vid, occur_time, depth, path_vids, path_eids)'
+                    || ' SELECT e.dst_vid, e.occur_time, t.depth + 1,'
+                    || ' t.path_vids || e.dst_vid, t.path_eids || e.eid'
+                    || ' FROM cycle_fwd t'
+                    || ' JOIN %s e ON e.src_vid = t.vid'
+                    || ' JOIN cycle_dist r ON r.vid = e.dst_vid%s'
+                    || ' WHERE t.depth = %s AND r.dist <= %s%s%s%s'
+                    || ' AND NOT (e.dst_vid = ANY(t.path_vids))',
+                    p_edge_table, v_fwd_join, v_fwd_depth, p_max_depth - v_fwd_depth - 1,
+                    v_fwd_time, v_edge_cond, v_vertex_cond
+                );
+                GET DIAGNOSTICS v_rows = ROW_COUNT;
+                IF v_rows = 0 THEN
+                    v_fwd_done := TRUE;
+                    CONTINUE;
+                END IF;
+                v_fwd_depth := v_fwd_depth + 1;
+                v_depth := v_fwd_depth;
+                v_steps := v_steps || 'fwd'::TEXT;
+                EXECUTE format(
+                    'SELECT COUNT(*) FROM cycle_fwd t JOIN %s e ON e.src_vid = t.vid WHERE t.depth = %s',
+                    p_edge_table, v_fwd_depth
+                ) INTO v_fwd_cost;
+            ELSE
+                -- 反向扩展
+                EXECUTE format(
+                    'INSERT INTO cycle_bwd (vid, occur_time, depth, path_vids, path_eids)'
+                    || ' SELECT e.src_vid, e.occur_time, t.depth + 1,'
+                    || ' t.path_vids || e.src_vid, t.path_eids || e.eid'
+                    || ' FROM cycle_bwd t'
+                    || ' JOIN %s e ON e.dst_vid = t.vid%s'
+                    || ' WHERE t.depth = %s%s%s%s'
+                    || ' AND NOT (e.src_vid = ANY(t.path_vids))',
+                    p_edge_table, v_bwd_join, v_bwd_depth, v_bwd_time, v_edge_cond, v_vertex_cond
+                );
+                GET DIAGNOSTICS v_rows = ROW_COUNT;
+                IF v_rows = 0 THEN
+                    v_bwd_done := TRUE;
+                    CONTINUE;
+                END IF;
+                v_bwd_depth := v_bwd_depth + 1;
+                v_depth := v_bwd_depth;
+                v_steps := v_steps || 'bwd'::TEXT;
+                EXECUTE format(
+                    'SELECT COUNT(*) FROM cycle_bwd t JOIN %s e ON e.dst_vid = t.vid WHERE t.depth = %s',
+                    p_edge_table, v_bwd_depth
+                ) INTO v_bwd_cost;
+            END IF;
+
+            -- 检查碰撞: 只用新扩展出的一层与另一方向的表做连接,
+            -- 正向路径接上反转后的反向路径即为环路,按边序列去重
+            EXECUTE format(
+                'INSERT INTO cycle_found (found_no, vids, eids)'
+                || ' SELECT %s + row_number() OVER (ORDER BY c.eids), c.vids, c.eids FROM ('
+                || '   SELECT DISTINCT'
+                || '     f.path_vids || ARRAY(SELECT b.path_vids[i]'
+                || '       FROM generate_series(array_length(b.path_vids, 1) - 1, 1, -1) i) AS vids,'
+                || '     f.path_eids || ARRAY(SELECT b.path_eids[i]'
+                || '       FROM generate_series(array_length(b.path_eids, 1), 1, -1) i) AS eids'
+                || '   FROM cycle_fwd f JOIN cycle_bwd b ON f.vid = b.vid'
+                || '   WHERE %s.depth = %s AND f.vid <> %s%s'
+                || ' ) c'
+                || ' WHERE NOT EXISTS (SELECT 1 FROM cycle_found x WHERE x.eids = c.eids)'
+                || ' ORDER BY c.eids LIMIT %s',
+                v_found, CASE WHEN v_forward THEN 'f' ELSE 'b' END, v_depth, p_start,
+                v_dup_cond, p_limit - v_found
+            );
+            GET DIAGNOSTICS v_rows = ROW_COUNT;
+            v_found := v_found + v_rows;
+        END LOOP;
+
+        IF v_found = 0 THEN
+            RETURN QUERY SELECT NULL::BIGINT[], NULL::BIGINT[], v_steps, v_fwd_depth, v_bwd_depth, v_truncated;
+        ELSE
+            RETURN QUERY EXECUTE
+                'SELECT vids, eids, $1, $2, $3, $4 FROM cycle_found ORDER BY found_no'
+                USING v_steps, v_fwd_depth, v_bwd_depth, v_truncated;
+        END IF;
+        DROP TABLE cycle_fwd, cycle_bwd, cycle_dist, cycle_found;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+
+
 def get_drop_tables_ddl() -> List[str]:
     """返回删除所有表的 DDL 列表。"""
     return [
@@ -81,7 +343,7 @@ def get_drop_tables_ddl() -> List[str]:
 
 
 def init_schema(**db_kwargs: Any) -> None:
-    """初始化数据库 Schema：创建点边表、用户表及核心索引。
+    """初始化数据库 Schema：创建点边表、用户表、核心索引及服务端环路搜索函数。
 
     Args:
         **db_kwargs: 数据库连接参数（可选），会覆盖默认配置
@@ -94,6 +356,10 @@ def init_schema(**db_kwargs: Any) -> None:
         execute_ddl(get_user_table_ddl(), **db_kwargs)
         print("✓ Users 表创建成功")
 
+        # 2. 创建服务端环路搜索函数(procbfs 引擎)
+        execute_ddl(get_cycle_function_ddl(), **db_kwargs)
+        print("✓ 环路搜索函数 cycle_bibfs 创建成功")
+
         print("✓ Schema 初始化完成")
 
     except Exception as e:
@@ -633,6 +633,74 @@ def test_cycle_operations():
     assert "execution_time_ms" in result["meta"], "meta 应包含执行时间"
     print(f"执行时间: {result['meta']['execution_time_ms']} ms")
 
+    # 测试 15: 批量查询
+    print("\n[6.15] 批量查询多个起点")
+    result = run_command(
+        [
+            "query",
+            "cycles-batch",
+            "--starts",
+            str(v1),
+            str(v2),
+            str(v3),
+            "--depth",
+            "10",
+            "--workers",
+            "2",
+        ]
+    )
+    assert result.get("status") == "success", "批量查询失败"
+    assert result.get("count") == 3, "应返回每个起点的结果"
+    assert {r["start_vid"] for r in result["data"]} == {v1, v2, v3}, "起点不匹配"
+    print(f"{result.get('found_count', 0)} 个起点找到环路")
+
+    print("\n[6.16] 查询起点所在的强连通分量")
+    result = run_command(["query", "scc", "--vid", str(v1)])
+    assert result.get("status") == "success", "查询强连通分量失败"
+    assert result["data"]["on_cycle"], "环上的点应属于非平凡分量"
+    assert {v1, v2, v3} <= set(result["data"]["members"]), "分量应包含环上所有点"
+    print(f"分量大小: {result['data']['size']}")
+
+    print("\n[6.17] 带时间预算的环路查询")
+    result = run_command(
+        ["query", "cycle", "--start", str(v1), "--depth", "10", "--timeout-ms", "5000"]
+    )
+    assert result.get("status") == "success", "带时间预算的查询失败"
+    assert "truncated" in result["meta"], "meta 应包含 truncated"
+    print(f"truncated: {result['meta']['truncated']}")
+
+    print("\n[6.18] 按总金额排序的环路查询")
+    result = run_command(
+        [
+            "query",
+            "cycle",
+            "--start",
+            str(v1),
+            "--depth",
+            "10",
+            "--order-by",
+            "total_amount",
+            "--limit",
+            "5",
+        ]
+    )
+    assert result.get("status") == "success", "排序查询失败"
+    if result.get("found"):
+        scores = [c["score"] for c in result["data"]]
+        assert scores == sorted(scores, reverse=True), "环路应按总金额从大到小排列"
+        print(f"总金额: {scores}")
+
+    print("\n[6.19] 数据库函数执行的环路查询 (需先运行 sql/init_schema.py)")
+    counts = {}
+    for engine in ("bibfs", "procbfs"):
+        result = run_command(
+            ["query", "cycle", "--start", str(v1), "--depth", "10", "--engine", engine]
+        )
+        assert result.get("status") == "success", f"{engine} 查询失败"
+        counts[engine] = result.get("count", 0)
+    assert counts["procbfs"] == counts["bibfs"], "procbfs 与 bibfs 找到的环路数应一致"
+    print(f"环路数: {counts}")
+
     print("\n✓ 环路查询测试通过")
 
 
@@ -0,0 +1,761 @@
+#!/usr/bin/env python3
+"""内存图与内存引擎的单元测试,不需要数据库。
+
+测试图直接在内存中随机生成并放入 graph_cache,结果与朴素实现(暴力枚举、
+纯 Python 扩展、用同样的点和边重新构建的图)逐项比较。
+"""
+import random
+import sys
+import os
+import tempfile
+import threading
+import time
+from itertools import islice
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from server.core import (
+    cycle_scan,
+    cycle_enum,
+    cycle_topk,
+    filter_view,
+    frontier_kernel,
+    graph_cache,
+    graph_service,
+    mem_graph,
+    membibfs,
+    scc,
+    snapshot,
+)
+from server.core.mem_graph import MemGraph
+from server.opengauss.graph_dao import Edge, Vertex
+
+
+def random_graph(username: str, n: int, m: int, seed: int) -> MemGraph:
+    """生成 n 个点、约 m 条边的随机图,点 vid 为 1..n,边 eid 为 1..m。"""
+    rnd = random.Random(seed)
+    graph = MemGraph(username)
+    for vid in range(1, n + 1):
+        graph._append_vertex(vid, rnd.choice("ab"), 1, rnd.randint(0, 100))
+    for eid in range(1, m + 1):
+        src, dst = rnd.randrange(n), rnd.randrange(n)
+        if src == dst:
+            continue
+        graph._append_edge(
+            eid, src, dst, rnd.randint(1, 100), rnd.randint(1, 1000), rnd.choice("xy")
+        )
+    graph.build_csr()
+    return graph
+
+
+def install(graph: MemGraph) -> None:
+    """把图放入进程级缓存,替换该用户已缓存的图。"""
+    graph_cache.invalidate(graph.username)
+    graph_cache._cache.get(graph.username, loader=lambda username: graph)
+
+
+def rebuild(graph: MemGraph, username: str) -> MemGraph:
+    """用图中存活的点和边重新构建一个全部位于 CSR 中的图。"""
+    fresh = MemGraph(username)
+    for vid in sorted(graph.index):
+        vertex = graph.get_vertex(vid)
+        fresh._append_vertex(vid, vertex.v_type, vertex.create_time, vertex.balance)
+    for ei in sorted(range(len(graph.eids)), key=graph.eids.__getitem__):
+        if graph.e_alive[ei]:
+            edge = graph.edge(ei)
+            fresh._append_edge(
+                edge.eid,
+                fresh.index[edge.src_vid],
+                fresh.index[edge.dst_vid],
+                edge.amount,
+                edge.occur_time,
+                edge.e_type,
+            )
+    fresh.build_csr()
+    return fresh
+
+
+def graph_state(graph: MemGraph) -> tuple:
+    """按 vid/eid 描述图的内容,与边下标和 CSR/增量部分的划分无关。
+
+    同时检查按时间截取的邻接(after/before)和时间包络与完整邻接一致。
+    """
+    time_col = graph.occur_time
+    vertices = {}
+    for vid, vi in graph.index.items():
+        out_edges = graph.out_edge_indices(vi)
+        in_edges = graph.in_edge_indices(vi)
+        for t in (0, 250, 500, 750):
+            assert set(graph.out_edge_indices(vi, after=t)) == {
+                ei for ei in out_edges if time_col[ei] > t
+            }, f"点 {vid} 的出边按时间截取不正确"
+            assert set(graph.in_edge_indices(vi, before=t)) == {
+                ei for ei in in_edges if time_col[ei] < t
+            }, f"点 {vid} 的入边按时间截取不正确"
+        out_times = [time_col[ei] for ei in out_edges]
+        in_times = [time_col[ei] for ei in in_edges]
+        envelope = (
+            (graph.out_time_min[vi], graph.out_time_max[vi]),
+            (graph.in_time_min[vi], graph.in_time_max[vi]),
+        )
+        assert envelope == (
+            (min(out_times, default=mem_graph.TIME_MAX), max(out_times, default=mem_graph.TIME_MIN)),
+            (min(in_times, default=mem_graph.TIME_MAX), max(in_times, default=mem_graph.TIME_MIN)),
+        ), f"点 {vid} 的时间包络与邻接不一致"
+        vertices[vid] = (
+            graph.get_vertex(vid),
+            sorted(graph.eids[ei] for ei in out_edges),
+            sorted(graph.eids[ei] for ei in in_edges),
+        )
+    edges = {
+        graph.eids[ei]: graph.edge(ei)
+        for ei in range(len(graph.eids))
+        if graph.e_alive[ei]
+    }
+    return vertices, edges
+
+
+def brute_cycles(
+    graph: MemGraph,
+    start_vid: int,
+    max_depth: int,
+    temporal: bool,
+    edge_ok=None,
+    allow_duplicate_vertices: bool = False,
+) -> set:
+    """朴素 DFS 枚举经过起点、长度不超过 max_depth 的环,返回 eid 元组的集合。
+
+    不做任何剪枝,边不重复;temporal 时要求边的时间严格递增。
+    """
+    out = {}
+    for ei in range(len(graph.eids)):
+        if graph.e_alive[ei]:
+            edge = graph.edge(ei)
+            if edge_ok is None or edge_ok(edge):
+                out.setdefault(edge.src_vid, []).append(edge)
+    found = set()
+
+    def dfs(vid, arrival, path, seen):
+        if len(path) >= max_depth:
+            return
+        for edge in out.get(vid, []):
+            if temporal and edge.occur_time <= arrival:
+                continue
+            if any(e.eid == edge.eid for e in path):
+                continue
+            if edge.dst_vid == start_vid:
+                found.add(tuple(e.eid for e in path) + (edge.eid,))
+                continue
+            if edge.dst_vid in seen and not allow_duplicate_vertices:
+                continue
+            dfs(edge.dst_vid, edge.occur_time, path + [edge], seen | {edge.dst_vid})
+
+    dfs(start_vid, 0, [], {start_vid})
+    return found
+
+
+def cycle_eids(result: dict) -> list:
+    assert result.get("status") == "success", result
+    return [[e["eid"] for e in cycle["edges"]] for cycle in result.get("data", [])]
+
+
+def _query_all(username: str, starts: range, threshold: int) -> list:
+    """以给定的向量化阈值对每个起点查询环路。"""
+    saved = frontier_kernel.VECTOR_MIN_EDGES
+    frontier_kernel.VECTOR_MIN_EDGES = threshold
+    try:
+        out = []
+        for start_vid in starts:
+            for direction in ("forward", "any"):
+                for filters in ({}, {"edge_filter_min_amount": 30}, {"vertex_filter_v_types": ["a"]}):
+                    result = membibfs.query_cycles(
+                        start_vid, 5, username, direction, limit=200, **filters
+                    )
+                    out.append(cycle_eids(result))
+        return out
+    finally:
+        frontier_kernel.VECTOR_MIN_EDGES = saved
+
+
+def test_frontier_kernel():
+    """向量化扩展与纯 Python 扩展的结果(含顺序)一致,前沿大小在阈值上下都覆盖。"""
+    if not frontier_kernel.available():
+        print("\n- 未安装 NumPy,跳过向量化扩展测试")
+        return
+    graph = random_graph("mem_kernel", 150, 3000, seed=14)
+    install(graph)
+    # 增量边和已删除的边走增量邻接表和存活掩码
+    rnd = random.Random(15)
+    for i in range(200):
+        graph.insert_edge(
+            Edge(10000 + i, rnd.randint(1, 150), rnd.randint(1, 150), rnd.randint(1, 100), rnd.randint(1, 1000), "x")
+        )
+    for eid in rnd.sample(range(1, 3000), 100):
+        if graph.edge_index(eid) is not None:
+            graph.delete_edge(eid)
+
+    starts = range(1, 40)
+    python = _query_all("mem_kernel", starts, threshold=1 << 62)
+    vector = _query_all("mem_kernel", starts, threshold=0)
+    mixed = _query_all("mem_kernel", starts, threshold=frontier_kernel.VECTOR_MIN_EDGES)
+    assert sum(map(len, python)) > 0, "测试图中没有环"
+    assert vector == python, "向量化扩展结果与纯 Python 不一致"
+    assert mixed == python, "默认阈值下结果与纯 Python 不一致"
+    print("\n✓ 向量化扩展测试通过")
+
+
+def test_frontier_kernel_concurrent_patch():
+    """向量化扩展期间并发修补: 固定的图不被原地扩容,缓存不因 BufferError 被丢弃。"""
+    if not frontier_kernel.available():
+        print("\n- 未安装 NumPy,跳过并发修补测试")
+        return
+    install(random_graph("mem_patch", 150, 3000, seed=16))
+    errors = []
+    stop = threading.Event()
+
+    def query():
+        try:
+            while not stop.is_set():
+                for start_vid in range(1, 20):
+                    cycle_eids(membibfs.query_cycles(start_vid, 5, "mem_patch", "any", limit=50))
+        except Exception as e:
+            errors.append(e)
+
+    saved = frontier_kernel.VECTOR_MIN_EDGES
+    frontier_kernel.VECTOR_MIN_EDGES = 0
+    readers = [threading.Thread(target=query) for _ in range(2)]
+    try:
+        for reader in readers:
+            reader.start()
+        rnd = random.Random(17)
+        deadline = time.time() + 2
+        eid = 20000
+        while time.time() < deadline:
+            eid += 1
+            edge = Edge(eid, rnd.randint(1, 150), rnd.randint(1, 150), 50, rnd.randint(1, 1000), "x")
+            graph_cache.patch("mem_patch", lambda graph: graph.insert_edge(edge))
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+        frontier_kernel.VECTOR_MIN_EDGES = saved
+
+    assert not errors, f"并发查询失败: {errors[0]!r}"
+    graph = graph_cache.peek_graph("mem_patch")
+    assert graph is not None, "修补失败,缓存被丢弃"
+    assert graph.edge_index(eid) is not None, "修补没有生效"
+    print("\n✓ 并发修补测试通过")
+
+
+def _random_patch(rnd: random.Random, graph: MemGraph, next_id: int):
+    """随机生成一个修补操作(与 graph_service 的写操作对应)。"""
+    vids = sorted(graph.index)
+    eids = [graph.eids[ei] for ei in range(len(graph.eids)) if graph.e_alive[ei]]
+    op = rnd.random()
+    if op < 0.05:
+        vertex = Vertex(next_id, rnd.choice("ab"), 1, rnd.randint(0, 100))
+        return lambda g: g.insert_vertex(vertex)
+    if op < 0.1 and len(vids) > 10:
+        vid = rnd.choice(vids)
+        return lambda g: g.delete_vertex(vid)
+    if op < 0.15:
+        vid, v_type, balance = rnd.choice(vids), rnd.choice("ab"), rnd.randint(0, 100)
+        return lambda g: g.update_vertex(vid, v_type, balance)
+    if op < 0.5:
+        edge = Edge(next_id, rnd.choice(vids), rnd.choice(vids), rnd.randint(1, 100), rnd.randint(1, 1000), rnd.choice("xy"))
+        return lambda g: g.insert_edge(edge)
+    if op < 0.75 and eids:
+        eid, amount, occur_time = rnd.choice(eids), rnd.randint(1, 100), rnd.randint(1, 1000)
+        return lambda g: g.update_edge(eid, amount, occur_time, rnd.choice([None, "x", "y"]))
+    eid = rnd.choice(eids)
+    return lambda g: g.delete_edge(eid)
+
+
+def _apply_patches(username: str, rnd: random.Random, count: int, next_id: int) -> int:
+    """通过 graph_cache 应用 count 个随机修补,返回下一个可用的 id。"""
+    for _ in range(count):
+        graph_cache.patch(username, _random_patch(rnd, graph_cache.peek_graph(username), next_id))
+        assert graph_cache.peek_graph(username) is not None, "修补失败,缓存被丢弃"
+        next_id += 1
+    return next_id
+
+
+def _all_cycles(username: str, starts) -> list:
+    """完整枚举每个起点的环,结果与边的存放顺序无关。"""
+    out = []
+    for start_vid in starts:
+        for direction in ("forward", "any"):
+            result = cycle_enum.query_cycles(start_vid, 4, username, direction, limit=1 << 30)
+            out.append(sorted(cycle_eids(result)))
+    return out
+
+
+def test_overlay_patch():
+    """增量修补(不压缩)后的图与用同样的点和边重新构建的图一致,查询结果相同。"""
+    saved = mem_graph.COMPACT_MIN_EDGES
+    mem_graph.COMPACT_MIN_EDGES = 1 << 62
+    try:
+        graph = random_graph("mem_overlay", 40, 300, seed=1)
+        install(graph)
+        rnd = random.Random(2)
+        next_id = 100000
+        for _ in range(6):
+            next_id = _apply_patches("mem_overlay", rnd, 50, next_id)
+            patched = graph_cache.peek_graph("mem_overlay")
+            assert patched is graph, "未被固定的图应原地修补"
+            fresh = rebuild(patched, "mem_overlay_fresh")
+            assert graph_state(patched) == graph_state(fresh), "增量修补后的图与重建的图不一致"
+        assert graph.base_edges < len(graph.eids), "没有用到增量邻接"
+
+        install(fresh)
+        starts = sorted(graph.index)[:15]
+        expected = _all_cycles("mem_overlay_fresh", starts)
+        assert sum(map(len, expected)) > 0, "测试图中没有环"
+        assert _all_cycles("mem_overlay", starts) == expected, "增量修补后的查询结果与重建的图不一致"
+    finally:
+        mem_graph.COMPACT_MIN_EDGES = saved
+    print("\n✓ 增量修补测试通过")
+
+
+def test_patch_pinned_copy():
+    """被固定的图不被修补: 修补作用在副本上并替换缓存,解除固定后恢复原地修补。"""
+    graph = random_graph("mem_cow", 40, 300, seed=3)
+    install(graph)
+    rnd = random.Random(4)
+    with graph_cache.pinned_graph("mem_cow", load=False) as pinned:
+        assert pinned is graph
+        before = graph_state(pinned)
+        next_id = _apply_patches("mem_cow", rnd, 100, 100000)
+        assert graph_state(pinned) == before, "被固定的图被修改"
+        assert graph_cache.get_graph("mem_cow") is pinned, "固定期间本线程应使用固定的图"
+        current = graph_cache.peek_graph("mem_cow")
+        assert current is not pinned, "修补没有替换缓存中的图"
+        assert graph_state(current) == graph_state(rebuild(current, "mem_cow")), "副本的修补结果不正确"
+    assert id(pinned) not in graph_cache._cache._pins, "解除固定后仍有固定计数"
+
+    _apply_patches("mem_cow", rnd, 20, next_id)
+    assert graph_cache.peek_graph("mem_cow") is current, "未被固定的图应原地修补"
+    print("\n✓ 固定图修补测试通过")
+
+
+def _check_view(graph: MemGraph) -> None:
+    """过滤视图与逐条判断过滤条件的结果一致。"""
+    view = filter_view.get_view(graph, ["a"], None, None, 30, None)
+    edge_ok = view.edge_ok
+    for ei in range(len(graph.eids)):
+        if not graph.e_alive[ei]:
+            continue
+        edge = graph.edge(ei)
+        expected = (
+            edge.amount >= 30
+            and graph.get_vertex(edge.src_vid).v_type == "a"
+            and graph.get_vertex(edge.dst_vid).v_type == "a"
+        )
+        assert edge_ok(ei) == expected, f"边 {edge.eid} 的过滤视图不正确"
+
+
+_VIEW_FILTERS = [
+    (["a"], None, None, 30, None),
+    (None, 50, None, None, None),
+    (["b"], 20, ["y"], None, 80),
+    (["c"], None, None, None, None),
+]
+
+
+def test_view_incremental():
+    """修补后缓存的过滤视图同步修补,与重新计算的位图一致(包括修补副本和新出现的类型)。"""
+    saved = mem_graph.COMPACT_MIN_EDGES
+    mem_graph.COMPACT_MIN_EDGES = 1 << 30
+    try:
+        graph = random_graph("mem_view", 40, 200, seed=19)
+        install(graph)
+        rnd = random.Random(20)
+        next_id = 100000
+        for filters in _VIEW_FILTERS:
+            filter_view.get_view(graph, *filters)
+
+        for round_ in range(8):
+            if round_ % 2:
+                # 固定期间的修补发生在副本上,副本带着视图的拷贝
+                with graph_cache.pinned_graph("mem_view", load=False):
+                    next_id = _apply_patches("mem_view", rnd, 30, next_id)
+            else:
+                next_id = _apply_patches("mem_view", rnd, 30, next_id)
+            if round_ == 3:
+                vertex = Vertex(next_id, "c", 1, 0)
+                graph_cache.patch("mem_view", lambda g: g.insert_vertex(vertex))
+                next_id += 1
+
+            current = graph_cache.peek_graph("mem_view")
+            assert len(current.filter_views) == len(_VIEW_FILTERS), "修补后视图被丢弃"
+            for filters in _VIEW_FILTERS:
+                key = filter_view.filter_key(*filters)
+                view = current.filter_views[key]
+                assert view.version == current.version
+                assert filter_view.get_view(current, *filters) is view, "视图被重新计算"
+                fresh = filter_view._build_view(current, key)
+                assert view.vertex_mask == fresh.vertex_mask, f"点位图不一致: {filters}"
+                live = [ei for ei in range(len(current.eids)) if current.e_alive[ei]]
+                assert [view.edge_mask[ei] for ei in live] == [fresh.edge_mask[ei] for ei in live], (
+                    f"边位图不一致: {filters}"
+                )
+        assert any(current.filter_views[filter_view.filter_key(*_VIEW_FILTERS[3])].vertex_mask)
+    finally:
+        mem_graph.COMPACT_MIN_EDGES = saved
+    print("\n✓ 过滤视图增量修补测试通过")
+
+
+def test_compaction():
+    """压缩(重建 CSR、重新编号边下标)后的图与重建的图一致,固定的图和它的视图不受影响。"""
+    saved = mem_graph.COMPACT_MIN_EDGES
+    mem_graph.COMPACT_MIN_EDGES = 10
+    try:
+        graph = random_graph("mem_compact", 40, 300, seed=5)
+        install(graph)
+        rnd = random.Random(6)
+        next_id = 100000
+
+        with graph_cache.pinned_graph("mem_compact", load=False) as pinned:
+            _check_view(pinned)
+            view = filter_view.get_view(pinned, ["a"], None, None, 30, None)
+            before = (graph_state(pinned), pinned.eids[:])
+            next_id = _apply_patches("mem_compact", rnd, 150, next_id)
+            assert (graph_state(pinned), pinned.eids[:]) == before, "被固定的图被压缩"
+            assert filter_view.get_view(pinned, ["a"], None, None, 30, None) is view, "被固定的图的视图被丢弃"
+
+        current = graph_cache.peek_graph("mem_compact")
+        compactions = 0
+        for _ in range(6):
+            _check_view(current)
+            base_edges = current.base_edges
+            next_id = _apply_patches("mem_compact", rnd, 50, next_id)
+            assert graph_cache.peek_graph("mem_compact") is current, "未被固定的图应原地修补"
+            compactions += current.base_edges != base_edges
+            fresh = rebuild(current, "mem_compact_fresh")
+            assert graph_state(current) == graph_state(fresh), "压缩后的图与重建的图不一致"
+            _check_view(current)
+        assert compactions > 0, "没有触发压缩"
+
+        install(fresh)
+        starts = sorted(current.index)[:15]
+        expected = _all_cycles("mem_compact_fresh", starts)
+        assert sum(map(len, expected)) > 0, "测试图中没有环"
+        assert _all_cycles("mem_compact", starts) == expected, "压缩后的查询结果与重建的图不一致"
+    finally:
+        mem_graph.COMPACT_MIN_EDGES = saved
+    print("\n✓ 压缩测试通过")
+
+
+def _filter_cases(graph: MemGraph) -> list:
+    """查询过滤参数与对应的逐条判断函数。"""
+    def v_type(vid):
+        return graph.get_vertex(vid).v_type
+
+    return [
+        ({}, None),
+        ({"edge_filter_min_amount": 30}, lambda e: e.amount >= 30),
+        ({"edge_filter_e_types": ["x"]}, lambda e: e.e_type == "x"),
+        ({"vertex_filter_v_types": ["a"]}, lambda e: v_type(e.src_vid) == "a" and v_type(e.dst_vid) == "a"),
+    ]
+
+
+def test_cycle_enum():
+    """完整枚举与朴素 DFS 的环集合一致。
+
+    双向BFS在汇合点不检查时间顺序和重复点(与数据库引擎相同),只检查它返回的
+    都是经过起点、边不重复、满足过滤条件的闭合路径。
+    """
+    graph = random_graph("mem_enum", 25, 150, seed=8)
+    install(graph)
+    total = 0
+    for start_vid in range(1, 26):
+        for direction in ("forward", "any"):
+            temporal = direction == "forward"
+            for filters, edge_ok in _filter_cases(graph):
+                expected = brute_cycles(graph, start_vid, 5, temporal, edge_ok)
+                result = cycle_enum.query_cycles(start_vid, 5, "mem_enum", direction, limit=1 << 30, **filters)
+                got = [tuple(eids) for eids in cycle_eids(result)]
+                assert len(got) == len(set(got)) and set(got) == expected, (
+                    f"完整枚举结果与朴素 DFS 不一致: start={start_vid} {direction} {filters}"
+                )
+                walks = brute_cycles(graph, start_vid, 5, False, edge_ok, allow_duplicate_vertices=True)
+                result = membibfs.query_cycles(start_vid, 5, "mem_enum", direction, limit=1 << 30, **filters)
+                assert {tuple(eids) for eids in cycle_eids(result)} <= walks, (
+                    f"双向BFS返回了不合法的环: start={start_vid} {direction} {filters}"
+                )
+                total += len(expected)
+
+            expected = brute_cycles(graph, start_vid, 4, temporal, allow_duplicate_vertices=True)
+            result = cycle_enum.query_cycles(
+                start_vid, 4, "mem_enum", direction, limit=1 << 30, allow_duplicate_vertices=True
+            )
+            assert {tuple(eids) for eids in cycle_eids(result)} == expected, (
+                f"允许重复点时完整枚举结果与朴素 DFS 不一致: start={start_vid} {direction}"
+            )
+    assert total > 0, "测试图中没有环"
+    print("\n✓ 完整枚举测试通过")
+
+
+def _check_scc(graph: MemGraph, index: scc.SccIndex) -> None:
+    """增量维护的分量索引与重新计算的一致,且分量间的边都从 rank 小的指向 rank 大的。"""
+    fresh = scc.SccIndex(graph)
+    alive = [vi for vi in range(len(graph.vids)) if graph.v_alive[vi]]
+
+    def partition(ix):
+        groups = {}
+        for vi in alive:
+            groups.setdefault(ix.comp[vi], set()).add(vi)
+        return sorted(sorted(group) for group in groups.values())
+
+    assert partition(index) == partition(fresh), "增量维护的分量与重新计算的不一致"
+    for ei in range(len(graph.eids)):
+        if graph.e_alive[ei]:
+            a, b = index.comp[graph.src[ei]], index.comp[graph.dst[ei]]
+            assert a == b or index.rank[a] < index.rank[b], "分量间的边违反拓扑序"
+    for vi in alive:
+        assert index.on_cycle(vi) == fresh.on_cycle(vi), "on_cycle 与重新计算的不一致"
+        assert index.component_size(vi) == fresh.component_size(vi), "分量大小与重新计算的不一致"
+
+
+def test_scc_incremental():
+    """随机插入点和边后,Pearce-Kelly 增量维护的分量索引与完整 Tarjan 一致。"""
+    for seed in range(3):
+        # 从稀疏图开始,多数边从小 vid 指向大 vid,分量随插入逐步合并
+        graph = random_graph("mem_scc", 80, 20, seed=20 + seed)
+        rnd = random.Random(seed)
+        scc.get_index(graph)
+        next_id = 100000
+        for step in range(400):
+            if step == 200:
+                graph = graph.copy()
+            vids = sorted(graph.index)
+            op = rnd.random()
+            next_id += 1
+            if op < 0.88:
+                a, b = rnd.choice(vids), rnd.choice(vids)
+                if rnd.random() < 0.85 and a > b:
+                    a, b = b, a
+                graph.insert_edge(Edge(next_id, a, b, 1, rnd.randint(1, 1000), "x"))
+                assert graph.scc_index is not None, "插入边后分量索引被丢弃"
+            elif op < 0.98:
+                graph.insert_vertex(Vertex(next_id, "a", 1, 0))
+                assert graph.scc_index is not None, "插入点后分量索引被丢弃"
+            else:
+                # 删除可能拆分分量,索引被丢弃后重新计算
+                eids = [graph.eids[ei] for ei in range(len(graph.eids)) if graph.e_alive[ei]]
+                graph.delete_edge(rnd.choice(eids))
+                assert graph.scc_index is None, "删除边后应丢弃分量索引"
+            _check_scc(graph, scc.get_index(graph))
+        assert scc.get_index(graph).summary()["cyclic_components"] > 0, "没有形成环"
+    print("\n✓ 增量分量测试通过")
+
+
+def test_scc_short_circuit():
+    """分量索引已构建时,不满足过滤条件或不在环上的起点直接返回,结果与引擎一致并带 meta。"""
+    graph = random_graph("mem_short", 60, 70, seed=23)
+    install(graph)
+    index = scc.get_index(graph)
+    acyclic = [vid for vid in sorted(graph.index) if not index.on_cycle(graph.vertex_index(vid))]
+    by_type = {t: [vid for vid in acyclic if graph.get_vertex(vid).v_type == t] for t in "ab"}
+    assert by_type["a"] and by_type["b"], "测试图中没有不在环上的点"
+
+    for start_vid, v_types, message in (
+        (by_type["a"][0], None, "Start vertex is not on any cycle"),
+        (by_type["a"][0], ["b"], "Start vertex does not match filters"),
+    ):
+        kwargs = {"engine": "enum", "vertex_filter_v_type": v_types}
+        result = graph_service.query_cycles("mem_short", start_vid, 5, **kwargs)
+        assert result["message"] == message and result["found"] is False, result
+        assert result["meta"]["plan"]["engine"] == "enum" and "execution_time_ms" in result["meta"]
+        engine_result = cycle_enum.query_cycles(start_vid, 5, "mem_short", "forward", v_types)
+        assert engine_result["message"] == message, engine_result
+    print("\n✓ 分量索引短路测试通过")
+
+
+def test_snapshot_round_trip():
+    """快照写入再读出的图与原图一致,按数据库区分文件,损坏的文件被拒绝。"""
+    graph = random_graph("mem_snapshot", 40, 300, seed=9)
+    graph.insert_vertex(Vertex(1000, "储蓄", 1, 50))
+    rnd = random.Random(10)
+    for i in range(100):
+        graph.insert_edge(Edge(100000 + i, rnd.randint(1, 40), rnd.choice([rnd.randint(1, 40), 1000]), 5, rnd.randint(1, 1000), "转账"))
+    for eid in rnd.sample(range(1, 300), 40):
+        if graph.edge_index(eid) is not None:
+            graph.delete_edge(eid)
+    graph.update_edge(100001, amount=7, occur_time=5)
+    graph.delete_vertex(2)
+    before = graph_state(graph)
+
+    saved = snapshot.SNAPSHOT_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot.SNAPSHOT_DIR = tmp
+        try:
+            db = {"host": "h1", "port": 1, "dbname": "d1"}
+            path = snapshot.write_snapshot(graph, 42, **db)
+            assert path == snapshot.snapshot_path("mem_snapshot", **db)
+            other = snapshot.write_snapshot(graph, 7, **dict(db, dbname="d2"))
+            assert other != path, "不同数据库的快照应写入不同文件"
+
+            loaded, log_seq = snapshot.read_snapshot(path)
+            assert log_seq == 42 and snapshot.read_snapshot(other)[1] == 7
+            assert loaded.username == "mem_snapshot"
+            assert graph_state(graph) == before, "写入快照改变了图的内容"
+            assert graph_state(loaded) == before, "读出的图与写入的不一致"
+            for name, _ in snapshot._COLUMNS:
+                assert getattr(loaded, name) == getattr(graph, name), f"列 {name} 不一致"
+            assert loaded.index == graph.index
+            assert (loaded.base_vertices, loaded.base_edges) == (graph.base_vertices, graph.base_edges)
+
+            # 读出的图可以继续修补
+            for g in (graph, loaded):
+                g.insert_edge(Edge(200000, 1, 1000, 3, 999, "转账"))
+                g.delete_edge(100002)
+                g.update_vertex(1000, balance=0)
+            assert graph_state(loaded) == graph_state(graph), "读出的图修补后与原图不一致"
+
+            with open(path, "rb") as f:
+                data = f.read()
+            for broken in (data[: len(data) // 2], b"NOTASNAP" + data[8:]):
+                with open(path, "wb") as f:
+                    f.write(broken)
+                try:
+                    snapshot.read_snapshot(path)
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError("损坏的快照没有被拒绝")
+        finally:
+            snapshot.SNAPSHOT_DIR = saved
+    print("\n✓ 快照测试通过")
+
+
+def _cycle_score(edges: list, order_by: str):
+    """按边字典列表计算环的得分。"""
+    if order_by == "total_amount":
+        return sum(e["amount"] for e in edges)
+    if order_by == "min_amount":
+        return min(e["amount"] for e in edges)
+    times = [e["occur_time"] for e in edges]
+    return max(times) - min(times)
+
+
+def test_cycle_topk():
+    """最优优先搜索按得分顺序产出全部的环,与朴素 DFS 排序后的结果一致,取前几个时少展开分支。"""
+    graph = random_graph("mem_topk", 30, 200, seed=11)
+    install(graph)
+    expanded_top = expanded_all = 0
+    for start_vid in range(1, 31):
+        start = graph.vertex_index(start_vid)
+        for direction, depth in (("forward", 5), ("any", 4)):
+            temporal = direction == "forward"
+            for allow_duplicate_vertices in (False, True):
+                expected = brute_cycles(graph, start_vid, depth, temporal, None, allow_duplicate_vertices)
+                edges = {eids: [graph.edge(graph.edge_index(eid)).to_dict() for eid in eids] for eids in expected}
+                for order_by in cycle_topk.ORDER_BY:
+                    stats = {"expanded": 0}
+                    got = []
+                    for score, path in cycle_topk.iter_best_cycles(
+                        graph, start, depth, direction, None, order_by, allow_duplicate_vertices, False, None, stats
+                    ):
+                        eids = tuple(graph.eids[ei] for ei in path)
+                        assert eids in expected, f"产出了不合法的环: start={start_vid} {direction}"
+                        assert score == _cycle_score(edges[eids], order_by), "得分计算错误"
+                        got.append(score)
+                    scores = sorted(
+                        (_cycle_score(e, order_by) for e in edges.values()),
+                        reverse=order_by != "duration",
+                    )
+                    assert got == scores, f"产出顺序与朴素 DFS 排序后不一致: start={start_vid} {direction} {order_by}"
+                    expanded_all += stats["expanded"]
+
+                    top = {"expanded": 0}
+                    best = cycle_topk.iter_best_cycles(
+                        graph, start, depth, direction, None, order_by, allow_duplicate_vertices, False, None, top
+                    )
+                    assert [score for score, _ in islice(best, 3)] == scores[:3]
+                    expanded_top += top["expanded"]
+    assert expanded_all > 0, "测试图中没有环"
+    assert expanded_top < expanded_all / 2, f"取前 3 个时没有剪枝: {expanded_top} / {expanded_all}"
+
+    for start_vid in range(1, 31):
+        for filters, edge_ok in _filter_cases(graph):
+            expected = brute_cycles(graph, start_vid, 5, True, edge_ok)
+            scores = sorted((sum(graph.edge(graph.edge_index(eid)).amount for eid in eids) for eids in expected), reverse=True)
+            result = cycle_topk.query_cycles(start_vid, 5, "mem_topk", "forward", limit=5, **filters)
+            assert result["status"] == "success", result
+            data = result.get("data", [])
+            assert [cycle["score"] for cycle in data] == scores[:5], f"top-k 结果不一致: start={start_vid} {filters}"
+            assert all(tuple(e["eid"] for e in cycle["edges"]) in expected for cycle in data)
+            if data:
+                assert result["meta"]["complete"] == (len(expected) < 5)
+    print("\n✓ top-k 测试通过")
+
+
+def _scan(username: str, workers: int, **kwargs) -> tuple:
+    cycles, summary = [], None
+    for item in cycle_scan.scan_cycles(username, 5, workers=workers, **kwargs):
+        if item["type"] == "cycle":
+            cycles.append(tuple(edge["eid"] for edge in item["edges"]))
+        elif item["type"] == "summary":
+            summary = item
+    assert summary["status"] == "success", summary
+    return cycles, summary
+
+
+def test_scan_processes():
+    """多进程扫描(工作进程加载导出的图,包括未压缩的增量边)与单进程扫描结果一致。"""
+    graph = random_graph("mem_scan", 60, 240, seed=13)
+    install(graph)
+    _apply_patches("mem_scan", random.Random(13), 40, 10000)
+    assert graph_cache.peek_graph("mem_scan")._extra_out, "没有产生增量边"
+
+    for direction in ("forward", "any"):
+        for filters in ({}, {"edge_filter_min_amount": 30}):
+            single, summary = _scan("mem_scan", 1, direction=direction, **filters)
+            multi, multi_summary = _scan("mem_scan", 3, direction=direction, **filters)
+            assert single, f"测试图中没有环: {direction} {filters}"
+            assert len(multi) == len(set(multi)), "多进程扫描重复报告了环"
+            assert sorted(multi) == sorted(single), f"多进程扫描结果不一致: {direction} {filters}"
+            assert multi_summary["done"] == summary["done"] == summary["starts"]
+
+    cycles, summary = _scan("mem_scan", 3, direction="any", limit=5)
+    assert len(cycles) == 5 and summary["truncated"]
+    print("\n✓ 多进程扫描测试通过")
+
+
+def _batch(username: str, workers: int, **kwargs) -> dict:
+    results = {}
+    for result in graph_service.iter_cycles_batch(username, list(range(1, 61)), 5, workers=workers, **kwargs):
+        assert result["status"] == "success", result
+        result.pop("meta", None)
+        results[result.pop("start_vid")] = result
+    return results
+
+
+def test_batch_processes():
+    """内存引擎的批量查询在工作进程中执行,结果与在当前线程中顺序执行一致。"""
+    graph = random_graph("mem_batch", 60, 240, seed=17)
+    install(graph)
+    for kwargs in (
+        {"engine": "membibfs"},
+        {"engine": "enum", "direction": "any", "limit": 1000},
+        {"engine": "enum", "edge_filter_min_amount": 30},
+        {"engine": "enum", "order_by": "total_amount", "limit": 3},
+    ):
+        single = _batch("mem_batch", 1, **kwargs)
+        assert any(r.get("found") for r in single.values()), f"测试图中没有环: {kwargs}"
+        assert _batch("mem_batch", 3, **kwargs) == single, f"多进程批量查询结果不一致: {kwargs}"
+    print("\n✓ 多进程批量查询测试通过")
+
+
+def main():
+    """运行所有测试。"""
+    tests = [name for name in globals() if name.startswith("test_")]
+    for name in tests:
+        globals()[name]()
+    print(f"\n✓ 全部 {len(tests)} 项测试通过")
+
+
+if __name__ == "__main__":
+    main()